@@ -1,6 +1,6 @@
 import json, boto3
 import brevitycore.core
-import digitalocean
+import brevityoperations.droplet
 
 def lambda_handler(event, context):
     
@@ -9,12 +9,15 @@ def lambda_handler(event, context):
     regionName = 'us-east-1'
     accessToken = brevitycore.core.get_secret(secretName,regionName)
     
-    manager = digitalocean.Manager(token=accessToken)
-    my_droplets = manager.get_all_droplets()
+    # Run once with {"tagLegacy": true} to tag the brevity- droplets created before tagging was added
+    if event.get('tagLegacy'):
+        print(brevityoperations.droplet.tagLegacyDroplets(accessToken))
+    
+    # Only the droplets tagged by brevity are listed, so the call does not grow with unrelated droplets in the account
+    my_droplets = brevityoperations.droplet.getDropletsByTag(accessToken, useCache=False)
     for dropletvalue in my_droplets:
         dropletState = dropletvalue.status
         dropletName = dropletvalue.name
-        # It would be smart to add a filter in this for the future to validate droplet naming convention as well in case there is a droplet that should not be deleted when shutdown.
         if dropletState == 'off':
             if dropletName.startswith('brevity-'):
                 dropletvalue.destroy()
@@ -1,36 +1,68 @@
 # This Lambda is still under development.
 
 import json, boto3, os
+import brevityprogram.sonar
 
 def lambda_handler(event, context):
     
     import boto3
+    
+    def _getParameters(paramName):
+        client = boto3.client('ssm')
+        response = client.get_parameter(
+            Name=paramName
+        )
+        return response['Parameter']['Value']
 
+    # Regular runs only crawl newly added folders, which Glue only allows with schema changes logged rather than applied.
+    # A run with {"fullCrawl": true} (for example a weekly schedule) recrawls everything and applies the schema changes to the catalog.
+    if event.get('fullCrawl'):
+        recrawlPolicy = {'RecrawlBehavior': 'CRAWL_EVERYTHING'}
+        schemaChangePolicy = {'UpdateBehavior': 'UPDATE_IN_DATABASE', 'DeleteBehavior': 'DELETE_FROM_DATABASE'}
+    else:
+        recrawlPolicy = {'RecrawlBehavior': 'CRAWL_NEW_FOLDERS_ONLY'}
+        schemaChangePolicy = {'UpdateBehavior': 'LOG', 'DeleteBehavior': 'LOG'}
     client = boto3.client('glue')
-    response = client.create_crawler(
-        Name='brevity-httpx-recon',
-        Role='AWSGlueServiceRole-brevity',
-        DatabaseName='brevity-analysis',
-        Description='HTTPX json recon crawler',
-        TablePrefix='brevity_',
-        Targets={
-            'S3Targets': [
-                {
-                    'Path': 's3://brevity-data/presentation/httpx-json/',
-                    'Exclusions': [
-                    ]
-                },
-            ]
-        },
-        SchemaChangePolicy={
-            'UpdateBehavior': 'UPDATE_IN_DATABASE',
-            'DeleteBehavior': 'DELETE_FROM_DATABASE'
-        }
-    )
+    try:
+        response = client.create_crawler(
+            Name='brevity-httpx-recon',
+            Role='AWSGlueServiceRole-brevity',
+            DatabaseName='brevity-analysis',
+            Description='HTTPX json recon crawler',
+            TablePrefix='brevity_',
+            Targets={
+                'S3Targets': [
+                    {
+                        'Path': 's3://brevity-data/presentation/httpx-json/',
+                        'Exclusions': [
+                        ]
+                    },
+                ]
+            },
+            RecrawlPolicy=recrawlPolicy,
+            SchemaChangePolicy=schemaChangePolicy
+        )
+    except client.exceptions.AlreadyExistsException:
+        # A running crawler keeps its current policy until the next run
+        try:
+            response = client.update_crawler(
+                Name='brevity-httpx-recon',
+                RecrawlPolicy=recrawlPolicy,
+                SchemaChangePolicy=schemaChangePolicy
+            )
+        except client.exceptions.CrawlerRunningException:
+            print('Crawler running, policy not updated')
 
-    response = client.start_crawler(
-        Name='httpx-json'
-    )
+    # The httpx-json and brevity-httpx crawlers keep their own configuration and are started as before
+    lstCrawlerStatus = []
+    for crawlerName in ['brevity-httpx-recon', 'httpx-json', 'brevity-httpx']:
+        try:
+            client.start_crawler(
+                Name=crawlerName
+            )
+            lstCrawlerStatus.append(crawlerName + ' started')
+        except client.exceptions.CrawlerRunningException:
+            lstCrawlerStatus.append(crawlerName + ' already running')
 
     response = client.update_table(
         DatabaseName='brevity-analysis',
@@ -46,14 +78,30 @@ def lambda_handler(event, context):
         }
     )
     
-    client = boto3.client('glue')
-    response = client.start_crawler(
-        Name='brevity-httpx'
-    )
+    # Register the FDNS date partitions that arrived since the last run, so the Sonar queries and the reversed table load see the latest date
+    ATHENA_DB = _getParameters('ATHENA_DB')
+    ATHENA_TABLE = _getParameters('ATHENA_TABLE')
+    lstSonarPartitions = brevityprogram.sonar.updateSonarPartitions(ATHENA_DB, _getParameters('ATHENA_BUCKET'), ATHENA_TABLE)
+    print('Registered ' + str(len(lstSonarPartitions)) + ' new Sonar partitions.')
+    
+    # Sonar reversed hostname table used by brevityprogram.sonar for prefix range scans, only on deployments that have configured it
+    try:
+        ATHENA_REVERSED_TABLE = _getParameters('ATHENA_REVERSED_TABLE')
+        ATHENA_REVERSED_PATH = _getParameters('ATHENA_REVERSED_PATH')
+    except boto3.client('ssm').exceptions.ParameterNotFound:
+        ATHENA_REVERSED_TABLE = None
+    if ATHENA_REVERSED_TABLE is not None:
+        sonarStatus = brevityprogram.sonar.sonarPrepareReversedTable(ATHENA_DB, _getParameters('ATHENA_BUCKET'), ATHENA_TABLE, ATHENA_REVERSED_TABLE, ATHENA_REVERSED_PATH)
+    else:
+        sonarStatus = 'No reversed Sonar table configured'
+    print(sonarStatus)
     
     responseData = {
         'Program Status': 'Success',
-        'Operation Status': response
+        'Operation Status': str(response),
+        'Crawler Status': lstCrawlerStatus,
+        'Sonar Partitions': len(lstSonarPartitions),
+        'Sonar Status': sonarStatus
     }
     
     return {
@@ -2,8 +2,7 @@ import json, boto3, os, re
 import urllib.parse
 import brevityprogram.gospider
 import brevityprogram.programs
-import brevitycore.core
-import brevityoperations.droplet
+import brevityoperations.pool
 import brevityscope.process
 
 def lambda_handler(event, context):
@@ -38,32 +37,11 @@ def lambda_handler(event, context):
     stepFunctionsStatus = brevityprogram.programs.generateScriptStepFunctions(programName, inputBucketName, taskToken, operationName)
     
     runOperation = 'crawl'
-    dropletName = 'brevity-' + runOperation + '-' + programName
-    #print(dropletName)
-    
-    #runOperation = 'httpx'
-    secretName = 'digitalocean'
-    regionName = 'us-east-1'
-    #secretDesc = 'API access token for Digital Ocean'
-
-    accessToken = brevitycore.core.get_secret(secretName,regionName)
-    
-    secretName = 'brevity-aws-recon'
-    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
-    secretjson = json.loads(secretRetrieved)
-    awsAccessKeyId = secretjson['AWS_ACCESS_KEY_ID']
-    awsSecretKey = secretjson['AWS_SECRET_ACCESS_KEY']
-    
-    droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    if droplet == 'NotFound':
-        droplet = brevityoperations.droplet.createDroplet(accessToken,dropletName,runOperation,programName,awsAccessKeyId,awsSecretKey)
-        dropletStatus = brevityoperations.droplet.getDropletStatus(droplet)
-    droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    # Take the droplet information and retrieve the IP address for the connection string
-    dropletConnection = brevityoperations.droplet.retrieveDropletConnection(accessToken,dropletName)
+    # Queue the job for the warm worker pool instead of creating a droplet for this program and operation
+    poolStatus = brevityoperations.pool.submitPoolJob(programName,runOperation,inputBucketName)
     
     responseData = {
-        'Droplet Connection': str(dropletConnection),
+        'Worker Pool': poolStatus,
     }
     
     return {
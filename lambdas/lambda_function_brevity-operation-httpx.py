@@ -1,9 +1,9 @@
 import json, boto3, os, re
-import brevitycore.core
 import urllib.parse
 import brevityprogram.programs
 import brevityprogram.httpx
-import brevityoperations.droplet
+import brevityscope.parser
+import brevityoperations.pool
 
 def lambda_handler(event, context):
     
@@ -28,45 +28,34 @@ def lambda_handler(event, context):
     
     #fileName = 's3://' + inputBucketName + '/programs/' + programName + '/' + programName + '-domains-new.csv'
     if (operationName == 'initial'):
-        fileName = programName + '-domains-new.txt'
+        # Probe only the newly discovered domains plus the stale hosts, unless a full pass over every domain is requested
+        if event.get('full'):
+            fileName = programName + '-domains-all.txt'
+        else:
+            refinedBucketPath = _getParameters('refinedBucketPath')
+            programInputBucketPath = _getParameters('programInputBucketPath')
+            probeStatus = brevityscope.parser.storeProbeDomains(programName, refinedBucketPath, programInputBucketPath)
+            print(probeStatus)
+            fileName = programName + '-domains-probe.txt'
     else:
         fileName = programName + '-urls-base.txt'
     
-    httpxStatus = brevityprogram.httpx.prepareHttpx(programName, inputBucketName, fileName)
+    # Optional number of shards to split the httpx input across pooled workers
+    shardCount = int(event.get('shards') or 1)
+    if shardCount > 1:
+        lstOperations = brevityprogram.httpx.prepareHttpxShards(programName, inputBucketName, fileName, shardCount)
+    else:
+        httpxStatus = brevityprogram.httpx.prepareHttpx(programName, inputBucketName, fileName)
+        lstOperations = ['httpx']
     # Create installation file (bounty-startup-httpx.sh) to run on ephemeral server at startup
     installScriptStatus = brevityprogram.httpx.generateInstallScriptHttpx(inputBucketName)
     stepFunctionsStatus = brevityprogram.programs.generateScriptStepFunctions(programName, inputBucketName, taskToken, operationName)
     
-    runOperation = 'httpx'
-    dropletName = 'brevity-' + runOperation + '-' + programName
-    #print(dropletName)
-    
-    #runOperation = 'httpx'
-    secretName = 'digitalocean'
-    regionName = 'us-east-1'
-    #secretDesc = 'API access token for Digital Ocean'
-
-    accessToken = brevitycore.core.get_secret(secretName,regionName)
-    
-    secretName = 'brevity-aws-recon'
-    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
-    secretjson = json.loads(secretRetrieved)
-    awsAccessKeyId = secretjson['AWS_ACCESS_KEY_ID']
-    awsSecretKey = secretjson['AWS_SECRET_ACCESS_KEY']
-    
-    try:
-        droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    except:
-        droplet = 'NotFound'
-    if droplet == 'NotFound':
-        droplet = brevityoperations.droplet.createDroplet(accessToken,dropletName,runOperation,programName,awsAccessKeyId,awsSecretKey)
-        dropletStatus = brevityoperations.droplet.getDropletStatus(droplet)
-    droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    # Take the droplet information and retrieve the IP address for the connection string
-    dropletConnection = brevityoperations.droplet.retrieveDropletConnection(accessToken,dropletName)
+    # Queue the job (or one job per shard) for the warm worker pool instead of creating a droplet for this program and operation
+    poolStatus = brevityoperations.pool.submitPoolJobs(programName,lstOperations,inputBucketName)
     
     responseData = {
-        'Droplet Connection': str(dropletConnection),
+        'Worker Pool': poolStatus,
     }
     
     return {
@@ -0,0 +1,53 @@
+# Test event
+#{
+#  "stage": "build",
+#  "platform": "droplet"
+#}
+
+import json, boto3
+import brevitycore.core
+import brevityoperations.image
+
+def lambda_handler(event, context):
+    
+    def _getParameters(paramName):
+        client = boto3.client('ssm')
+        response = client.get_parameter(
+            Name=paramName
+        )
+        return response['Parameter']['Value']
+    
+    inputBucketName = _getParameters('inputBucketName')
+    
+    # build launches the image builders, snapshot is called again (for example after a step functions wait state) until both report Complete.
+    # Failed means the install script did not finish, the builder is kept for inspection and has to be removed before the next build
+    imageStage = str(event.get('stage') or 'build')
+    lstPlatforms = [str(event['platform'])] if event.get('platform') else ['droplet', 'ec2']
+    
+    secretName = 'digitalocean'
+    regionName = 'us-east-1'
+    accessToken = brevitycore.core.get_secret(secretName,regionName)
+    
+    secretName = 'brevity-aws-recon'
+    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
+    secretjson = json.loads(secretRetrieved)
+    awsAccessKeyId = secretjson['AWS_ACCESS_KEY_ID']
+    awsSecretKey = secretjson['AWS_SECRET_ACCESS_KEY']
+    
+    responseData = {'Toolchain': brevityoperations.image.toolchainName()}
+    if 'droplet' in lstPlatforms:
+        if imageStage == 'build':
+            responseData['Droplet'] = brevityoperations.image.startDropletImageBuild(accessToken,inputBucketName,awsAccessKeyId,awsSecretKey)
+        else:
+            responseData['Droplet'] = brevityoperations.image.snapshotDropletImage(accessToken)
+    if 'ec2' in lstPlatforms:
+        if imageStage == 'build':
+            responseData['EC2'] = brevityoperations.image.startEC2ImageBuild(inputBucketName)
+        else:
+            responseData['EC2'] = brevityoperations.image.snapshotEC2Image()
+    
+    return {
+        'statusCode': 200,
+        'stage': imageStage,
+        'body': json.dumps(responseData)
+    }
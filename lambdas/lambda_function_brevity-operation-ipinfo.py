@@ -1,9 +1,11 @@
 import pandas as pd
 import boto3
 import requests
-import io
+import io, json, datetime
+from concurrent.futures import ThreadPoolExecutor
 from requests.structures import CaseInsensitiveDict
-from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import brevityprogram.ipinfo
 
 def lambda_handler(event, context):
     
@@ -16,23 +18,112 @@ def lambda_handler(event, context):
     
     dashboardBucketName = _getParameters('dataBucketName')
     
-    def query_dns(dynamodb=None):
-        if not dynamodb:
-            dynamodb = boto3.resource('dynamodb')
-
-        table = dynamodb.Table('brevity_ipinfo')
-        response = table.scan(
-            Limit=100
-        )
-        return response['Items']
-
-    # Retrieve DNS entries from DynamoDB
-    dnsResults = query_dns()
-    # Load results into Pandas DataFrame
-    dfDNS = pd.DataFrame(dnsResults)
-    # Convert IP addresses column into a list
-    ipList = dfDNS["ipinfo_ip"].tolist()
-
+    # The aggregate, distinct IP list and watermark are kept in the data bucket so each run only folds in the records added since the previous run
+    aggregateKey = 'dashboard/dns/dns-aggregate.csv'
+    ipListKey = 'dashboard/dns/dns-ips.txt'
+    watermarkKey = 'dashboard/dns/dns-watermark.txt'
+    mapUrlKey = 'dashboard/dns/dns-map-url.txt'
+    aggregateColumns = ['timebucket', 'ipinfo_country', 'ipinfo_org', 'dns_queryname']
+    totalSegments = 8
+    
+    s3client = boto3.client('s3')
+    
+    def retrieve_object(bucketName, objectKey):
+        try:
+            s3Object = s3client.get_object(Bucket=bucketName, Key=objectKey)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise e
+        return s3Object['Body'].read().decode('utf-8')
+    
+    # Scan one segment of the table with pagination. Only the fields needed for the aggregate are returned.
+    # The full scan is only used for the first run, which also counts the records written before the ingested attributes were added.
+    def scan_segment(segment):
+        dynamodbclient = boto3.client('dynamodb')
+        paginator = dynamodbclient.get_paginator('scan')
+        scanArgs = {
+            'TableName': 'brevity_ipinfo',
+            'Segment': segment,
+            'TotalSegments': totalSegments,
+            'ProjectionExpression': '#ts, ipinfo_ip, ipinfo_country, ipinfo_org, dns_queryname',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'FilterExpression': 'attribute_not_exists(ingested) OR ingested <= :newwatermark',
+            'ExpressionAttributeValues': {':newwatermark': {'S': newWatermark}}
+        }
+        lstItems = []
+        for page in paginator.paginate(**scanArgs):
+            for item in page['Items']:
+                lstItems.append({key: value.get('S', '') for key, value in item.items()})
+        return lstItems
+    
+    # Query one ingestion hour shard through the ingested_hour index, so a run only reads the records written since the watermark rather than the whole table.
+    # Records are selected by when they were ingested so late arriving log events are still counted exactly once.
+    def query_hour(ingestedHourKey, watermark):
+        dynamodbclient = boto3.client('dynamodb')
+        paginator = dynamodbclient.get_paginator('query')
+        queryArgs = {
+            'TableName': 'brevity_ipinfo',
+            'IndexName': brevityprogram.ipinfo.IPINFO_INGESTED_INDEX,
+            'KeyConditionExpression': 'ingested_hour = :hour AND ingested BETWEEN :watermark AND :newwatermark',
+            'ProjectionExpression': '#ts, ingested, ipinfo_ip, ipinfo_country, ipinfo_org, dns_queryname',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'ExpressionAttributeValues': {':hour': {'S': ingestedHourKey}, ':watermark': {'S': watermark}, ':newwatermark': {'S': newWatermark}}
+        }
+        lstItems = []
+        for page in paginator.paginate(**queryArgs):
+            for item in page['Items']:
+                # BETWEEN is inclusive, the records at the old watermark were counted by the previous run
+                if item['ingested']['S'] != watermark:
+                    lstItems.append({key: value.get('S', '') for key, value in item.items()})
+        return lstItems
+    
+    # Retrieve DNS entries added since the watermark from DynamoDB, parallel index queries for each shard of each ingestion hour or a parallel segmented scan on the first run
+    def query_dns(watermark):
+        with ThreadPoolExecutor(max_workers=totalSegments) as executor:
+            if watermark:
+                lstHourKeys = brevityprogram.ipinfo.ingestedHourKeys(watermark, newWatermark)
+                queryResults = executor.map(lambda ingestedHourKey: query_hour(ingestedHourKey, watermark), lstHourKeys)
+            else:
+                queryResults = executor.map(scan_segment, range(totalSegments))
+        dnsResults = []
+        for lstItems in queryResults:
+            dnsResults += lstItems
+        return dnsResults
+    
+    watermark = retrieve_object(dashboardBucketName, watermarkKey)
+    # The new watermark trails the current time so records still being written by the Route53 Lambda are picked up on the next run
+    newWatermark = (datetime.datetime.utcnow() - datetime.timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    dnsResults = query_dns(watermark)
+    if not dnsResults:
+        s3client.put_object(Body=newWatermark.encode(), Bucket=dashboardBucketName, Key=watermarkKey)
+        return {
+            'statusCode': 200,
+            'body': json.dumps('No new DNS records')
+        }
+    
+    # Load results into Pandas DataFrame and bucket the timestamps by hour (2021-05-01T13)
+    dfDNS = pd.DataFrame(dnsResults).reindex(columns=['timestamp', 'ipinfo_ip', 'ipinfo_country', 'ipinfo_org', 'dns_queryname']).fillna('')
+    dfDNS['timebucket'] = dfDNS['timestamp'].str[:13]
+    dfNewAggregate = dfDNS.groupby(aggregateColumns).size().reset_index(name='queries')
+    
+    # Merge the new counts into the existing aggregate
+    aggregateData = retrieve_object(dashboardBucketName, aggregateKey)
+    if aggregateData:
+        dfAggregate = pd.read_csv(io.StringIO(aggregateData), dtype={'queries': 'int64'}, keep_default_na=False)
+        dfAggregate = dfAggregate.append(dfNewAggregate)
+        dfAggregate = dfAggregate.groupby(aggregateColumns, as_index=False)['queries'].sum()
+    else:
+        dfAggregate = dfNewAggregate
+    
+    ipData = retrieve_object(dashboardBucketName, ipListKey)
+    setIPs = set(ipData.split('\n')) if ipData else set()
+    setNewIPs = set(dfDNS['ipinfo_ip'].tolist()) - setIPs
+    setNewIPs.discard('')
+    setIPs.update(setNewIPs)
+    setIPs.discard('')
+    ipList = sorted(setIPs)
+    
     # Retrieves the IPInfo Map URL
     def query_ipinfo(ipList):    
         headers = CaseInsensitiveDict()    
@@ -44,22 +135,37 @@ def lambda_handler(event, context):
         mapUrl = response['reportUrl']
         return mapUrl
 
-    mapUrl = query_ipinfo(ipList)
+    # Only the addresses first seen in this run are mapped, the previous map is kept when there are none
+    mapUrl = retrieve_object(dashboardBucketName, mapUrlKey)
+    if setNewIPs or not mapUrl:
+        mapUrl = query_ipinfo(sorted(setNewIPs) or ipList)
+    
+    # Only summary tables of the aggregate are rendered, so the page size does not grow with the number of DNS records
+    def generate_summary_html(dfAggregate, summaryColumn, summaryTitle):
+        dfSummary = dfAggregate.groupby(summaryColumn)['queries'].sum().sort_values(ascending=False).head(50)
+        summaryhtml = f"""<h2>{summaryTitle}</h2>
+        """
+        summaryhtml += dfSummary.reset_index().to_html(index=False)
+        return summaryhtml
 
-    def generate_dns_html(dfDNS, mapUrl):
+    def generate_dns_html(dfAggregate, mapUrl):
         resphtml = f"""<html>
         <title>Brevity In Motion - DNS Tracker</title>
         <body>
-        <a href="{mapUrl}">IPInfo Map</a>
+        <a href="{mapUrl}">IPInfo Map (new addresses)</a>
+        <p>Total queries: {int(dfAggregate['queries'].sum())}</p>
         """
-        resphtml += dfDNS.to_html()
+        resphtml += generate_summary_html(dfAggregate, 'timebucket', 'Queries by hour')
+        resphtml += generate_summary_html(dfAggregate, 'ipinfo_country', 'Queries by country')
+        resphtml += generate_summary_html(dfAggregate, 'ipinfo_org', 'Queries by organization')
+        resphtml += generate_summary_html(dfAggregate, 'dns_queryname', 'Queries by name')
         resphtml += f"""
         </body>
         </html>
         """
         return resphtml
 
-    resphtml = generate_dns_html(dfDNS, mapUrl)
+    resphtml = generate_dns_html(dfAggregate, mapUrl)
 
     def upload_html(resphtml):
         filebuffer = io.BytesIO(resphtml.encode())
@@ -71,6 +177,12 @@ def lambda_handler(event, context):
         return response
 
     response = upload_html(resphtml)
+    
+    # Store the aggregate state and move the watermark forward only after the dashboard is published
+    s3client.put_object(Body=dfAggregate.to_csv(index=False).encode(), Bucket=dashboardBucketName, Key=aggregateKey)
+    s3client.put_object(Body='\n'.join(ipList).encode(), Bucket=dashboardBucketName, Key=ipListKey)
+    s3client.put_object(Body=mapUrl.encode(), Bucket=dashboardBucketName, Key=mapUrlKey)
+    s3client.put_object(Body=newWatermark.encode(), Bucket=dashboardBucketName, Key=watermarkKey)
    
     return {
         'statusCode': 200
@@ -57,14 +57,14 @@ def lambda_handler(event, context):
     
     droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
     if droplet == 'NotFound':
+        # Return without waiting for the droplet to boot, it writes its booted marker (with the IP address) once it is ready
         droplet = brevityoperations.droplet.createDropletManual(accessToken,dropletName,operationName,programName,awsAccessKeyId,awsSecretKey)
-        dropletStatus = brevityoperations.droplet.getDropletStatus(droplet)
-    droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    # Take the droplet information and retrieve the IP address for the connection string
+    # Take the droplet information and retrieve the IP address for the connection string (Pending until the droplet has an address)
     dropletConnection = brevityoperations.droplet.retrieveDropletConnection(accessToken,dropletName)
     
     responseData = {
         'Droplet Connection': str(dropletConnection),
+        'Ready Marker': 's3://' + brevityoperations.droplet.READY_BUCKET + '/' + brevityoperations.droplet.readyMarkerPath(dropletName,'booted'),
     }
     
     return {
@@ -1,10 +1,9 @@
 import json, boto3, os, re
-import brevitycore.core
 import urllib.parse
 import brevityprogram.programs
 import brevityprogram.scripts
 import brevityprogram.nuclei
-import brevityoperations.droplet
+import brevityoperations.pool
 
 def lambda_handler(event, context):
     
@@ -33,28 +32,11 @@ def lambda_handler(event, context):
     stepFunctionsStatus = brevityprogram.programs.generateScriptStepFunctions(programName, inputBucketName, taskToken, operationName)
     
     runOperation = 'nuclei'
-    dropletName = 'brevity-' + runOperation + '-' + programName
-    secretName = 'digitalocean'
-    regionName = 'us-east-1'
-
-    accessToken = brevitycore.core.get_secret(secretName,regionName)
-    
-    secretName = 'brevity-aws-recon'
-    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
-    secretjson = json.loads(secretRetrieved)
-    awsAccessKeyId = secretjson['AWS_ACCESS_KEY_ID']
-    awsSecretKey = secretjson['AWS_SECRET_ACCESS_KEY']
-    
-    droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    if droplet == 'NotFound':
-        droplet = brevityoperations.droplet.createDroplet(accessToken,dropletName,runOperation,programName,awsAccessKeyId,awsSecretKey)
-        dropletStatus = brevityoperations.droplet.getDropletStatus(droplet)
-    droplet = brevityoperations.droplet.loadDropletInfo(accessToken,dropletName)
-    # Take the droplet information and retrieve the IP address for the connection string
-    dropletConnection = brevityoperations.droplet.retrieveDropletConnection(accessToken,dropletName)
+    # Queue the job for the warm worker pool instead of creating a droplet for this program and operation
+    poolStatus = brevityoperations.pool.submitPoolJob(programName,runOperation,inputBucketName)
     
     responseData = {
-        'Droplet Connection': str(dropletConnection),
+        'Worker Pool': poolStatus,
     }
     
     return {
@@ -0,0 +1,52 @@
+import json, boto3
+import brevityprogram.programs
+import brevityprogram.httpx
+import brevityprogram.gospider
+import brevityscope.parser
+import brevityoperations.pipeline
+import brevityoperations.pool
+
+def lambda_handler(event, context):
+    
+    def _getParameters(paramName):
+        client = boto3.client('ssm')
+        response = client.get_parameter(
+            Name=paramName
+        )
+        return response['Parameter']['Value']
+    
+    inputBucketName = _getParameters('inputBucketName')
+    refinedBucketPath = _getParameters('refinedBucketPath')
+    programInputBucketPath = _getParameters('programInputBucketPath')
+    
+    if event['program'] is None:
+        return {"isBase64Encoded":False,"statusCode":400,"body":json.dumps({"error":"Missing program name."})}
+    
+    programName = str(event['program'])
+    taskToken = str(event['token'])
+    
+    # Same incremental probe list as the initial httpx pass
+    probeStatus = brevityscope.parser.storeProbeDomains(programName, refinedBucketPath, programInputBucketPath)
+    print(probeStatus)
+    # The worker resumes the step function once every stage is published
+    stepFunctionsStatus = brevityprogram.programs.generateScriptStepFunctions(programName, inputBucketName, taskToken, 'pipeline')
+    # Install files (bounty-startup-httpx.sh and bounty-startup-crawl.sh) for workers that did not boot from the toolchain image
+    installScriptStatus = brevityprogram.httpx.generateInstallScriptHttpx(inputBucketName)
+    installScriptStatus = brevityprogram.gospider.generateInstallScriptGoSpider(inputBucketName)
+    # resume picks up an unfinished run from its last stage checkpoint
+    runId, specStatus = brevityoperations.pipeline.preparePipeline(programName, inputBucketName, bool(event.get('resume')))
+    if not specStatus:
+        return {"isBase64Encoded":False,"statusCode":500,"body":json.dumps({"error":"Pipeline job spec upload failed.","run":runId})}
+    
+    poolStatus = brevityoperations.pool.submitPoolJob(programName,'pipeline',inputBucketName)
+    
+    responseData = {
+        'Run': runId,
+        'Worker Pool': poolStatus,
+    }
+    
+    return {
+        'statusCode': 200,
+        'program': programName,
+        'body': json.dumps(responseData)
+    }
@@ -63,13 +63,15 @@ def lambda_handler(event, context):
     if not wildcardDomains:
         storeStatus = 'No Wildcards'
     else:
-        for rootDomain in wildcardDomains:
-            # Parse the wildcard and the period from the beginning of the domain
-            rootDomain = rootDomain[1:]
-            rootDomain = rootDomain[1:]
-            lstDomains = brevityprogram.securitytrails.retrieveSecurityTrailsDomains(rootDomain)
-            if (lstDomains != 'no subdomains'):
-                storeStatus = brevityscope.parser.storeAllDomains(programName, refinedBucketPath, lstDomains, programInputBucketPath)
+        # Parse the wildcard and the period from the beginning of each domain
+        lstRootDomains = [rootDomain[2:] for rootDomain in wildcardDomains]
+        # Every root is retrieved concurrently and the results are stored with a single domain store write
+        lstDomains, rootStatus = brevityprogram.securitytrails.retrieveSecurityTrailsDomainsBatch(lstRootDomains, refinedBucketName)
+        print(rootStatus)
+        if lstDomains:
+            storeStatus = brevityscope.parser.storeAllDomains(programName, refinedBucketPath, lstDomains, programInputBucketPath)
+        else:
+            storeStatus = 'no subdomains'
     
     responseData = {
         'status': str(storeStatus),
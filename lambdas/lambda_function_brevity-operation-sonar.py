@@ -1,6 +1,7 @@
 import json, boto3, os, re
 import urllib.parse
 import brevityprogram.sonar
+import brevityprogram.sonarindex
 
 def lambda_handler(event, context):
     
@@ -17,6 +18,47 @@ def lambda_handler(event, context):
     ATHENA_BUCKET = _getParameters('ATHENA_BUCKET')
     ATHENA_DB = _getParameters('ATHENA_DB')
     ATHENA_TABLE = _getParameters('ATHENA_TABLE')
+    # The reversed hostname table is optional, without it the single program query falls back to the LIKE scan of the raw table
+    try:
+        ATHENA_REVERSED_TABLE = _getParameters('ATHENA_REVERSED_TABLE')
+    except boto3.client('ssm').exceptions.ParameterNotFound:
+        ATHENA_REVERSED_TABLE = None
+    # The local backend queries the FDNS index built with python3 -m brevityprogram.sonarindex build, on a file system mounted at sonarIndexPath
+    try:
+        sonarBackend = str(event.get('backend') or _getParameters('sonarBackend'))
+    except boto3.client('ssm').exceptions.ParameterNotFound:
+        sonarBackend = 'athena'
+    
+    # Batch mode runs one query for a list of programs, or for every program with wildcards when the list is 'all'
+    if event.get('programs') is not None:
+        lstPrograms = event['programs']
+        if lstPrograms == 'all':
+            lstPrograms = []
+        if ATHENA_REVERSED_TABLE is None:
+            return {"isBase64Encoded":False,"statusCode":400,"body":json.dumps({"error":"Batch mode requires the ATHENA_REVERSED_TABLE parameter."})}
+        ATHENA_SCOPE_TABLE = _getParameters('ATHENA_SCOPE_TABLE')
+        execid = brevityprogram.sonar.sonarBatchRun(lstPrograms, refinedBucketPath, ATHENA_DB, ATHENA_BUCKET, ATHENA_REVERSED_TABLE, ATHENA_SCOPE_TABLE)
+        if (execid == 'No Wildcards'):
+            return {
+                'statusCode': 200,
+                'operation': 'sonarbatch',
+                'body': json.dumps(execid)
+            }
+        lstResultPrograms = brevityprogram.sonar.sonarBatchRetrieveResults(execid, refinedBucketPath)
+        sonarLoadStatus = {}
+        for programName in lstResultPrograms:
+            sonarLoadStatus[programName] = brevityprogram.sonar.sonarLoadSubdomains(programName, refinedBucketPath, programInputBucketPath)
+        
+        responseData = {
+            'Status': 'Success',
+            'Programs': sonarLoadStatus
+        }
+        
+        return {
+            'statusCode': 200,
+            'operation': 'sonarbatch',
+            'body': json.dumps(responseData)
+        }
     
     if event['program'] is None:
         return {"isBase64Encoded":False,"statusCode":400,"body":json.dumps({"error":"Missing program name."})}
@@ -25,7 +67,23 @@ def lambda_handler(event, context):
     programName = str(event['program'])
     operationName = str(event['operation'])
     
-    execid = brevityprogram.sonar.sonarRun(programName,refinedBucketPath,ATHENA_DB,ATHENA_BUCKET,ATHENA_TABLE)
+    if sonarBackend == 'local':
+        try:
+            indexPath = _getParameters('sonarIndexPath')
+        except boto3.client('ssm').exceptions.ParameterNotFound:
+            indexPath = brevityprogram.sonarindex.SONAR_INDEX_PATH
+        sonarRetrieveStatus = brevityprogram.sonar.sonarRunLocal(programName, refinedBucketPath, indexPath)
+        if (sonarRetrieveStatus == 'Subdomains successfully generated'):
+            sonarLoadStatus = brevityprogram.sonar.sonarLoadSubdomains(programName, refinedBucketPath, programInputBucketPath)
+        else: sonarLoadStatus = 'No subdomains loaded'
+        return {
+            'statusCode': 200,
+            'program': programName,
+            'operation': operationName,
+            'body': json.dumps({'Status': 'Success', 'Backend': sonarBackend, 'Subdomains': sonarRetrieveStatus})
+        }
+    
+    execid = brevityprogram.sonar.sonarRun(programName,refinedBucketPath,ATHENA_DB,ATHENA_BUCKET,ATHENA_TABLE,ATHENA_REVERSED_TABLE)
     
     if (execid == 'No Wildcards'):
         return {
@@ -1,4 +1,5 @@
 import json, boto3, os
+import brevitycore.core
 
 def lambda_handler(event, context):
     
@@ -11,14 +12,27 @@ def lambda_handler(event, context):
     
     programName = str(event['program'])
     
+    # Once the table exists, a partitioned table only needs any new partitions registered. The httpx json table is not partitioned, so the crawler
+    # (which only crawls new folders) is still started for it, as it is to create the table the first time.
     client = boto3.client('glue')
-    response = client.start_crawler(
-        Name='brevity-httpx-recon'
-    )
+    try:
+        table = client.get_table(DatabaseName='brevity-analysis', Name='brevity_httpx_json')['Table']
+    except client.exceptions.EntityNotFoundException:
+        table = None
+    if table is not None and table.get('PartitionKeys'):
+        lstNewPartitions = brevitycore.core.registerNewPartitions('brevity-analysis', 'brevity_httpx_json')
+        response = 'Registered ' + str(len(lstNewPartitions)) + ' new partitions.'
+    else:
+        try:
+            response = client.start_crawler(
+                Name='brevity-httpx-recon'
+            )
+        except client.exceptions.CrawlerRunningException:
+            response = 'Crawler already running.'
     
     responseData = {
         'Program Status': 'Success',
-        'Operation Status': response
+        'Operation Status': str(response)
     }
     
     return {
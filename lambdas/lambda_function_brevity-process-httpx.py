@@ -1,7 +1,9 @@
 import json, boto3, os, re
 import brevitycore.core
 import urllib.parse
+from botocore.exceptions import ClientError
 import brevityscope.process
+import brevityscope.searchindex
 
 def lambda_handler(event, context):
     
@@ -28,9 +30,15 @@ def lambda_handler(event, context):
     programName = str(event['program'])
     
     processHTTPXStatus = brevityscope.process.processHttpx(programName, refinedBucketPath, inputBucketPath, presentationBucketPath, operationName, programInputBucketPath)
+    # The httpx job has added its responses to the response store, add them to the search index as well
+    try:
+        indexStatus = brevityscope.searchindex.requestIndexUpdate(programName)
+    except ClientError as e:
+        indexStatus = 'Index update not sent: ' + e.response['Error']['Code']
     
     responseData = {
         'status': str(processHTTPXStatus),
+        'index': str(indexStatus)
     }
     
     return {
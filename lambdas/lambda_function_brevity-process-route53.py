@@ -1,9 +1,9 @@
 import json, boto3, os, re
+import datetime
 import gzip
 import base64
-import ipinfo
 from io import BytesIO
-import brevitycore.core
+import brevityprogram.ipinfo
 
 def lambda_handler(event, context):
     
@@ -12,17 +12,13 @@ def lambda_handler(event, context):
     cw_logs = gzip.GzipFile(fileobj=BytesIO(base64.b64decode(cw_data, validate=True))).read()
     log_events = json.loads(cw_logs)
     
-    def retrieveIPInfo(ip_address):
-        # Retrieve API key for IPInfo
-        secretName = "brevity-recon-apis"
-        regionName = "us-east-1"
-        secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
-        secretjson = json.loads(secretRetrieved)
-        access_token = secretjson['ipinfo']
-        handler = ipinfo.getHandler(access_token)
-        details = handler.getDetails(ip_address)
-        return details
+    # Enrich every distinct client subnet in the batch once, using the shared /24 cache and the IPInfo batch endpoint for any misses
+    lstClientSubnets = [log_event['extractedFields']['clientsubnet'] for log_event in log_events['logEvents']]
+    subnetDetails = brevityprogram.ipinfo.retrieveIPInfoBatch(lstClientSubnets, dynamodbclient)
     
+    # The ingestion time lets the DNS dashboard fold in only the records written since its previous run, the hour and a query id shard key its index (brevityprogram.ipinfo.IPINFO_INGESTED_INDEX)
+    ingestedTimestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    lstItems = []
     for log_event in log_events['logEvents']:
         queryid = log_event['id']
         log_event = log_event['extractedFields']
@@ -37,21 +33,25 @@ def lambda_handler(event, context):
         dns_clientsubnet = log_event['clientsubnet']
         # Since the DNS query only provides a CIDR range, it converts it to the starting IP address of the range
         dns_clientipaddress = dns_clientsubnet.split('/', 1)[0]
-        response = retrieveIPInfo(dns_clientipaddress)
-        ipinfo_ip = response.ip
-        ipinfo_city = response.city
-        ipinfo_region = response.region
-        ipinfo_country = response.country
-        ipinfo_loc = response.loc
-        ipinfo_org = response.org
-        ipinfo_postal = response.postal
-        ipinfo_timezone = response.timezone
-        ipinfo_country_name = response.country_name
-        ipinfo_latitude = response.latitude
-        ipinfo_longitude = response.longitude
+        # No client subnet (logged as -) leaves the IPInfo fields empty so the dashboard does not count it as an address
+        clientKey = brevityprogram.ipinfo.subnetKey(dns_clientsubnet)
+        response = subnetDetails.get(clientKey, {})
+        ipinfo_ip = response.get('ip', dns_clientipaddress if clientKey else '')
+        ipinfo_city = response.get('city', '')
+        ipinfo_region = response.get('region', '')
+        ipinfo_country = response.get('country', '')
+        ipinfo_loc = response.get('loc', '')
+        ipinfo_org = response.get('org', '')
+        ipinfo_postal = response.get('postal', '')
+        ipinfo_timezone = response.get('timezone', '')
+        ipinfo_country_name = response.get('country_name', '')
+        ipinfo_latitude = response.get('latitude', '')
+        ipinfo_longitude = response.get('longitude', '')
     
-        dynamoItem = {'queryid':{'S':queryid},'timestamp':{'S':dns_timestamp},'dns_zoneid':{'S':dns_zoneid},'dns_queryname':{'S':dns_queryname},'dns_querytype':{'S':dns_querytype},'dns_responsecode':{'S':dns_responsecode},'dns_protocol':{'S':dns_protocol},'dns_edgelocation':{'S':dns_edgelocation},'dns_resolverip':{'S':dns_resolverip},'dns_clientsubnet':{'S':dns_clientsubnet},'dns_clientipaddress':{'S':dns_clientipaddress},'ipinfo_ip':{'S':ipinfo_ip},'ipinfo_city':{'S':ipinfo_city},'ipinfo_region':{'S':ipinfo_region},'ipinfo_country':{'S':ipinfo_country},'ipinfo_loc':{'S':ipinfo_loc},'ipinfo_org':{'S':ipinfo_org},'ipinfo_postal':{'S':ipinfo_postal},'ipinfo_timezone':{'S':ipinfo_timezone},'ipinfo_country_name':{'S':ipinfo_country_name},'ipinfo_latitude':{'S':ipinfo_latitude},'ipinfo_longitude':{'S':ipinfo_longitude}}
-        dynamoresponse = dynamodbclient.put_item(TableName='brevity_ipinfo',Item=dynamoItem)
+        dynamoItem = {'queryid':{'S':queryid},'timestamp':{'S':dns_timestamp},'dns_zoneid':{'S':dns_zoneid},'dns_queryname':{'S':dns_queryname},'dns_querytype':{'S':dns_querytype},'dns_responsecode':{'S':dns_responsecode},'dns_protocol':{'S':dns_protocol},'dns_edgelocation':{'S':dns_edgelocation},'dns_resolverip':{'S':dns_resolverip},'dns_clientsubnet':{'S':dns_clientsubnet},'dns_clientipaddress':{'S':dns_clientipaddress},'ipinfo_ip':{'S':ipinfo_ip},'ipinfo_city':{'S':ipinfo_city},'ipinfo_region':{'S':ipinfo_region},'ipinfo_country':{'S':ipinfo_country},'ipinfo_loc':{'S':ipinfo_loc},'ipinfo_org':{'S':ipinfo_org},'ipinfo_postal':{'S':ipinfo_postal},'ipinfo_timezone':{'S':ipinfo_timezone},'ipinfo_country_name':{'S':ipinfo_country_name},'ipinfo_latitude':{'S':ipinfo_latitude},'ipinfo_longitude':{'S':ipinfo_longitude},'ingested':{'S':ingestedTimestamp},'ingested_hour':{'S':brevityprogram.ipinfo.ingestedHourKey(ingestedTimestamp, queryid)}}
+        lstItems.append({'PutRequest': {'Item': dynamoItem}})
+    
+    dynamoresponse = brevityprogram.ipinfo.batchWriteItems('brevity_ipinfo', lstItems, dynamodbclient)
     
     return {
         'statusCode': 200,
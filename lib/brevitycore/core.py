@@ -162,6 +162,80 @@ def retrieveresults(execid):
         else:
             time.sleep(5)
             
+# Register only the partitions that have arrived in S3 since the last run instead of running msck repair table.
+# The S3 listing uses a delimiter so only the key=value folder names are returned for each partition level, and the existing partitions come from the Glue catalog. Only the difference is added with batch_create_partition.
+def registerNewPartitions(databaseName, tableName):
+    glue = boto3.client('glue')
+    s3 = boto3.client('s3')
+    table = glue.get_table(DatabaseName=databaseName, Name=tableName)['Table']
+    partitionKeys = [key['Name'] for key in table.get('PartitionKeys', [])]
+    if not partitionKeys:
+        return []
+    storageDescriptor = table['StorageDescriptor']
+    tableLocation = storageDescriptor['Location'].rstrip('/') + '/'
+    full = tableLocation[5:] # trim s3:// prefix
+    bucketloc = full.split('/')[0]
+    prefixloc = full.replace(bucketloc,'',1)[1:]
+    
+    # Walk each partition level (for example date=20210101/) using only the common prefixes
+    lstPrefixes = [(prefixloc, [])]
+    for partitionKey in partitionKeys:
+        lstNextPrefixes = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for prefix, values in lstPrefixes:
+            for page in paginator.paginate(Bucket=bucketloc, Prefix=prefix, Delimiter='/'):
+                for commonPrefix in page.get('CommonPrefixes', []):
+                    folderName = commonPrefix['Prefix'][len(prefix):].rstrip('/')
+                    if folderName.startswith(partitionKey + '='):
+                        lstNextPrefixes.append((commonPrefix['Prefix'], values + [folderName.split('=', 1)[1]]))
+        lstPrefixes = lstNextPrefixes
+    
+    existingPartitions = set()
+    paginator = glue.get_paginator('get_partitions')
+    for page in paginator.paginate(DatabaseName=databaseName, TableName=tableName, ExcludeColumnSchema=True):
+        for partition in page['Partitions']:
+            existingPartitions.add(tuple(partition['Values']))
+    
+    lstNewPartitions = []
+    for prefix, values in lstPrefixes:
+        if tuple(values) in existingPartitions:
+            continue
+        partitionDescriptor = dict(storageDescriptor)
+        partitionDescriptor['Location'] = 's3://' + bucketloc + '/' + prefix
+        lstNewPartitions.append({'Values': values, 'StorageDescriptor': partitionDescriptor})
+    
+    # The Glue API accepts a maximum of 100 partitions per call
+    for i in range(0, len(lstNewPartitions), 100):
+        glue.batch_create_partition(DatabaseName=databaseName, TableName=tableName, PartitionInputList=lstNewPartitions[i:i + 100])
+    return [partition['Values'] for partition in lstNewPartitions]
+
+# Generate the table properties for Athena partition projection on a date partition. With projection enabled, Athena calculates the partitions from the query itself and the catalog never needs to be refreshed.
+def generateDateProjectionProperties(partitionKey, tableLocation, dateFormat='yyyyMMdd', dateRange='20130101,NOW'):
+    tableLocation = tableLocation.rstrip('/') + '/'
+    projectionProperties = {
+        'projection.enabled': 'true',
+        'projection.' + partitionKey + '.type': 'date',
+        'projection.' + partitionKey + '.format': dateFormat,
+        'projection.' + partitionKey + '.range': dateRange,
+        'projection.' + partitionKey + '.interval': '1',
+        'projection.' + partitionKey + '.interval.unit': 'DAYS',
+        'storage.location.template': tableLocation + partitionKey + '=${' + partitionKey + '}/'
+    }
+    return projectionProperties
+
+# Apply partition projection properties to an existing Glue table.
+def enablePartitionProjection(databaseName, tableName, projectionProperties):
+    glue = boto3.client('glue')
+    table = glue.get_table(DatabaseName=databaseName, Name=tableName)['Table']
+    # update_table only accepts the TableInput fields, not the read-only fields returned by get_table
+    tableInputFields = ['Name', 'Description', 'Owner', 'Retention', 'StorageDescriptor', 'PartitionKeys', 'TableType', 'Parameters']
+    tableInput = {field: table[field] for field in tableInputFields if field in table}
+    tableParameters = dict(tableInput.get('Parameters', {}))
+    tableParameters.update(projectionProperties)
+    tableInput['Parameters'] = tableParameters
+    response = glue.update_table(DatabaseName=databaseName, TableInput=tableInput)
+    return response
+
 # Configure SNS topic and text messaging
 def notify_user(phonenumber,message):
     client = boto3.client('sns')
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+import argparse, asyncio, gzip, hashlib, json, os, re, shutil, sys, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+
+# Brevity worker agent
+# Runs on the droplets and pooled workers in place of the generated bash run scripts. This file is uploaded to config/brevity-agent.py and only depends on boto3.
+# A job spec (run/<program>/<operation>-<program>.json, written by brevityprogram.programs.uploadJobSpec) lists:
+#   inputs   - objects to download before the tools run, [{"bucket", "key", "path", "optional"}]
+#              an optional input may be missing (404), any other download error marks it as failed
+#   steps    - tools to run in order, {"name", "command": [argv] or "shell": "pipeline", "cwd", "env", "requires", "mkdirs", "cleanDirs", "check", "stdout": {"bucket", "key"}, "uploads": [...]}
+#              requires skips the step when the path is missing and cleanDirs are emptied before the tool starts
+#              env is added to the agent environment and check fails the job when the tool exits non-zero
+#              stdout is streamed straight into a multipart S3 upload while the tool runs
+#              uploads run as soon as the step exits, {"path", "bucket", "key"} for a file or {"path", "bucket", "prefix", "stripSuffix"} for a directory
+#              an upload with "requiresInput": <input path> is skipped when that input failed, so a file built on top of it does not overwrite the stored copy
+#              {"path", "bucket", "store", "stripSuffix"} adds a directory of httpx responses to the content-addressed response store (see storeResponses)
+#   complete - {"bucket", "key"} of the step functions task file, plus an optional barrier {"bucket", "prefix", "name", "count"} for sharded jobs
+# Modes:
+#   --job <key>      run a single job spec and exit (dedicated droplets)
+#   --queue <url>    long poll the worker pool queue until idle (pooled workers)
+
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+STORE_BODY_DIR = 'bodies/'
+STORE_INDEX_DIR = 'index/'
+UPLOAD_THREADS = 16
+READ_SIZE = 64 * 1024
+# Responses read and stored at once, bodies are held in memory from the read until the put finishes
+STORE_CONCURRENCY = UPLOAD_THREADS * 2
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_THREADS)
+_s3client = None
+
+def _s3():
+    global _s3client
+    if _s3client is None:
+        _s3client = boto3.client('s3')
+    return _s3client
+
+async def _runBlocking(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: function(*args, **kwargs))
+
+def _expand(value):
+    return os.path.expanduser(os.path.expandvars(value))
+
+# Buffer a stream and write it to S3 in multipart chunks. Output smaller than one part is written with a single put.
+class ChunkedS3Upload:
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.buffer = bytearray()
+        self.uploadId = None
+        self.parts = []
+        self.size = 0
+
+    async def _uploadPart(self, body):
+        if self.uploadId is None:
+            response = await _runBlocking(_s3().create_multipart_upload, Bucket=self.bucket, Key=self.key)
+            self.uploadId = response['UploadId']
+        partNumber = len(self.parts) + 1
+        response = await _runBlocking(_s3().upload_part, Bucket=self.bucket, Key=self.key, UploadId=self.uploadId, PartNumber=partNumber, Body=body)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': partNumber})
+
+    async def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        if len(self.buffer) >= UPLOAD_PART_SIZE:
+            body = bytes(self.buffer)
+            self.buffer = bytearray()
+            await self._uploadPart(body)
+
+    async def close(self):
+        if self.uploadId is None:
+            await _runBlocking(_s3().put_object, Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                await self._uploadPart(bytes(self.buffer))
+            await _runBlocking(_s3().complete_multipart_upload, Bucket=self.bucket, Key=self.key, UploadId=self.uploadId, MultipartUpload={'Parts': self.parts})
+        self.buffer = bytearray()
+        return self.size
+
+    async def abort(self):
+        if self.uploadId is not None:
+            await _runBlocking(_s3().abort_multipart_upload, Bucket=self.bucket, Key=self.key, UploadId=self.uploadId)
+
+# Returns the set of optional input paths that could not be downloaded for a reason other than the object not existing
+async def downloadInputs(lstInputs):
+    setFailed = set()
+    async def _download(jobInput):
+        localPath = _expand(jobInput['path'])
+        os.makedirs(os.path.dirname(localPath), exist_ok=True)
+        # A copy left by an earlier job on a reused worker must not stand in for a missing optional input
+        if jobInput.get('optional') and os.path.exists(localPath):
+            os.remove(localPath)
+        try:
+            await _runBlocking(_s3().download_file, jobInput['bucket'], jobInput['key'], localPath)
+        except ClientError as e:
+            if jobInput.get('optional') and e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                setFailed.add(localPath)
+            print('Input not available: ' + jobInput['key'] + ' ' + str(e))
+        except Exception as e:
+            if jobInput.get('optional'):
+                setFailed.add(localPath)
+            print('Input not available: ' + jobInput['key'] + ' ' + str(e))
+    await asyncio.gather(*[_download(jobInput) for jobInput in lstInputs])
+    return setFailed
+
+# Split a stored httpx response into the request (newer httpx versions write it first), the response headers and the body
+def splitResponse(data):
+    responseStart = 0 if data.startswith(b'HTTP/') else data.find(b'\nHTTP/') + 1
+    request = data[:responseStart]
+    response = data[responseStart:]
+    for separator in [b'\r\n\r\n', b'\n\n']:
+        headerEnd = response.find(separator)
+        if headerEnd >= 0:
+            return request, response[:headerEnd], response[headerEnd + len(separator):]
+    return request, response, b''
+
+def _responseUrl(request, responseName):
+    requestLine = re.match(rb'[A-Z]+ (\S+) HTTP/', request)
+    hostHeader = re.search(rb'(?im)^host:\s*(\S+)', request)
+    if requestLine and hostHeader:
+        return (hostHeader.group(1) + requestLine.group(1)).decode('utf-8', 'replace')
+    return responseName
+
+# Hashes already in the store, read from the index parts of earlier jobs
+def loadStoreHashes(bucket, storePrefix):
+    storeHashes = set()
+    for page in _s3().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=storePrefix + STORE_INDEX_DIR):
+        for s3object in page.get('Contents', []):
+            indexPart = gzip.decompress(_s3().get_object(Bucket=bucket, Key=s3object['Key'])['Body'].read())
+            storeHashes.update([json.loads(indexLine)['hash'] for indexLine in indexPart.splitlines() if indexLine.strip()])
+    return storeHashes
+
+# Content-addressed response store. Identical error pages and default vhosts are common, so each distinct body is written once to <store>bodies/<hh>/<sha256>.gz
+# and every response gets a row in a new index part, <store>index/<time>-<id>.jsonl.gz, with its name (the old responses/ object name), url, body hash, size, status line and headers.
+# Parts from concurrent jobs never collide, brevityscope.responses merges and compacts them.
+async def storeResponses(jobUpload):
+    localPath = _expand(jobUpload['path'])
+    storePrefix = jobUpload['store']
+    storeHashes = await _runBlocking(loadStoreHashes, jobUpload['bucket'], storePrefix)
+    claimedHashes = set()
+    storeSlots = asyncio.Semaphore(STORE_CONCURRENCY)
+
+    def _readResponse(filePath):
+        with open(filePath, 'rb') as responseFile:
+            data = responseFile.read()
+        request, headers, body = splitResponse(data)
+        return request, headers, body, hashlib.sha256(body).hexdigest()
+
+    async def _storeResponse(filePath):
+        responseName = os.path.relpath(filePath, localPath).replace(os.sep, '/')
+        stripSuffix = jobUpload.get('stripSuffix')
+        if stripSuffix and responseName.endswith(stripSuffix):
+            responseName = responseName[:-len(stripSuffix)]
+        async with storeSlots:
+            request, headers, body, bodyHash = await _runBlocking(_readResponse, filePath)
+            if bodyHash not in storeHashes and bodyHash not in claimedHashes:
+                claimedHashes.add(bodyHash)
+                bodyKey = storePrefix + STORE_BODY_DIR + bodyHash[:2] + '/' + bodyHash + '.gz'
+                await _runBlocking(_s3().put_object, Bucket=jobUpload['bucket'], Key=bodyKey, Body=gzip.compress(body))
+        headerLines = headers.decode('latin-1').splitlines()
+        return {'name': responseName, 'url': _responseUrl(request, responseName), 'hash': bodyHash, 'size': len(body), 'status': headerLines[0] if headerLines else '', 'headers': '\n'.join(headerLines[1:]), 'stored': int(time.time())}
+
+    lstFiles = [os.path.join(dirPath, fileName) for dirPath, dirNames, fileNames in os.walk(localPath) for fileName in fileNames]
+    lstRows = await asyncio.gather(*[_storeResponse(filePath) for filePath in lstFiles])
+    if lstRows:
+        indexKey = storePrefix + STORE_INDEX_DIR + time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8] + '.jsonl.gz'
+        indexBody = gzip.compress('\n'.join([json.dumps(row) for row in lstRows]).encode())
+        await _runBlocking(_s3().put_object, Bucket=jobUpload['bucket'], Key=indexKey, Body=indexBody)
+    print('Stored ' + str(len(lstRows)) + ' responses, ' + str(len(claimedHashes)) + ' new bodies')
+    return len(lstRows)
+
+# Upload a file, or every file under a directory. stripSuffix replaces the old shell loop that renamed the httpx response files.
+async def uploadPath(jobUpload):
+    if jobUpload.get('store'):
+        return await storeResponses(jobUpload)
+    localPath = _expand(jobUpload['path'])
+    if os.path.isfile(localPath):
+        await _runBlocking(_s3().upload_file, localPath, jobUpload['bucket'], jobUpload['key'])
+        return 1
+    lstFiles = []
+    for dirPath, dirNames, fileNames in os.walk(localPath):
+        for fileName in fileNames:
+            filePath = os.path.join(dirPath, fileName)
+            objectKey = os.path.relpath(filePath, localPath).replace(os.sep, '/')
+            stripSuffix = jobUpload.get('stripSuffix')
+            if stripSuffix and objectKey.endswith(stripSuffix):
+                objectKey = objectKey[:-len(stripSuffix)]
+            lstFiles.append((filePath, jobUpload['prefix'] + objectKey))
+    await asyncio.gather(*[_runBlocking(_s3().upload_file, filePath, jobUpload['bucket'], objectKey) for filePath, objectKey in lstFiles])
+    return len(lstFiles)
+
+# Run one tool. stdout either streams to S3 or is passed through to the agent log.
+async def runStep(jobStep, setFailedInputs=frozenset()):
+    cwd = _expand(jobStep['cwd']) if jobStep.get('cwd') else None
+    if cwd:
+        os.makedirs(cwd, exist_ok=True)
+    if jobStep.get('requires') and not os.path.exists(_expand(jobStep['requires'])):
+        print('Skipping ' + jobStep.get('name', '') + ', missing ' + jobStep['requires'])
+        return None, 0
+    for directory in jobStep.get('mkdirs', []):
+        os.makedirs(_expand(directory), exist_ok=True)
+    # Output directories are emptied first so a reused worker only uploads what this job produced
+    for directory in jobStep.get('cleanDirs', []):
+        shutil.rmtree(_expand(directory), ignore_errors=True)
+        os.makedirs(_expand(directory), exist_ok=True)
+    stdoutTarget = jobStep.get('stdout')
+    stdoutPipe = asyncio.subprocess.PIPE if stdoutTarget else None
+    env = dict(os.environ, **{name: _expand(value) for name, value in jobStep['env'].items()}) if jobStep.get('env') else None
+    if jobStep.get('shell'):
+        process = await asyncio.create_subprocess_shell(jobStep['shell'], stdout=stdoutPipe, cwd=cwd, env=env, executable='/bin/bash')
+    else:
+        process = await asyncio.create_subprocess_exec(*[_expand(argument) for argument in jobStep['command']], stdout=stdoutPipe, cwd=cwd, env=env)
+    if stdoutTarget:
+        upload = ChunkedS3Upload(stdoutTarget['bucket'], stdoutTarget['key'])
+        try:
+            while True:
+                data = await process.stdout.read(READ_SIZE)
+                if not data:
+                    break
+                await upload.write(data)
+            await upload.close()
+        except Exception:
+            await upload.abort()
+            process.kill()
+            raise
+    returnCode = await process.wait()
+    print('Step ' + jobStep.get('name', '') + ' exited with ' + str(returnCode))
+    lstUploads = []
+    for jobUpload in jobStep.get('uploads', []):
+        if jobUpload.get('requiresInput') and _expand(jobUpload['requiresInput']) in setFailedInputs:
+            print('Not uploading ' + jobUpload['path'] + ', input ' + jobUpload['requiresInput'] + ' failed to download')
+            continue
+        lstUploads.append(jobUpload)
+    uploadCounts = await asyncio.gather(*[uploadPath(jobUpload) for jobUpload in lstUploads])
+    if jobStep.get('check') and returnCode != 0:
+        raise RuntimeError('Step ' + jobStep.get('name', '') + ' exited with ' + str(returnCode))
+    return returnCode, sum(uploadCounts)
+
+# Resume the step function. With a barrier only the last job of the group to finish sends the task success.
+async def completeJob(jobComplete, errorMessage=None):
+    barrier = jobComplete.get('barrier')
+    if barrier and errorMessage is None:
+        await _runBlocking(_s3().put_object, Bucket=barrier['bucket'], Key=barrier['prefix'] + str(barrier['name']), Body=b'')
+        response = await _runBlocking(_s3().list_objects_v2, Bucket=barrier['bucket'], Prefix=barrier['prefix'])
+        if response.get('KeyCount', 0) < int(barrier['count']):
+            return 'Waiting'
+    try:
+        s3Object = await _runBlocking(_s3().get_object, Bucket=jobComplete['bucket'], Key=jobComplete['key'])
+    except Exception as e:
+        print('No step functions task: ' + str(e))
+        return 'NoTask'
+    stepFunctionsTask = json.loads(s3Object['Body'].read())
+    stepfunctions = boto3.client('stepfunctions')
+    # Two shards can both see the full barrier, the task is already closed for the second one
+    try:
+        if errorMessage is None:
+            await _runBlocking(stepfunctions.send_task_success, taskToken=stepFunctionsTask['taskToken'], output=json.dumps(stepFunctionsTask['output']))
+            return 'Success'
+        await _runBlocking(stepfunctions.send_task_failure, taskToken=stepFunctionsTask['taskToken'], error='BrevityAgentError', cause=errorMessage[:32000])
+    except (stepfunctions.exceptions.InvalidToken, stepfunctions.exceptions.TaskTimedOut, stepfunctions.exceptions.TaskDoesNotExist) as e:
+        print('Step functions task already completed: ' + str(e))
+        return 'AlreadyComplete'
+    return 'Failure'
+
+async def runJob(jobSpec):
+    startTime = time.time()
+    try:
+        setFailedInputs = await downloadInputs(jobSpec.get('inputs', []))
+        for jobStep in jobSpec.get('steps', []):
+            await runStep(jobStep, setFailedInputs)
+    except Exception as e:
+        print('Job failed: ' + str(e))
+        if jobSpec.get('complete'):
+            await completeJob(jobSpec['complete'], str(e))
+        return 'Failure'
+    print('Job ' + jobSpec.get('operation', '') + ' for ' + jobSpec.get('program', '') + ' finished in ' + str(int(time.time() - startTime)) + ' seconds')
+    if jobSpec.get('complete'):
+        return await completeJob(jobSpec['complete'])
+    return 'Success'
+
+def loadJobSpec(bucket, key):
+    try:
+        s3Object = _s3().get_object(Bucket=bucket, Key=key)
+    except _s3().exceptions.NoSuchKey:
+        return None
+    return json.loads(s3Object['Body'].read())
+
+# Operations without a job spec still run through their generated bash scripts
+async def runLegacyJob(bucket, programName, runOperation):
+    runPath = os.path.expanduser('~/security/run/' + programName)
+    command = f"mkdir -p {runPath} && aws s3 sync s3://{bucket}/run/{programName}/ {runPath}/ && sh {runPath}/sync-{programName}.sh; sh {runPath}/{runOperation}-{programName}.sh"
+    process = await asyncio.create_subprocess_shell(command, executable='/bin/bash')
+    return await process.wait()
+
+async def runQueue(bucket, queueUrl, idleTimeout):
+    sqs = boto3.client('sqs')
+    idleStart = time.time()
+    while time.time() - idleStart < idleTimeout:
+        response = await _runBlocking(sqs.receive_message, QueueUrl=queueUrl, WaitTimeSeconds=20, MaxNumberOfMessages=1)
+        for message in response.get('Messages', []):
+            jobComplete = None
+            # A bad message or job must not stop the agent, the worker shuts down once it exits
+            try:
+                jobMessage = json.loads(message['Body'])
+                programName = jobMessage['program']
+                runOperation = jobMessage['operation']
+                jobComplete = {'bucket': bucket, 'key': 'run/' + programName + '/stepfunctions-' + programName + '.json'}
+                print('Running ' + runOperation + ' for ' + programName)
+                jobSpec = await _runBlocking(loadJobSpec, bucket, 'run/' + programName + '/' + runOperation + '-' + programName + '.json')
+                if jobSpec is None:
+                    await runLegacyJob(bucket, programName, runOperation)
+                else:
+                    jobComplete = jobSpec.get('complete')
+                    await runJob(jobSpec)
+            except Exception as e:
+                print('Job message failed: ' + message['Body'][:1000] + ' ' + repr(e))
+                if jobComplete:
+                    try:
+                        await completeJob(dict(jobComplete, barrier=None), repr(e))
+                    except Exception as completeError:
+                        print('Could not fail the step functions task: ' + repr(completeError))
+            await _runBlocking(sqs.delete_message, QueueUrl=queueUrl, ReceiptHandle=message['ReceiptHandle'])
+            idleStart = time.time()
+    return 'Idle'
+
+# Publish this file for the workers to run (config/brevity-agent.py in the inputs bucket)
+def uploadAgent(inputBucketName):
+    with open(os.path.abspath(__file__), 'rb') as agentFile:
+        _s3().put_object(Bucket=inputBucketName, Key='config/brevity-agent.py', Body=agentFile.read())
+    return 'Success'
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity worker agent')
+    parser.add_argument('--bucket', default='brevity-inputs')
+    parser.add_argument('--job', help='Job spec key to run once')
+    parser.add_argument('--queue', help='Worker pool queue url')
+    parser.add_argument('--idle', type=int, default=1800, help='Seconds without a job before the agent exits')
+    args = parser.parse_args()
+    if args.job:
+        jobSpec = loadJobSpec(args.bucket, args.job)
+        if jobSpec is None:
+            print('Job spec not found: ' + args.job)
+            sys.exit(1)
+        print(asyncio.run(runJob(jobSpec)))
+    elif args.queue:
+        print(asyncio.run(runQueue(args.bucket, args.queue, args.idle)))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
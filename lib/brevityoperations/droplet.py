@@ -1,5 +1,118 @@
 import digitalocean
-import json, io
+import json, io, time
+import boto3
+import brevityoperations.agent
+import brevityoperations.image
+
+# Droplets are tagged with brevity, brevity-program-<program> and brevity-operation-<operation> so lookups can be filtered by tag instead of listing every droplet in the account.
+# SSH keys and droplet listings are cached for a short time so repeated calls within a Lambda (and across warm invocations) do not hit the API each time.
+SSHKEY_CACHE_TTL = 3600
+DROPLET_CACHE_TTL = 15
+BREVITY_TAG = 'brevity'
+
+# Droplets report their own progress instead of being polled. Cloud-init writes a marker object under status/<droplet>/ in the inputs bucket:
+#   booted   - written once the install script finishes, the object body is the public IP address
+#   complete - written once the operation script finishes, just before the droplet shuts down
+# Operation completion is still reported to Step Functions through the task token script, so Lambdas return as soon as the droplet is created.
+READY_BUCKET = 'brevity-inputs'
+READY_PREFIX = 'status/'
+
+_dropletCache = {}
+
+def _cacheGet(cacheKey, ttl):
+    if cacheKey in _dropletCache:
+        cachedTime, cachedValue = _dropletCache[cacheKey]
+        if time.time() - cachedTime < ttl:
+            return cachedValue
+    return None
+
+def _cachePut(cacheKey, cachedValue):
+    _dropletCache[cacheKey] = (time.time(), cachedValue)
+    return cachedValue
+
+# Remove the cached droplet listings, for example after a droplet is created or destroyed
+def clearDropletCache():
+    for cacheKey in list(_dropletCache.keys()):
+        if cacheKey[0] == 'droplets':
+            del _dropletCache[cacheKey]
+
+def dropletTags(runOperation,programName):
+    return [BREVITY_TAG, 'brevity-program-' + programName, 'brevity-operation-' + runOperation]
+
+# Retrieve the account SSH keys once per hour rather than on every droplet launch
+def getSSHKeys(accessToken):
+    keys = _cacheGet(('sshkeys', accessToken), SSHKEY_CACHE_TTL)
+    if keys is None:
+        manager = digitalocean.Manager(token=accessToken)
+        keys = _cachePut(('sshkeys', accessToken), manager.get_all_sshkeys())
+    return keys
+
+# Retrieve the droplets with a tag. Set useCache to False when polling for a state change.
+def getDropletsByTag(accessToken,tagName=BREVITY_TAG,useCache=True):
+    droplets = None
+    if useCache:
+        droplets = _cacheGet(('droplets', accessToken, tagName), DROPLET_CACHE_TTL)
+    if droplets is None:
+        manager = digitalocean.Manager(token=accessToken)
+        droplets = _cachePut(('droplets', accessToken, tagName), manager.get_all_droplets(tag_name=tagName))
+    return droplets
+
+# One-off migration for droplets created before tagging was added, which only carry the brevity- name prefix.
+# Adding the brevity tag makes them visible to the tag lookups (loadDropletInfo, getDropletStates and the cleanup).
+def tagLegacyDroplets(accessToken):
+    manager = digitalocean.Manager(token=accessToken)
+    lstLegacy = [dropletvalue for dropletvalue in manager.get_all_droplets() if dropletvalue.name.startswith('brevity-') and BREVITY_TAG not in dropletvalue.tags]
+    if lstLegacy:
+        tag = digitalocean.Tag(token=accessToken, name=BREVITY_TAG)
+        tag.create()
+        tag.add_droplets([dropletvalue.id for dropletvalue in lstLegacy])
+        clearDropletCache()
+    return [dropletvalue.name for dropletvalue in lstLegacy]
+
+# Single call status of every brevity droplet - returns a dictionary of droplet name to status
+def getDropletStates(accessToken,useCache=True):
+    dropletStates = {}
+    for dropletvalue in getDropletsByTag(accessToken,BREVITY_TAG,useCache):
+        dropletStates[dropletvalue.name] = dropletvalue.status
+    return dropletStates
+
+# Look up the droplet for a program and operation using the program tag
+def loadDropletByTag(accessToken,programName,runOperation):
+    for dropletvalue in getDropletsByTag(accessToken,'brevity-program-' + programName):
+        if ('brevity-operation-' + runOperation) in dropletvalue.tags:
+            return dropletvalue
+    return 'NotFound'
+
+def readyMarkerPath(dropletName,dropletState):
+    return READY_PREFIX + dropletName + '/' + dropletState
+
+# Shell command that writes a state marker. The DigitalOcean metadata service provides the public IP address from inside the droplet.
+def readyCommand(dropletName,dropletState):
+    return f"curl -s http://169.254.169.254/metadata/v1/interfaces/public/0/ipv4/address | aws s3 cp - s3://{READY_BUCKET}/{readyMarkerPath(dropletName,dropletState)}"
+
+# Cloud-init runcmd entry of readyCommand
+def generateReadyCommand(dropletName,dropletState):
+    return "     - " + readyCommand(dropletName,dropletState)
+
+# Remove the markers left by an earlier droplet with the same name so they are not mistaken for the new droplet
+def clearReadyMarkers(dropletName):
+    s3client = boto3.client('s3')
+    response = s3client.list_objects_v2(Bucket=READY_BUCKET, Prefix=READY_PREFIX + dropletName + '/')
+    lstObjects = [{'Key': s3object['Key']} for s3object in response.get('Contents', [])]
+    if lstObjects:
+        s3client.delete_objects(Bucket=READY_BUCKET, Delete={'Objects': lstObjects})
+    return len(lstObjects)
+
+# Single check of the markers a droplet has written - returns a dictionary of state to marker body (the IP address)
+def getDropletReadiness(dropletName):
+    s3client = boto3.client('s3')
+    dropletReadiness = {}
+    response = s3client.list_objects_v2(Bucket=READY_BUCKET, Prefix=READY_PREFIX + dropletName + '/')
+    for s3object in response.get('Contents', []):
+        dropletState = s3object['Key'].rsplit('/', 1)[-1]
+        s3Marker = s3client.get_object(Bucket=READY_BUCKET, Key=s3object['Key'])
+        dropletReadiness[dropletState] = s3Marker['Body'].read().decode('utf-8').strip()
+    return dropletReadiness
 
 def createDroplet(accessToken,dropletName,runOperation,programName,awsAccessKeyId,awsSecretKey):
     
@@ -21,14 +134,16 @@ def createDroplet(accessToken,dropletName,runOperation,programName,awsAccessKeyI
      - wait
      - aws s3 sync s3://brevity-inputs/run/{1}/ /root/security/run/{1}/
      - wait
-     - sh /root/security/config/bounty-startup-{0}.sh
+     - {6}
      - wait
+{4}
      - sh /root/security/run/{1}/sync-{1}.sh
      - wait
      - sh /root/security/run/{1}/{0}-{1}.sh
      - wait
+{5}
      - shutdown now"""
-        fileContents = fileContents.format(runOperation,programName,awsAccessKeyId,awsSecretKey)
+        fileContents = fileContents.format(runOperation,programName,awsAccessKeyId,awsSecretKey,generateReadyCommand(dropletName,'booted'),generateReadyCommand(dropletName,'complete'),brevityoperations.image.installGuardCommand('sh /root/security/config/bounty-startup-' + runOperation + '.sh'))
         fileBuffer.write(fileContents)
         userData = fileBuffer.getvalue()
         return userData
@@ -36,20 +151,23 @@ def createDroplet(accessToken,dropletName,runOperation,programName,awsAccessKeyI
     userData = _generateUserDataScript(runOperation,programName,awsAccessKeyId,awsSecretKey)
     
     # Extract all keys within the account to load into the droplet
-    manager = digitalocean.Manager(token=accessToken)
-    keys = manager.get_all_sshkeys()
+    keys = getSSHKeys(accessToken)
     #  source ~/.bashrc
     # Prepare droplet specifications
     droplet = digitalocean.Droplet(token=accessToken,
                                    name=dropletName,
                                    region='nyc3', # New York 2
-                                   image='ubuntu-20-04-x64', # Ubuntu 20.04 x64
+                                   image=brevityoperations.image.getDropletImage(accessToken), # Toolchain snapshot, or Ubuntu 20.04 x64 until it is built
                                    size_slug='s-1vcpu-1gb',  # 1GB RAM, 1 vCPU
                                    ssh_keys=keys,
                                    backups=False,
+                                   tags=dropletTags(runOperation,programName),
                                    user_data=userData)
-    # Create new droplet
+    # Create new droplet - the run scripts hand their job specs to the worker agent synced from config/
+    brevityoperations.agent.uploadAgent(READY_BUCKET)
+    clearReadyMarkers(dropletName)
     droplet.create()
+    clearDropletCache()
     return droplet
     
 def createDropletManual(accessToken,dropletName,runOperation,programName,awsAccessKeyId,awsSecretKey):
@@ -72,12 +190,15 @@ def createDropletManual(accessToken,dropletName,runOperation,programName,awsAcce
      - wait
      - aws s3 sync s3://brevity-inputs/run/{1}/ /root/security/run/{1}/
      - wait
-     - sh /root/security/config/bounty-startup-{0}.sh
+     - {6}
      - wait
+{4}
      - sh /root/security/run/{1}/sync-{1}.sh
      - wait
-     - sh /root/security/run/{1}/{0}-{1}.sh"""
-        fileContents = fileContents.format(runOperation,programName,awsAccessKeyId,awsSecretKey)
+     - sh /root/security/run/{1}/{0}-{1}.sh
+     - wait
+{5}"""
+        fileContents = fileContents.format(runOperation,programName,awsAccessKeyId,awsSecretKey,generateReadyCommand(dropletName,'booted'),generateReadyCommand(dropletName,'complete'),brevityoperations.image.installGuardCommand('sh /root/security/config/bounty-startup-' + runOperation + '.sh'))
         fileBuffer.write(fileContents)
         userData = fileBuffer.getvalue()
         return userData
@@ -85,74 +206,65 @@ def createDropletManual(accessToken,dropletName,runOperation,programName,awsAcce
     userData = _generateUserDataScript(runOperation,programName,awsAccessKeyId,awsSecretKey)
     
     # Extract all keys within the account to load into the droplet
-    manager = digitalocean.Manager(token=accessToken)
-    keys = manager.get_all_sshkeys()
+    keys = getSSHKeys(accessToken)
     #  source ~/.bashrc
     # Prepare droplet specifications
     droplet = digitalocean.Droplet(token=accessToken,
                                    name=dropletName,
                                    region='nyc3', # New York 2
-                                   image='ubuntu-20-04-x64', # Ubuntu 20.04 x64
+                                   image=brevityoperations.image.getDropletImage(accessToken), # Toolchain snapshot, or Ubuntu 20.04 x64 until it is built
                                    size_slug='s-1vcpu-1gb',  # 1GB RAM, 1 vCPU
                                    ssh_keys=keys,
                                    backups=False,
+                                   tags=dropletTags(runOperation,programName),
                                    user_data=userData)
-    # Create new droplet
+    # Create new droplet - the run scripts hand their job specs to the worker agent synced from config/
+    brevityoperations.agent.uploadAgent(READY_BUCKET)
+    clearReadyMarkers(dropletName)
     droplet.create()
+    clearDropletCache()
     return droplet
 
 def loadDropletInfo(accessToken,dropletName):
-    manager = digitalocean.Manager(token=accessToken)
-    my_droplets = manager.get_all_droplets()
-    for dropletvalue in my_droplets:
+    for dropletvalue in getDropletsByTag(accessToken):
         if dropletvalue.name == dropletName:
-            #dropletId = dropletvalue.id
-            droplet = dropletvalue
-            return droplet
-        else: droplet = 'NotFound'
-    return droplet
+            return dropletvalue
+    return 'NotFound'
     
+# Non-blocking status check. Callers no longer wait for the create action, the droplet writes its booted marker once it is usable.
 def getDropletStatus(droplet):
-    import time
-    dropletStatus = ''
-    while dropletStatus != 'completed':
-        actions = droplet.get_actions()
-        for action in actions:
-            action.load()
-            dropletStatus = action.status
-            print(dropletStatus)
-        time.sleep(5)
+    droplet.load()
+    dropletStatus = droplet.status
+    print(dropletStatus)
     return dropletStatus
     
 def retrieveDropletConnection(accessToken,dropletName):
-    manager = digitalocean.Manager(token=accessToken)
-    my_droplets = manager.get_all_droplets()
-    for dropletvalue in my_droplets:
-        if dropletvalue.name == dropletName:
-            dropletIP = dropletvalue.ip_address
-            # TO-DO - add the brevityocean ssh key name as a variable
-            dropletConnection = 'ssh -i brevityocean root@' + dropletIP
-            return dropletConnection
-        else: dropletConnection = 'NotFound'
+    droplet = loadDropletInfo(accessToken,dropletName)
+    if droplet == 'NotFound':
+        return 'NotFound'
+    dropletIP = droplet.ip_address
+    if not dropletIP:
+        # The droplet has not been assigned an address yet, use the address it reported in the booted marker
+        dropletIP = getDropletReadiness(dropletName).get('booted')
+    if not dropletIP:
+        return 'Pending'
+    # TO-DO - add the brevityocean ssh key name as a variable
+    dropletConnection = 'ssh -i brevityocean root@' + dropletIP
     return dropletConnection
     
+# Non-blocking check for a droplet that has finished its operation. Returns off, complete (the operation finished and the droplet is shutting down), the current status or NotFound.
 def retrieveDropletOff(accessToken,dropletName):
-    import time
-    dropletState = ''
-    while dropletState != 'off':
-        manager = digitalocean.Manager(token=accessToken)
-        my_droplets = manager.get_all_droplets()
-        for dropletvalue in my_droplets:
-            if dropletvalue.name == dropletName:
-                dropletState = dropletvalue.status
-                print(dropletState)
-                time.sleep(60)
+    dropletState = getDropletStates(accessToken,useCache=False).get(dropletName, 'NotFound')
+    if dropletState not in ['off', 'NotFound'] and 'complete' in getDropletReadiness(dropletName):
+        dropletState = 'complete'
+    print(dropletState)
     return dropletState
 
 def deleteDroplet(brevityDroplet,dropletName):
     try:
         if brevityDroplet.name == dropletName:
             brevityDroplet.destroy()
+            clearDropletCache()
             status = 'Droplet has been destroyed.'
             return status
     except:
@@ -1,5 +1,6 @@
 import json, io
 import boto3
+import brevityoperations.image
 
 def createEC2(runOperation,programName):
     def _generateUserDataScript(runOperation,programName):
@@ -22,7 +23,7 @@ def createEC2(runOperation,programName):
      - wait
      - aws s3 sync s3://brevity-inputs/run/{runOperation}/ /home/ec2-user/security/run/{runOperation}/
      - wait
-     - sudo bash /home/ec2-user/security/config/bounty-startup-{runOperation}.sh
+     - {brevityoperations.image.installGuardCommand('sudo bash /home/ec2-user/security/config/bounty-startup-' + runOperation + '.sh', '/home/ec2-user')}
      - sudo bash /home/ec2-user/security/run/{programName}/sync-{programName}.sh
      - wait
      - sudo bash /root/security/run/{programName}/{runOperation}-{programName}.sh"""
@@ -57,7 +58,7 @@ def createEC2(runOperation,programName):
                 },
             },
         ],
-        ImageId='ami-0c2b8ca1dad447f8a',
+        ImageId=brevityoperations.image.getEC2Image(ec2_client), # Toolchain AMI, or the stock Amazon Linux AMI until it is built
         MinCount=1,
         MaxCount=1,
         InstanceType="t3.medium",
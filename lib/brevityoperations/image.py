@@ -0,0 +1,227 @@
+import digitalocean
+import json, io, hashlib
+import boto3
+import brevitycore.core
+import brevityoperations.droplet
+import brevityoperations.toolchain
+
+# Pre-baked toolchain image
+# The version-pinned tool definition in brevityoperations.toolchain is baked into a DigitalOcean snapshot and an EC2 AMI.
+# The image name carries a hash of the definition, so changing any pin produces a new image and droplets never boot from a stale toolchain.
+# The baked image contains /root/.brevity-toolchain (or /home/ec2-user/.brevity-toolchain), and the boot scripts skip the per-operation install script when it is present.
+# The install script stops at the first failing command and writes the file only once every tool resolves, and a builder is only snapshotted after it reports built.
+# Building is split into non-blocking stages so it can be driven by Step Functions with a wait state in between:
+#   build    - launch a builder that installs the toolchain and powers off
+#   snapshot - snapshot the builder once it is off, and remove the builder once the image exists
+# Axiom is not part of the image, it is a controller toolset (packer, doctl) rather than a worker tool.
+
+DROPLET_BASE_IMAGE = 'ubuntu-20-04-x64'
+EC2_BASE_IMAGE = 'ami-0c2b8ca1dad447f8a'
+# The builder droplet uses the keep- prefix so the droplet-delete Lambda does not remove it while it is off and waiting for the snapshot
+IMAGE_BUILDER_PREFIX = 'keep-image-'
+
+_toolchainImages = {}
+
+def toolchainName():
+    toolchain = brevityoperations.toolchain
+    toolchainDefinition = json.dumps({'go': toolchain.GO_VERSION, 'packages': toolchain.TOOLCHAIN_PACKAGES, 'gotools': toolchain.TOOLCHAIN_GO, 'pip': toolchain.TOOLCHAIN_PIP, 'git': toolchain.TOOLCHAIN_GIT}, sort_keys=True)
+    return 'brevity-toolchain-' + hashlib.sha256(toolchainDefinition.encode()).hexdigest()[:12]
+
+# Command that runs a per-operation install script only when the machine did not boot from the toolchain image
+def installGuardCommand(installCommand, homePath='/root'):
+    return 'test -f ' + homePath + '/.brevity-toolchain || ' + installCommand
+
+# Render the consolidated install script. packageManager is apt for the DigitalOcean Ubuntu image and yum for the Amazon Linux AMI.
+def renderToolchainScript(homePath='/root', packageManager='apt'):
+    toolchain = brevityoperations.toolchain
+    if packageManager == 'apt':
+        packageCommands = 'export DEBIAN_FRONTEND=noninteractive\napt-get update\napt-get install -y ' + ' '.join(toolchain.TOOLCHAIN_PACKAGES)
+    else:
+        packageCommands = 'yum update -y\nyum install -y ' + ' '.join(toolchain.TOOLCHAIN_PACKAGES)
+    goCommands = toolchain.goToolCommands(toolchain.TOOLCHAIN_GO.keys())
+    pipCommands = 'pip3 install ' + ' '.join(toolchain.TOOLCHAIN_PIP)
+    gitCommands = '\n'.join([f"git clone --depth 1 {gitUrl} $HOME/security/tools/{gitName}\ncd $HOME/security/tools/{gitName}\npip3 install -r requirements.txt\npython3 setup.py install\ncd $HOME" for gitName, gitUrl in toolchain.TOOLCHAIN_GIT.items()])
+    checkCommands = '\n'.join(['command -v ' + toolCommand + ' > /dev/null' for toolCommand in toolchain.TOOLCHAIN_COMMANDS])
+    fileContents = f"""#!/bin/bash
+set -euo pipefail
+
+# Brevity toolchain {toolchainName()}
+export HOME={homePath}
+
+# Create directory structure
+mkdir -p $HOME/security/tools/amass/db $HOME/security/tools/hakrawler $HOME/security/tools/httpx
+mkdir -p $HOME/security/raw $HOME/security/refined $HOME/security/curated $HOME/security/scope $HOME/security/install $HOME/security/config $HOME/security/run $HOME/security/inputs
+mkdir -p $HOME/security/presentation/httpx $HOME/security/presentation/httpx-json
+
+{packageCommands}
+
+{goCommands}
+
+{pipCommands}
+
+{gitCommands}
+
+# Every tool has to resolve before the image is marked as a toolchain image
+{checkCommands}
+
+# Record the toolchain and the resolved tool versions, the boot scripts skip the install scripts when this file exists
+go version -m $GOPATH/bin/* | grep -E '^/|mod' > /tmp/brevity-toolchain-versions
+echo {toolchainName()} | cat - /tmp/brevity-toolchain-versions > $HOME/.brevity-toolchain"""
+    return fileContents
+
+# Upload the rendered scripts to config/brevity-toolchain-apt.sh and config/brevity-toolchain-yum.sh
+def generateToolchainScripts(inputBucketName):
+    lstStatus = []
+    for packageManager, homePath in [('apt', '/root'), ('yum', '/home/ec2-user')]:
+        objectBuffer = io.BytesIO(renderToolchainScript(homePath, packageManager).encode())
+        object_path = 'config/brevity-toolchain-' + packageManager + '.sh'
+        lstStatus.append(brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path))
+        objectBuffer.close()
+    return lstStatus
+
+# Snapshot id of the current toolchain image, or None if it has not been built. An image never changes for a toolchain name, so found images are kept for the life of the container.
+def getToolchainImage(accessToken):
+    imageName = toolchainName()
+    imageId = _toolchainImages.get((accessToken, imageName))
+    if imageId is None:
+        manager = digitalocean.Manager(token=accessToken)
+        for snapshot in manager.get_droplet_snapshots():
+            if snapshot.name == imageName:
+                imageId = snapshot.id
+                _toolchainImages[(accessToken, imageName)] = imageId
+    return imageId
+
+# Image to create droplets from - the toolchain snapshot when available, otherwise the stock image and the per-operation install scripts
+def getDropletImage(accessToken):
+    return getToolchainImage(accessToken) or DROPLET_BASE_IMAGE
+
+def startDropletImageBuild(accessToken,inputBucketName,awsAccessKeyId,awsSecretKey):
+    imageName = toolchainName()
+    if getToolchainImage(accessToken):
+        return 'Image exists: ' + imageName
+    builderName = IMAGE_BUILDER_PREFIX + imageName
+    if brevityoperations.droplet.loadDropletInfo(accessToken,builderName) != 'NotFound':
+        return 'Building: ' + builderName
+    generateToolchainScripts(inputBucketName)
+    userData = f"""#cloud-config
+    runcmd:
+     - export AWS_ACCESS_KEY_ID={awsAccessKeyId}
+     - export AWS_SECRET_ACCESS_KEY={awsSecretKey}
+     - export AWS_DEFAULT_REGION=us-east-1
+     - apt-get update
+     - apt-get install -y awscli
+     - mkdir -p /root/security/config
+     - aws s3 cp s3://{inputBucketName}/config/brevity-toolchain-apt.sh /root/security/config/
+     - bash /root/security/config/brevity-toolchain-apt.sh && {brevityoperations.droplet.readyCommand(builderName,'built')}
+     - rm -rf /var/lib/cloud/instances /root/security/config
+     - poweroff"""
+    keys = brevityoperations.droplet.getSSHKeys(accessToken)
+    droplet = digitalocean.Droplet(token=accessToken,
+                                   name=builderName,
+                                   region='nyc3', # New York 3
+                                   image=DROPLET_BASE_IMAGE,
+                                   size_slug='s-1vcpu-1gb',  # 1GB RAM, 1 vCPU
+                                   ssh_keys=keys,
+                                   backups=False,
+                                   tags=brevityoperations.droplet.dropletTags('image','toolchain'),
+                                   user_data=userData)
+    brevityoperations.droplet.clearReadyMarkers(builderName)
+    droplet.create()
+    brevityoperations.droplet.clearDropletCache()
+    return 'Building: ' + builderName
+
+# Snapshot the builder once it has powered off, and remove the builder once the snapshot exists
+def snapshotDropletImage(accessToken):
+    imageName = toolchainName()
+    builderName = IMAGE_BUILDER_PREFIX + imageName
+    builder = brevityoperations.droplet.loadDropletInfo(accessToken,builderName)
+    if getToolchainImage(accessToken):
+        if builder != 'NotFound':
+            brevityoperations.droplet.deleteDroplet(builder,builderName)
+        return 'Complete: ' + imageName
+    if builder == 'NotFound':
+        return 'NotFound'
+    if builder.status != 'off':
+        return 'Building: ' + builderName
+    # An off builder without the built marker failed its install script, it is left for inspection rather than snapshotted
+    if 'built' not in brevityoperations.droplet.getDropletReadiness(builderName):
+        return 'Failed: ' + builderName
+    if builder.locked:
+        return 'Snapshotting: ' + imageName
+    builder.take_snapshot(imageName, power_off=True)
+    return 'Snapshotting: ' + imageName
+
+# AMI id of the current toolchain image, or None if it has not been built (or is still pending)
+def getEC2ToolchainImage(ec2_client=None):
+    if not ec2_client:
+        ec2_client = boto3.client('ec2', region_name='us-east-1')
+    response = ec2_client.describe_images(Owners=['self'], Filters=[{'Name': 'name', 'Values': [toolchainName()]}, {'Name': 'state', 'Values': ['available']}])
+    if response['Images']:
+        return response['Images'][0]['ImageId']
+    return None
+
+def getEC2Image(ec2_client=None):
+    return getEC2ToolchainImage(ec2_client) or EC2_BASE_IMAGE
+
+def _findEC2Builder(ec2_client):
+    response = ec2_client.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': [IMAGE_BUILDER_PREFIX + toolchainName()]}, {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}])
+    for reservation in response['Reservations']:
+        for instance in reservation['Instances']:
+            return instance
+    return None
+
+def startEC2ImageBuild(inputBucketName):
+    ec2_client = boto3.client('ec2', region_name='us-east-1')
+    imageName = toolchainName()
+    if getEC2ToolchainImage(ec2_client):
+        return 'Image exists: ' + imageName
+    if _findEC2Builder(ec2_client):
+        return 'Building: ' + IMAGE_BUILDER_PREFIX + imageName
+    generateToolchainScripts(inputBucketName)
+    # The instance profile provides the S3 access, and the instance stops rather than terminates when the script powers it off
+    # The builder writes the same built marker as the droplet builder (brevityoperations.droplet.readyMarkerPath) once the install script succeeds
+    builderName = IMAGE_BUILDER_PREFIX + imageName
+    userData = f"""#cloud-config
+    runcmd:
+     - export AWS_DEFAULT_REGION=us-east-1
+     - mkdir -p /home/ec2-user/security/config
+     - aws s3 cp s3://{inputBucketName}/config/brevity-toolchain-yum.sh /home/ec2-user/security/config/
+     - bash /home/ec2-user/security/config/brevity-toolchain-yum.sh && echo {imageName} | aws s3 cp - s3://{brevityoperations.droplet.READY_BUCKET}/{brevityoperations.droplet.readyMarkerPath(builderName,'built')}
+     - rm -rf /var/lib/cloud/instances /home/ec2-user/security/config
+     - poweroff"""
+    brevityoperations.droplet.clearReadyMarkers(builderName)
+    instances = ec2_client.run_instances(
+        ImageId=EC2_BASE_IMAGE,
+        MinCount=1,
+        MaxCount=1,
+        InstanceType="t3.medium",
+        IamInstanceProfile={
+            'Name': 'brevity-ec2'
+        },
+        KeyName="brevity-recon",
+        SecurityGroups=["brevity-ec2"],
+        InstanceInitiatedShutdownBehavior='stop',
+        TagSpecifications=[{'ResourceType': 'instance', 'Tags': [{'Key': 'Name', 'Value': builderName}]}],
+        UserData=userData,
+    )
+    return 'Building: ' + builderName
+
+def snapshotEC2Image():
+    ec2_client = boto3.client('ec2', region_name='us-east-1')
+    imageName = toolchainName()
+    builder = _findEC2Builder(ec2_client)
+    if getEC2ToolchainImage(ec2_client):
+        if builder:
+            ec2_client.terminate_instances(InstanceIds=[builder['InstanceId']])
+        return 'Complete: ' + imageName
+    if not builder:
+        return 'NotFound'
+    if builder['State']['Name'] != 'stopped':
+        return 'Building: ' + IMAGE_BUILDER_PREFIX + imageName
+    # A stopped builder without the built marker failed its install script, it is left for inspection rather than imaged
+    if 'built' not in brevityoperations.droplet.getDropletReadiness(IMAGE_BUILDER_PREFIX + imageName):
+        return 'Failed: ' + IMAGE_BUILDER_PREFIX + imageName
+    response = ec2_client.describe_images(Owners=['self'], Filters=[{'Name': 'name', 'Values': [imageName]}])
+    if not response['Images']:
+        ec2_client.create_image(InstanceId=builder['InstanceId'], Name=imageName, Description='Brevity worker toolchain')
+    return 'Snapshotting: ' + imageName
@@ -0,0 +1,329 @@
+import argparse, asyncio, io, json, os, shutil, subprocess, time, zipfile
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+import brevitycore.core
+import brevityprogram.programs
+import brevityprogram.httpx
+import brevityprogram.gospider
+import brevityscope.process
+import brevityscope.responses
+import brevityscope.searchindex
+import brevityscope.urlextract
+import brevityoperations.agent
+
+# Pipelined recon on a single worker
+# The step function normally hops Lambda -> worker -> Lambda for each of httpx initial, process, crawl, process, httpx crawl and process, with every stage reading and writing S3.
+# In pipeline mode one pooled worker runs the whole chain. The brevityscope.process functions already take path prefixes, so they are pointed at a local work folder laid out like the buckets:
+#   <work>/<program>/refined/       - s3://brevity-data/refined/
+#   <work>/<program>/presentation/  - s3://brevity-data/presentation/
+#   <work>/<program>/inputs/        - s3://<inputs bucket>/ (programs/<program>/...)
+#   <work>/<program>/raw/           - httpx responses and crawl output, added to the response store and brevity-raw as soon as each tool exits
+# After each stage the files it changed and pipeline/<program>/checkpoint.json are written to the inputs bucket, so a job that is handed to another worker resumes from the last completed stage.
+# The bucket copies are only published once every stage has finished.
+# The worker runs this module from config/brevity-lib.zip (uploaded by preparePipeline) with python3 -m brevityoperations.pipeline.
+
+PIPELINE_WORK_PATH = '/root/security/pipeline/'
+PIPELINE_PREFIX = 'pipeline/'
+PIPELINE_LIBRARY_KEY = 'config/brevity-lib.zip'
+PIPELINE_PACKAGES = ['brevitycore', 'brevityprogram', 'brevityscope', 'brevityoperations']
+# The on-box processing needs the same libraries as the pandas Lambda layer (also baked into the toolchain image, brevityoperations.toolchain.TOOLCHAIN_PIP)
+PIPELINE_REQUIREMENTS = ['pandas==1.3.5', 'tldextract==3.4.4', 'dynamodb-json==1.3']
+PIPELINE_STATE_FOLDERS = ['refined', 'presentation', 'inputs']
+
+_executor = ThreadPoolExecutor(max_workers=16)
+
+# Zip the brevity packages for the worker. Python imports straight from the zip once it is on PYTHONPATH.
+def uploadLibrary(inputBucketName):
+    libraryPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    objectBuffer = io.BytesIO()
+    with zipfile.ZipFile(objectBuffer, 'w', zipfile.ZIP_DEFLATED) as libraryZip:
+        for packageName in PIPELINE_PACKAGES:
+            for dirPath, dirNames, fileNames in os.walk(os.path.join(libraryPath, packageName)):
+                for fileName in fileNames:
+                    if fileName.endswith('.py') and not fileName.startswith('.'):
+                        filePath = os.path.join(dirPath, fileName)
+                        libraryZip.write(filePath, os.path.relpath(filePath, libraryPath))
+    objectBuffer.seek(0)
+    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,PIPELINE_LIBRARY_KEY)
+    objectBuffer.close()
+    return status
+
+def _checkpointKey(programName):
+    return PIPELINE_PREFIX + programName + '/checkpoint.json'
+
+def _statePrefix(programName):
+    return PIPELINE_PREFIX + programName + '/state/'
+
+def loadCheckpoint(programName, inputBucketName):
+    s3client = boto3.client('s3')
+    try:
+        s3Object = s3client.get_object(Bucket=inputBucketName, Key=_checkpointKey(programName))
+    except s3client.exceptions.NoSuchKey:
+        return None
+    return json.loads(s3Object['Body'].read())
+
+# Build the pipeline job for the worker pool. resume keeps the run id of an unfinished run so the worker picks up from its checkpoint.
+# Returns the run id and whether both the library and the job spec were uploaded.
+def preparePipeline(programName, inputBucketName, resume=False):
+    checkpoint = loadCheckpoint(programName, inputBucketName) if resume else None
+    if checkpoint and not checkpoint.get('published'):
+        runId = checkpoint['runId']
+    else:
+        runId = time.strftime('%Y%m%d%H%M%S')
+    libraryStatus = uploadLibrary(inputBucketName)
+    libraryPath = '$HOME/security/config/brevity-lib.zip'
+    jobSpec = {
+        'inputs': [{'bucket': inputBucketName, 'key': PIPELINE_LIBRARY_KEY, 'path': libraryPath}],
+        'steps': [
+            {
+                'name': 'requirements',
+                'shell': "python3 -c 'import pandas, tldextract, dynamodb_json' 2>/dev/null || pip3 install " + ' '.join(PIPELINE_REQUIREMENTS)
+            },
+            {
+                'name': 'pipeline',
+                'command': ['python3', '-m', 'brevityoperations.pipeline', '--program', programName, '--bucket', inputBucketName, '--run', runId],
+                'env': {'PYTHONPATH': libraryPath},
+                'check': True
+            }
+        ],
+        'complete': brevityprogram.programs.generateJobComplete(programName, inputBucketName)
+    }
+    status = brevityprogram.programs.uploadJobSpec(programName, inputBucketName, 'pipeline', jobSpec)
+    return runId, bool(libraryStatus and status)
+
+def pipelinePaths(programName, workPath=PIPELINE_WORK_PATH):
+    programPath = workPath + programName + '/'
+    return {
+        'work': programPath,
+        'refined': programPath + 'refined/',
+        'presentation': programPath + 'presentation/',
+        'inputs': programPath + 'inputs/',
+        'programInputs': programPath + 'inputs/programs/',
+        'raw': programPath + 'raw/'
+    }
+
+def _hasLines(filePath):
+    return os.path.isfile(filePath) and os.path.getsize(filePath) > 0
+
+def _runTool(command, stdoutPath=None):
+    startTime = time.time()
+    shell = isinstance(command, str)
+    stdoutFile = open(stdoutPath, 'wb') if stdoutPath else None
+    try:
+        returnCode = subprocess.run(command, stdout=stdoutFile, shell=shell, executable='/bin/bash' if shell else None).returncode
+    finally:
+        if stdoutFile:
+            stdoutFile.close()
+    print('Tool ' + (command if shell else command[0]) + ' exited with ' + str(returnCode) + ' after ' + str(int(time.time() - startTime)) + ' seconds')
+    return returnCode
+
+def _cleanDir(dirPath):
+    shutil.rmtree(dirPath, ignore_errors=True)
+    os.makedirs(dirPath, exist_ok=True)
+
+def _uploadRaw(localPath, prefix):
+    return asyncio.run(brevityoperations.agent.uploadPath({'path': localPath, 'bucket': 'brevity-raw', 'prefix': prefix}))
+
+def _storeResponses(programName, localPath):
+    return asyncio.run(brevityoperations.agent.uploadPath({'path': localPath, 'bucket': 'brevity-raw', 'store': brevityscope.responses.RESPONSE_STORE_PREFIX + programName + '/', 'stripSuffix': '.txt'}))
+
+# httpx over inputPath, writing presentation/httpx-json/<program>-httpx-<operation>.json
+def _stageHttpx(programName, paths, inputPath, operationName):
+    outputPath = paths['presentation'] + 'httpx-json/' + programName + '-httpx-' + operationName + '.json'
+    responsesPath = paths['raw'] + 'responses-' + operationName
+    os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+    if not _hasLines(inputPath):
+        print('No httpx input: ' + inputPath)
+        open(outputPath, 'w').close()
+        return
+    _cleanDir(responsesPath)
+    _runTool(brevityprogram.httpx.httpxCommand(inputPath, responsesPath), outputPath)
+    _storeResponses(programName, responsesPath)
+
+def _stageProcessHttpx(programName, paths, operationName):
+    outputPath = paths['presentation'] + 'httpx-json/' + programName + '-httpx-' + operationName + '.json'
+    if not _hasLines(outputPath):
+        print('No httpx output to process for ' + operationName)
+        return
+    brevityscope.process.processHttpx(programName, paths['refined'], paths['inputs'], paths['presentation'], operationName, paths['programInputs'])
+
+def stageHttpxInitial(programName, paths):
+    _stageHttpx(programName, paths, paths['programInputs'] + programName + '/' + programName + '-domains-probe.txt', 'initial')
+
+def stageProcessInitial(programName, paths):
+    _stageProcessHttpx(programName, paths, 'initial')
+
+# gospider over the base urls from the initial pass, then the url lists the crawl job writes to the refined bucket
+def stageCrawl(programName, paths):
+    inputPath = paths['programInputs'] + programName + '/' + programName + '-urls-base.txt'
+    if not _hasLines(inputPath):
+        print('No crawl input: ' + inputPath)
+        return
+    crawlPath = paths['raw'] + 'crawl'
+    refinedPath = paths['refined'] + programName + '/'
+    simplePath = refinedPath + 'crawl'
+    _cleanDir(crawlPath)
+    _cleanDir(simplePath)
+    _runTool(brevityprogram.gospider.gospiderCommand(inputPath, crawlPath))
+    # Same seen file as the crawl job (brevityprogram.gospider), so -urls-new.txt only lists urls no earlier crawl found
+    seenPath = paths['raw'] + 'urls.seen'
+    seenKey = 'crawl-seen/' + programName + '/urls.seen'
+    s3client = boto3.client('s3')
+    if os.path.exists(seenPath):
+        os.remove(seenPath)
+    try:
+        s3client.download_file('brevity-raw', seenKey, seenPath)
+    except ClientError as e:
+        # Only a missing seen file starts a new history, anything else would overwrite it with this run's urls
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+        print('No crawl seen file yet for ' + programName)
+    print(brevityscope.urlextract.extractUrls(crawlPath, refinedPath + programName + '-urls-min.txt', refinedPath + programName + '-urls-max.txt', simplePath, seenPath, refinedPath + programName + '-urls-new.txt'))
+    if os.path.exists(seenPath):
+        s3client.upload_file(seenPath, 'brevity-raw', seenKey)
+    _uploadRaw(crawlPath, 'crawl/' + programName + '/')
+
+def stageProcessCrawl(programName, paths):
+    if not _hasLines(paths['refined'] + programName + '/' + programName + '-urls-max.txt'):
+        print('No crawl urls to process')
+        return
+    brevityscope.process.processCrawl(programName, paths['refined'], paths['inputs'], paths['presentation'], 'crawl', paths['programInputs'])
+
+def stageHttpxCrawl(programName, paths):
+    _stageHttpx(programName, paths, paths['programInputs'] + programName + '/' + programName + '-urls-base.txt', 'crawl')
+
+def stageProcessHttpxCrawl(programName, paths):
+    _stageProcessHttpx(programName, paths, 'crawl')
+
+PIPELINE_STAGES = [
+    ('httpx-initial', stageHttpxInitial),
+    ('process-initial', stageProcessInitial),
+    ('crawl', stageCrawl),
+    ('process-crawl', stageProcessCrawl),
+    ('httpx-crawl', stageHttpxCrawl),
+    ('process-httpx-crawl', stageProcessHttpxCrawl)
+]
+
+def _listKeys(bucketName, prefix):
+    s3client = boto3.client('s3')
+    lstKeys = []
+    for page in s3client.get_paginator('list_objects_v2').paginate(Bucket=bucketName, Prefix=prefix):
+        lstKeys += [s3object['Key'] for s3object in page.get('Contents', [])]
+    return lstKeys
+
+def _transfer(function, lstArgs):
+    return list(_executor.map(lambda args: function(*args), lstArgs))
+
+# Fresh run - the probe list from the httpx Lambda logic, the merged httpx datasets processHttpx appends to, the amass detail processCrawl takes the cloud columns from, and shard manifests that mark both passes as unsharded
+def downloadPipelineInputs(programName, inputBucketName, paths):
+    s3client = boto3.client('s3')
+    lstDownloads = [
+        (inputBucketName, 'programs/' + programName + '/' + programName + '-domains-probe.txt', paths['programInputs'] + programName + '/' + programName + '-domains-probe.txt'),
+        ('brevity-data', 'presentation/httpx/' + programName + '-httpx.json', paths['presentation'] + 'httpx/' + programName + '-httpx.json'),
+        ('brevity-data', 'refined/' + programName + '/' + programName + '-subs-detail.csv', paths['refined'] + programName + '/' + programName + '-subs-detail.csv'),
+        ('brevity-data', 'refined/' + programName + '/' + programName + '-httpx-initial.json', paths['refined'] + programName + '/' + programName + '-httpx-initial.json')
+    ]
+    for bucketName, objectKey, localPath in lstDownloads:
+        os.makedirs(os.path.dirname(localPath), exist_ok=True)
+        try:
+            s3client.download_file(bucketName, objectKey, localPath)
+        except Exception as e:
+            print('Pipeline input not available: ' + objectKey + ' ' + str(e))
+    manifestPath = paths['programInputs'] + programName + '/' + brevityprogram.httpx.HTTPX_SHARD_DIR + '/'
+    os.makedirs(manifestPath, exist_ok=True)
+    for operationName in ['initial', 'crawl']:
+        with open(manifestPath + programName + '-httpx-' + operationName + '.json', 'w') as manifestFile:
+            json.dump({'program': programName, 'operation': operationName, 'shards': 1}, manifestFile)
+
+# Upload the state files changed since sinceTime and record the completed stages
+def saveCheckpoint(programName, inputBucketName, paths, runId, lstCompleted, sinceTime, published=False):
+    s3client = boto3.client('s3')
+    lstUploads = []
+    for folderName in PIPELINE_STATE_FOLDERS:
+        for dirPath, dirNames, fileNames in os.walk(paths[folderName]):
+            for fileName in fileNames:
+                filePath = os.path.join(dirPath, fileName)
+                if os.path.getmtime(filePath) >= sinceTime:
+                    objectKey = _statePrefix(programName) + os.path.relpath(filePath, paths['work']).replace(os.sep, '/')
+                    lstUploads.append((filePath, inputBucketName, objectKey))
+    _transfer(s3client.upload_file, lstUploads)
+    checkpoint = {'program': programName, 'runId': runId, 'completed': lstCompleted, 'published': published, 'updated': int(time.time())}
+    s3client.put_object(Bucket=inputBucketName, Key=_checkpointKey(programName), Body=json.dumps(checkpoint).encode())
+    return len(lstUploads)
+
+def restoreCheckpoint(programName, inputBucketName, paths):
+    s3client = boto3.client('s3')
+    statePrefix = _statePrefix(programName)
+    lstDownloads = []
+    for objectKey in _listKeys(inputBucketName, statePrefix):
+        localPath = paths['work'] + objectKey[len(statePrefix):]
+        os.makedirs(os.path.dirname(localPath), exist_ok=True)
+        lstDownloads.append((inputBucketName, objectKey, localPath))
+    _transfer(s3client.download_file, lstDownloads)
+    return len(lstDownloads)
+
+def clearCheckpoint(programName, inputBucketName):
+    s3client = boto3.client('s3')
+    lstKeys = _listKeys(inputBucketName, _statePrefix(programName))
+    for i in range(0, len(lstKeys), 1000):
+        s3client.delete_objects(Bucket=inputBucketName, Delete={'Objects': [{'Key': objectKey} for objectKey in lstKeys[i:i + 1000]]})
+    return len(lstKeys)
+
+# Copy the local mirrors to the buckets they stand in for
+def publishPipeline(programName, inputBucketName, paths):
+    lstPublish = [
+        {'path': paths['refined'], 'bucket': 'brevity-data', 'prefix': 'refined/'},
+        {'path': paths['presentation'], 'bucket': 'brevity-data', 'prefix': 'presentation/'},
+        {'path': paths['inputs'], 'bucket': inputBucketName, 'prefix': ''}
+    ]
+    return sum([asyncio.run(brevityoperations.agent.uploadPath(jobUpload)) for jobUpload in lstPublish])
+
+def runPipeline(programName, inputBucketName, runId, workPath=PIPELINE_WORK_PATH):
+    paths = pipelinePaths(programName, workPath)
+    _cleanDir(paths['work'])
+    checkpoint = loadCheckpoint(programName, inputBucketName)
+    if checkpoint and checkpoint.get('runId') == runId:
+        lstCompleted = checkpoint['completed']
+        print('Resuming ' + runId + ' after ' + ', '.join(lstCompleted) + ' with ' + str(restoreCheckpoint(programName, inputBucketName, paths)) + ' state files')
+        # The restored files are already in the checkpoint
+        sinceTime = time.time()
+    else:
+        lstCompleted = []
+        clearCheckpoint(programName, inputBucketName)
+        downloadPipelineInputs(programName, inputBucketName, paths)
+        sinceTime = 0
+    # processHttpx and processCrawl write into these presentation folders without creating them
+    for localPath in [paths['refined'] + programName, paths['programInputs'] + programName, paths['presentation'] + 'httpx', paths['presentation'] + 'httpx-json', paths['presentation'] + 'urls', paths['raw']]:
+        os.makedirs(localPath, exist_ok=True)
+
+    for stageName, stageFunction in PIPELINE_STAGES:
+        if stageName in lstCompleted:
+            continue
+        stageStart = time.time()
+        stageFunction(programName, paths)
+        lstCompleted.append(stageName)
+        stateCount = saveCheckpoint(programName, inputBucketName, paths, runId, lstCompleted, sinceTime)
+        print('Stage ' + stageName + ' finished in ' + str(int(time.time() - stageStart)) + ' seconds, ' + str(stateCount) + ' state files saved')
+        sinceTime = time.time()
+    publishCount = publishPipeline(programName, inputBucketName, paths)
+    saveCheckpoint(programName, inputBucketName, paths, runId, lstCompleted, time.time(), published=True)
+    print('Published ' + str(publishCount) + ' files for ' + programName)
+    # Best effort once the results are published, the worker credentials may not allow SSM and the sift job still updates the index in that case
+    try:
+        print('Index update: ' + str(brevityscope.searchindex.requestIndexUpdate(programName, inputBucketName)))
+    except Exception as e:
+        print('Index update not sent: ' + str(e))
+    return 'Success'
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity recon pipeline')
+    parser.add_argument('--program', required=True)
+    parser.add_argument('--bucket', default='brevity-inputs')
+    parser.add_argument('--run', required=True, help='Run id, a matching checkpoint is resumed')
+    parser.add_argument('--work', default=PIPELINE_WORK_PATH)
+    args = parser.parse_args()
+    print(runPipeline(args.program, args.bucket, args.run, args.work))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import digitalocean
+import json, io, time, uuid
+import boto3
+import brevitycore.core
+import brevityoperations.agent
+import brevityoperations.droplet
+import brevityoperations.image
+
+# Warm worker pool
+# Instead of creating a new droplet per program and operation, a fixed number of brevity-worker droplets are kept running with every operation toolset installed.
+# Operation Lambdas place a job on the SQS queue and return. Each worker runs the agent (brevityoperations.agent), which long polls the queue, runs the job spec for each job and shuts the worker down after sitting idle for the idle timeout.
+# The droplet-delete Lambda already cleans up any brevity- droplets that are off, and the pool is replenished on the next dispatch.
+
+WORKER_POOL_SIZE = 2
+WORKER_POOL_MAX = 8
+WORKER_IDLE_TIMEOUT = 1800
+WORKER_QUEUE_NAME = 'brevity-jobs'
+WORKER_PREFIX = 'brevity-worker-'
+# Pooled workers carry this tag (dropletTags('worker', 'pool')), the pool is counted by tag rather than by name
+WORKER_TAG = 'brevity-operation-worker'
+WORKER_OPERATIONS = ['httpx', 'crawl', 'nuclei']
+# Only the dispatch holding the lease counts and creates workers, so concurrent dispatches cannot overshoot the pool size.
+# The lease is a conditional put on the brevity_pool_lease table and expires on its own if a Lambda dies while holding it.
+POOL_LEASE_TABLE = 'brevity_pool_lease'
+POOL_LEASE_SECONDS = 120
+POOL_LEASE_ATTEMPTS = 10
+
+# Retrieve the queue url, creating the queue the first time. The visibility timeout covers the longest running operation so a job is not handed to a second worker.
+def getJobQueueUrl():
+    sqs = boto3.client('sqs')
+    try:
+        response = sqs.get_queue_url(QueueName=WORKER_QUEUE_NAME)
+    except sqs.exceptions.QueueDoesNotExist:
+        response = sqs.create_queue(QueueName=WORKER_QUEUE_NAME, Attributes={'VisibilityTimeout': '43200', 'ReceiveMessageWaitTimeSeconds': '20'})
+    return response['QueueUrl']
+
+# Place a job on the queue for the next available worker.
+def dispatchJob(programName, runOperation):
+    sqs = boto3.client('sqs')
+    queueUrl = getJobQueueUrl()
+    jobBody = json.dumps({'program': programName, 'operation': runOperation})
+    response = sqs.send_message(QueueUrl=queueUrl, MessageBody=jobBody)
+    return response['MessageId']
+
+# Generate the worker script that runs on each pooled droplet (config/brevity-worker.sh). The worker agent long polls the queue, runs each job and exits once idle.
+def generateScriptWorker(inputBucketName, queueUrl, idleTimeout=WORKER_IDLE_TIMEOUT):
+    agentStatus = brevityoperations.agent.uploadAgent(inputBucketName)
+    fileBuffer = io.StringIO()
+    fileContents = f"""#!/bin/bash
+
+# Brevity worker - run queued operation jobs until idle
+export HOME=/root
+export PATH=/root/go/bin:$PATH
+python3 -c 'import boto3' 2>/dev/null || pip3 install boto3
+python3 $HOME/security/config/brevity-agent.py --bucket {inputBucketName} --queue {queueUrl} --idle {idleTimeout}
+shutdown now"""
+    fileBuffer.write(fileContents)
+    objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
+    # Upload file to S3
+    object_name = 'brevity-worker.sh'
+    object_path = 'config/' + object_name
+    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
+    fileBuffer.close()
+    objectBuffer.close()
+    return status
+
+# Create a pooled worker droplet. All of the operation install scripts run once at boot and then the worker loop takes over.
+def createWorker(accessToken,workerName,awsAccessKeyId,awsSecretKey):
+
+    def _generateUserDataScript(awsAccessKeyId,awsSecretKey):
+        installCommands = '\n'.join([f"     - {brevityoperations.image.installGuardCommand('sh /root/security/config/bounty-startup-' + runOperation + '.sh')}\n     - wait" for runOperation in WORKER_OPERATIONS])
+        fileContents = f"""#cloud-config
+    packages:
+     - awscli
+
+    runcmd:
+     - mkdir /root/security
+     - mkdir /root/security/config
+     - mkdir /root/security/run
+     - export AWS_ACCESS_KEY_ID={awsAccessKeyId}
+     - export AWS_SECRET_ACCESS_KEY={awsSecretKey}
+     - export AWS_DEFAULT_REGION=us-east-1
+     - aws s3 sync s3://brevity-inputs/config/ /root/security/config/
+     - wait
+{installCommands}
+{brevityoperations.droplet.generateReadyCommand(workerName,'booted')}
+     - sh /root/security/config/brevity-worker.sh"""
+        return fileContents
+
+    userData = _generateUserDataScript(awsAccessKeyId,awsSecretKey)
+
+    keys = brevityoperations.droplet.getSSHKeys(accessToken)
+    droplet = digitalocean.Droplet(token=accessToken,
+                                   name=workerName,
+                                   region='nyc3', # New York 3
+                                   image=brevityoperations.image.getDropletImage(accessToken), # Toolchain snapshot, or Ubuntu 20.04 x64 until it is built
+                                   size_slug='s-1vcpu-1gb',  # 1GB RAM, 1 vCPU
+                                   ssh_keys=keys,
+                                   backups=False,
+                                   tags=brevityoperations.droplet.dropletTags('worker','pool'),
+                                   user_data=userData)
+    brevityoperations.droplet.clearReadyMarkers(workerName)
+    droplet.create()
+    brevityoperations.droplet.clearDropletCache()
+    return droplet
+
+# Unique worker name, so two dispatches topping up the pool at the same time never create droplets with the same name
+def workerName():
+    return WORKER_PREFIX + time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+# Take the pool lease, waiting up to POOL_LEASE_ATTEMPTS seconds for another dispatch to finish. Returns the lease owner, or None if it is still held.
+def acquirePoolLease(dynamodbclient):
+    leaseOwner = uuid.uuid4().hex
+    for attempt in range(POOL_LEASE_ATTEMPTS):
+        now = int(time.time())
+        try:
+            dynamodbclient.put_item(
+                TableName=POOL_LEASE_TABLE,
+                Item={'lease': {'S': 'pool'}, 'owner': {'S': leaseOwner}, 'expires': {'N': str(now + POOL_LEASE_SECONDS)}},
+                ConditionExpression='attribute_not_exists(lease) OR expires < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}})
+            return leaseOwner
+        except dynamodbclient.exceptions.ConditionalCheckFailedException:
+            time.sleep(1)
+    return None
+
+def releasePoolLease(dynamodbclient, leaseOwner):
+    try:
+        dynamodbclient.delete_item(TableName=POOL_LEASE_TABLE, Key={'lease': {'S': 'pool'}}, ConditionExpression='#owner = :owner', ExpressionAttributeNames={'#owner': 'owner'}, ExpressionAttributeValues={':owner': {'S': leaseOwner}})
+    except dynamodbclient.exceptions.ConditionalCheckFailedException:
+        print('Pool lease expired before it was released')
+
+# Make sure the pool has poolSize running workers. Workers that are still booting count toward the pool, workers that are off do not.
+def ensureWorkerPool(accessToken,inputBucketName,awsAccessKeyId,awsSecretKey,poolSize=WORKER_POOL_SIZE):
+    queueUrl = getJobQueueUrl()
+    workerStatus = generateScriptWorker(inputBucketName, queueUrl)
+    dynamodbclient = boto3.client('dynamodb')
+    leaseOwner = acquirePoolLease(dynamodbclient)
+    # The job is already queued, the dispatch holding the lease tops up the pool for it
+    if leaseOwner is None:
+        print('Pool lease held by another dispatch')
+        return []
+    lstCreated = []
+    try:
+        workerCount = len([dropletvalue for dropletvalue in brevityoperations.droplet.getDropletsByTag(accessToken,WORKER_TAG,useCache=False) if dropletvalue.status != 'off'])
+        while workerCount + len(lstCreated) < poolSize:
+            newWorkerName = workerName()
+            createWorker(accessToken,newWorkerName,awsAccessKeyId,awsSecretKey)
+            lstCreated.append(newWorkerName)
+    finally:
+        releasePoolLease(dynamodbclient, leaseOwner)
+    return lstCreated
+
+# Queue a job and top up the pool. This returns as soon as the job is queued, the worker reports back through the step functions script.
+def submitPoolJob(programName,runOperation,inputBucketName):
+    return submitPoolJobs(programName,[runOperation],inputBucketName)
+
+# Queue several jobs for the same program, for example the httpx shards. The pool is grown (up to WORKER_POOL_MAX) so the jobs run in parallel.
+def submitPoolJobs(programName,lstOperations,inputBucketName):
+    secretName = 'digitalocean'
+    regionName = 'us-east-1'
+    accessToken = brevitycore.core.get_secret(secretName,regionName)
+
+    secretName = 'brevity-aws-recon'
+    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
+    secretjson = json.loads(secretRetrieved)
+    awsAccessKeyId = secretjson['AWS_ACCESS_KEY_ID']
+    awsSecretKey = secretjson['AWS_SECRET_ACCESS_KEY']
+
+    lstMessageIds = [dispatchJob(programName, runOperation) for runOperation in lstOperations]
+    poolSize = min(max(WORKER_POOL_SIZE, len(lstOperations)), WORKER_POOL_MAX)
+    lstCreated = ensureWorkerPool(accessToken,inputBucketName,awsAccessKeyId,awsSecretKey,poolSize)
+    if len(lstMessageIds) == 1:
+        return {'Job': lstMessageIds[0], 'Workers Created': lstCreated}
+    return {'Jobs': lstMessageIds, 'Workers Created': lstCreated}
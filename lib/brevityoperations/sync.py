@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+import argparse, hashlib, io, json, os, tarfile, time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+
+# Brevity delta sync
+# Replaces the aws s3 sync / aws s3 cp --recursive commands in the program sync script (run/<program>/sync-<program>.sh). Uploaded to config/brevity-sync.py and only depends on boto3.
+# The sync spec (run/<program>/sync-<program>.json, written by brevityprogram.programs.prepareProgram) lists pairs of {"name", "direction", "path", "bucket", "prefix", "archive"}.
+# Each pair keeps a manifest on the worker ($HOME/security/manifests/<program>/<name>.json) and a copy in the inputs bucket (manifests/<program>/<name>.json) for the next worker:
+#   up    - files are hashed (only when their size or mtime changed) and only new or changed content is uploaded
+#           with archive set, changed files under SYNC_SMALL_FILE are packed into tar.gz batches under <prefix>_batches/ instead of one object each
+#   down  - the listing ETags are compared with the manifest and only new or changed objects are downloaded, batches are unpacked in place
+# Transfers run in parallel.
+
+SYNC_THREADS = 32
+SYNC_SMALL_FILE = 128 * 1024
+SYNC_BATCH_SIZE = 32 * 1024 * 1024
+SYNC_BATCH_DIR = '_batches/'
+MANIFEST_PATH = '$HOME/security/manifests/'
+MANIFEST_PREFIX = 'manifests/'
+
+_executor = ThreadPoolExecutor(max_workers=SYNC_THREADS)
+_s3client = None
+
+def _s3():
+    global _s3client
+    if _s3client is None:
+        _s3client = boto3.client('s3')
+    return _s3client
+
+def _expand(value):
+    return os.path.expanduser(os.path.expandvars(value))
+
+def _hashFile(filePath):
+    fileHash = hashlib.sha256()
+    with open(filePath, 'rb') as localFile:
+        for block in iter(lambda: localFile.read(1024 * 1024), b''):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+# The worker copy is used when present, otherwise the copy left in the bucket by the last worker
+def loadManifest(programName, pairName, manifestBucket):
+    manifestPath = _expand(MANIFEST_PATH) + programName + '/' + pairName + '.json'
+    try:
+        with open(manifestPath) as manifestFile:
+            return json.load(manifestFile)
+    except (FileNotFoundError, ValueError):
+        pass
+    try:
+        s3Object = _s3().get_object(Bucket=manifestBucket, Key=MANIFEST_PREFIX + programName + '/' + pairName + '.json')
+        return json.loads(s3Object['Body'].read())
+    except Exception:
+        return {'files': {}}
+
+def saveManifest(programName, pairName, manifestBucket, manifest, publish=True):
+    manifestPath = _expand(MANIFEST_PATH) + programName + '/' + pairName + '.json'
+    os.makedirs(os.path.dirname(manifestPath), exist_ok=True)
+    manifestBody = json.dumps(manifest)
+    with open(manifestPath, 'w') as manifestFile:
+        manifestFile.write(manifestBody)
+    if publish:
+        _s3().put_object(Bucket=manifestBucket, Key=MANIFEST_PREFIX + programName + '/' + pairName + '.json', Body=manifestBody.encode())
+
+def _listFiles(localPath):
+    lstFiles = []
+    for dirPath, dirNames, fileNames in os.walk(localPath):
+        for fileName in fileNames:
+            filePath = os.path.join(dirPath, fileName)
+            lstFiles.append((os.path.relpath(filePath, localPath).replace(os.sep, '/'), filePath))
+    return lstFiles
+
+# Group the small files into batches of up to SYNC_BATCH_SIZE, named after their content so an unchanged batch keeps its key
+def _packBatches(lstSmall):
+    lstBatches = []
+    lstBatch = []
+    batchSize = 0
+    for relPath, filePath, fileSize, fileHash in sorted(lstSmall):
+        lstBatch.append((relPath, filePath, fileHash))
+        batchSize += fileSize
+        if batchSize >= SYNC_BATCH_SIZE:
+            lstBatches.append(lstBatch)
+            lstBatch = []
+            batchSize = 0
+    if lstBatch:
+        lstBatches.append(lstBatch)
+    return lstBatches
+
+def _uploadBatch(bucket, prefix, lstBatch):
+    batchName = hashlib.sha256(''.join([relPath + fileHash for relPath, filePath, fileHash in lstBatch]).encode()).hexdigest()[:24]
+    batchKey = prefix + SYNC_BATCH_DIR + batchName + '.tar.gz'
+    batchBuffer = io.BytesIO()
+    with tarfile.open(fileobj=batchBuffer, mode='w:gz') as batchTar:
+        for relPath, filePath, fileHash in lstBatch:
+            batchTar.add(filePath, arcname=relPath)
+    batchBuffer.seek(0)
+    _s3().upload_fileobj(batchBuffer, bucket, batchKey)
+    return batchKey
+
+def syncUp(programName, syncPair, manifestBucket):
+    localPath = _expand(syncPair['path'])
+    manifest = loadManifest(programName, syncPair['name'], manifestBucket)
+    manifestFiles = manifest.get('files', {})
+    lstChanged = []
+    for relPath, filePath in _listFiles(localPath):
+        fileStat = os.stat(filePath)
+        entry = manifestFiles.get(relPath)
+        if entry and entry['size'] == fileStat.st_size and entry['mtime'] == fileStat.st_mtime_ns:
+            continue
+        fileHash = _hashFile(filePath)
+        if entry and entry['hash'] == fileHash:
+            entry['mtime'] = fileStat.st_mtime_ns
+            continue
+        lstChanged.append((relPath, filePath, fileStat.st_size, fileHash, fileStat.st_mtime_ns))
+
+    lstSingle = [changed for changed in lstChanged if not (syncPair.get('archive') and changed[2] < SYNC_SMALL_FILE)]
+    lstSmall = [changed[:4] for changed in lstChanged if syncPair.get('archive') and changed[2] < SYNC_SMALL_FILE]
+    list(_executor.map(lambda changed: _s3().upload_file(changed[1], syncPair['bucket'], syncPair['prefix'] + changed[0]), lstSingle))
+    lstBatches = _packBatches(lstSmall)
+    lstBatchKeys = list(_executor.map(lambda lstBatch: _uploadBatch(syncPair['bucket'], syncPair['prefix'], lstBatch), lstBatches))
+
+    for relPath, filePath, fileSize, fileHash, fileMtime in lstSingle:
+        manifestFiles[relPath] = {'size': fileSize, 'mtime': fileMtime, 'hash': fileHash}
+    changedMtimes = {changed[0]: changed[4] for changed in lstChanged}
+    for lstBatch, batchKey in zip(lstBatches, lstBatchKeys):
+        for relPath, filePath, fileHash in lstBatch:
+            manifestFiles[relPath] = {'size': os.path.getsize(filePath), 'mtime': changedMtimes[relPath], 'hash': fileHash, 'batch': batchKey}
+    manifest['files'] = manifestFiles
+    saveManifest(programName, syncPair['name'], manifestBucket, manifest, publish=bool(lstChanged))
+    return {'files': len(lstSingle), 'batches': len(lstBatches), 'batched': len(lstSmall)}
+
+def _isBatch(relPath):
+    return relPath.startswith(SYNC_BATCH_DIR) and relPath.endswith('.tar.gz')
+
+def _downloadObject(bucket, objectKey, localPath, relPath):
+    targetPath = os.path.join(localPath, relPath)
+    os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+    _s3().download_file(bucket, objectKey, targetPath)
+
+def _downloadBatch(bucket, objectKey):
+    batchBuffer = io.BytesIO()
+    _s3().download_fileobj(bucket, objectKey, batchBuffer)
+    batchBuffer.seek(0)
+    return batchBuffer
+
+def _extractBatch(batchBuffer, localPath):
+    with tarfile.open(fileobj=batchBuffer, mode='r:gz') as batchTar:
+        batchTar.extractall(localPath, members=[member for member in batchTar.getmembers() if member.isfile() and not member.name.startswith(('/', '..'))])
+
+# Downloads only keep the manifest on the worker, the listing in the bucket is the other side of the comparison
+def syncDown(programName, syncPair, manifestBucket):
+    localPath = _expand(syncPair['path'])
+    os.makedirs(localPath, exist_ok=True)
+    manifest = loadManifest(programName, syncPair['name'], manifestBucket)
+    manifestFiles = manifest.get('files', {})
+    lstChanged = []
+    for page in _s3().get_paginator('list_objects_v2').paginate(Bucket=syncPair['bucket'], Prefix=syncPair['prefix']):
+        for s3object in page.get('Contents', []):
+            relPath = s3object['Key'][len(syncPair['prefix']):]
+            if not relPath or relPath.endswith('/'):
+                continue
+            entry = manifestFiles.get(relPath)
+            if entry and entry['etag'] == s3object['ETag'] and (_isBatch(relPath) or os.path.exists(os.path.join(localPath, relPath))):
+                continue
+            lstChanged.append((s3object['Key'], relPath, s3object['ETag'], s3object['Size'], s3object['LastModified']))
+    lstSingle = [changed for changed in lstChanged if not _isBatch(changed[1])]
+    list(_executor.map(lambda changed: _downloadObject(syncPair['bucket'], changed[0], localPath, changed[1]), lstSingle))
+    # A file that changed is packed again into a newer batch, so the batches are unpacked oldest first
+    lstBatches = sorted([changed for changed in lstChanged if _isBatch(changed[1])], key=lambda changed: changed[4])
+    for i in range(0, len(lstBatches), SYNC_THREADS):
+        for batchBuffer in _executor.map(lambda changed: _downloadBatch(syncPair['bucket'], changed[0]), lstBatches[i:i + SYNC_THREADS]):
+            _extractBatch(batchBuffer, localPath)
+    for objectKey, relPath, etag, objectSize, lastModified in lstChanged:
+        manifestFiles[relPath] = {'size': objectSize, 'etag': etag}
+    manifest['files'] = manifestFiles
+    saveManifest(programName, syncPair['name'], manifestBucket, manifest, publish=False)
+    return {'files': len(lstChanged)}
+
+def runSync(bucket, specKey, lstNames=None):
+    syncSpec = json.loads(_s3().get_object(Bucket=bucket, Key=specKey)['Body'].read())
+    programName = syncSpec['program']
+    for syncPair in syncSpec['pairs']:
+        if lstNames and syncPair['name'] not in lstNames:
+            continue
+        startTime = time.time()
+        if syncPair['direction'] == 'up':
+            if not os.path.isdir(_expand(syncPair['path'])):
+                continue
+            syncStatus = syncUp(programName, syncPair, bucket)
+        else:
+            syncStatus = syncDown(programName, syncPair, bucket)
+        print('Sync ' + syncPair['name'] + ' ' + syncPair['direction'] + ' ' + json.dumps(syncStatus) + ' in ' + str(round(time.time() - startTime, 1)) + ' seconds')
+    return 'Success'
+
+# Publish this file for the workers (config/brevity-sync.py in the inputs bucket)
+def uploadSyncTool(inputBucketName):
+    with open(os.path.abspath(__file__), 'rb') as syncFile:
+        _s3().put_object(Bucket=inputBucketName, Key='config/brevity-sync.py', Body=syncFile.read())
+    return 'Success'
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity delta sync')
+    parser.add_argument('--bucket', default='brevity-inputs')
+    parser.add_argument('--spec', required=True, help='Sync spec key')
+    parser.add_argument('--only', nargs='*', help='Only sync the named pairs')
+    args = parser.parse_args()
+    print(runSync(args.bucket, args.spec, args.only))
+
+if __name__ == '__main__':
+    main()
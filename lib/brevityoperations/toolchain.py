@@ -0,0 +1,44 @@
+# Version-pinned worker toolchain
+# Single definition of the tools the workers use. The toolchain image (brevityoperations.image) installs all of it, and the per-operation
+# generateInstallScript* functions render their Go tools from it, so the stock image fallback installs the same versions as the baked image.
+# Kept free of third party imports so the brevityprogram modules can use it without the DigitalOcean library.
+
+GO_VERSION = '1.20.14'
+TOOLCHAIN_PACKAGES = ['git', 'python3', 'python3-pip', 'unzip', 'jq', 'awscli']
+# Installed binary name to go install path
+TOOLCHAIN_GO = {
+    'httpx': 'github.com/projectdiscovery/httpx/cmd/httpx@v1.3.7',
+    'nuclei': 'github.com/projectdiscovery/nuclei/v2/cmd/nuclei@v2.9.15',
+    'interactsh-server': 'github.com/projectdiscovery/interactsh/cmd/interactsh-server@v1.1.6',
+    'interactsh-client': 'github.com/projectdiscovery/interactsh/cmd/interactsh-client@v1.1.6',
+    'notify': 'github.com/projectdiscovery/notify/cmd/notify@v1.0.5',
+    'amass': 'github.com/owasp-amass/amass/v3/...@v3.23.3',
+    'gospider': 'github.com/jaeles-project/gospider@v1.1.6',
+    'anew': 'github.com/tomnomnom/anew@v0.1.1',
+    'unfurl': 'github.com/tomnomnom/unfurl@v0.4.3',
+    'ffuf': 'github.com/ffuf/ffuf@v1.5.0',
+    'sift': 'github.com/svent/sift@v0.9.0',
+    # hakrawler does not publish semver tags, the resolved version is recorded in the toolchain file on the image
+    'hakrawler': 'github.com/hakluke/hakrawler@latest'
+}
+TOOLCHAIN_PIP = ['boto3==1.28.57', 'semgrep==1.45.0', 'pacu==1.5.1', 'pandas==1.3.5', 'tldextract==3.4.4', 'dynamodb-json==1.3', 'pyahocorasick==2.0.0']
+TOOLCHAIN_GIT = {'LinkFinder': 'https://github.com/GerbenJavado/LinkFinder.git'}
+# Commands checked before an image is marked as built
+TOOLCHAIN_COMMANDS = ['git', 'python3', 'pip3', 'unzip', 'jq', 'aws', 'go'] + list(TOOLCHAIN_GO.keys())
+
+# Shell lines that install the pinned Go release (the distribution golang package is too old for go install with versions) and the named Go tools
+def goToolCommands(lstTools):
+    goInstalls = '\n'.join(['go install -v ' + TOOLCHAIN_GO[goTool] for goTool in lstTools])
+    return f"""# Pinned Go release
+curl -sSL https://go.dev/dl/go{GO_VERSION}.linux-amd64.tar.gz -o /tmp/go.tar.gz
+rm -rf /usr/local/go
+tar -C /usr/local -xzf /tmp/go.tar.gz
+rm /tmp/go.tar.gz
+export GOPATH=$HOME/go
+export PATH=/usr/local/go/bin:$GOPATH/bin:$PATH
+echo 'export GOROOT=/usr/local/go' >> $HOME/.bashrc
+echo 'export GOPATH=$HOME/go' >> $HOME/.bashrc
+echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> $HOME/.bashrc
+
+# Install go tools
+{goInstalls}"""
@@ -3,6 +3,7 @@ import io, json
 import pandas as pd
 import brevitycore.core
 import brevityprogram.dynamodb
+import brevityprogram.programs
 
 # Initial function for program specific amass configuration
 def prepareAmass(programName, inputBucketName, inputBucketPath):
@@ -50,31 +51,28 @@ def generateScopeFiles(bucketPath, programName, scopes):
     except:
         return "Scope generation failed."
         
+# Build the worker agent job for amass. The config and scope files are downloaded directly and the results are uploaded to the refined bucket as soon as amass exits.
 def generateScriptAmass(programName, inputBucketName):
-    fileBuffer = io.StringIO()
-    fileContents = f"""#!/bin/bash
-
-# Run custom amass script
-export HOME=/root
-cd $HOME/security/tools/amass
-amass enum -config config.ini -blf {programName}-out.txt -df {programName}-in.txt -json {programName}-amass-subs.json
-mkdir $HOME/security/raw/{programName}
-sleep 5
-mv *.json $HOME/security/refined/{programName}/
-sleep 10
-mv db/amass.txt $HOME/security/refined/{programName}/{programName}-amass-subs.txt
-sleep 10
-sh $HOME/security/config/sync-{programName}.sh
-sleep 10
-shutdown now"""
-    fileBuffer.write(fileContents)
-    objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
-    # Upload file to S3
-    object_name = 'amass-' + programName + '.sh'
-    object_path = 'run/' + programName + '/' + object_name
-    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
-    fileBuffer.close()
-    objectBuffer.close()
+    amassPath = '$HOME/security/tools/amass'
+    refinedPath = '$HOME/security/refined/' + programName
+    jobSpec = {
+        'inputs': [
+            {'bucket': inputBucketName, 'key': 'tools/amass/config.ini', 'path': amassPath + '/config.ini'},
+            {'bucket': inputBucketName, 'key': 'scope/' + programName + '/' + programName + '-in.txt', 'path': amassPath + '/' + programName + '-in.txt'},
+            {'bucket': inputBucketName, 'key': 'scope/' + programName + '/' + programName + '-out.txt', 'path': amassPath + '/' + programName + '-out.txt'}
+        ],
+        'steps': [{
+            'name': 'amass',
+            'command': ['amass', 'enum', '-config', 'config.ini', '-blf', programName + '-out.txt', '-df', programName + '-in.txt', '-json', refinedPath + '/' + programName + '-amass-subs.json'],
+            'cwd': amassPath,
+            'mkdirs': [refinedPath],
+            'uploads': [
+                {'path': refinedPath + '/' + programName + '-amass-subs.json', 'bucket': 'brevity-data', 'key': 'refined/' + programName + '/' + programName + '-amass-subs.json'},
+                {'path': amassPath + '/db/amass.txt', 'bucket': 'brevity-data', 'key': 'refined/' + programName + '/' + programName + '-amass-subs.txt'}
+            ]
+        }]
+    }
+    status = brevityprogram.programs.uploadJobSpec(programName, inputBucketName, 'amass', jobSpec)
     return status
     
 def generateAmassConfig(inputBucketName):
@@ -0,0 +1,166 @@
+import ipaddress, json
+import boto3
+from botocore.exceptions import ClientError
+import pandas as pd
+import brevityprogram.iprange
+
+# Cloud provider classification for discovered hosts.
+# The published provider range files are kept as local JSON snapshots in one folder (local path or s3:// path) using these file names:
+#   aws-ip-ranges.json        - https://ip-ranges.amazonaws.com/ip-ranges.json
+#   gcp-cloud.json            - https://www.gstatic.com/ipranges/cloud.json
+#   azure-servicetags.json    - Azure Service Tags (Public) download
+#   cloudflare-ips.json       - https://api.cloudflare.com/client/v4/ips
+# The prefixes are flattened into non-overlapping intervals (the most specific prefix wins) and loaded into the sorted arrays from brevityprogram.iprange.
+# The folder comes from the cloudRangesPath SSM parameter, CLOUD_RANGES_PATH is used where it is not set or cannot be read.
+
+CLOUD_RANGES_PATH = 's3://brevity-inputs/config/cloudranges/'
+CLOUD_RANGES_PARAMETER = 'cloudRangesPath'
+CLOUD_COLUMNS = ['cloud_provider', 'cloud_service', 'cloud_region']
+
+_cloudRangeIndexes = {}
+_cloudRangesPath = None
+
+def getCloudRangesPath():
+    global _cloudRangesPath
+    if _cloudRangesPath is None:
+        try:
+            client = boto3.client('ssm')
+            response = client.get_parameter(
+                Name=CLOUD_RANGES_PARAMETER
+            )
+            _cloudRangesPath = response['Parameter']['Value']
+        except ClientError as e:
+            print('Using the default cloud ranges path: ' + str(e))
+            _cloudRangesPath = CLOUD_RANGES_PATH
+    return _cloudRangesPath
+
+def _loadJSON(filePath):
+    if filePath.startswith('s3://'):
+        full = filePath[5:] # trim s3:// prefix
+        bucketloc = full.split('/')[0]
+        keyloc = full.replace(bucketloc,'',1)[1:]
+        s3 = boto3.client('s3')
+        # A missing or unreadable (AccessDenied) snapshot is skipped, the other providers are still classified
+        try:
+            s3Object = s3.get_object(Bucket=bucketloc, Key=keyloc)
+        except ClientError as e:
+            print('Cloud range snapshot not readable: ' + filePath + ' ' + str(e))
+            return None
+        return json.loads(s3Object['Body'].read())
+    try:
+        with open(filePath) as jsonFile:
+            return json.load(jsonFile)
+    except FileNotFoundError:
+        return None
+
+# Each parser returns a list of (prefix, provider, service, region, priority) tuples. A higher priority wins when the same prefix is listed more than once.
+def _parseAWS(jsonRanges):
+    lstPrefixes = []
+    for prefix in jsonRanges.get('prefixes', []) + jsonRanges.get('ipv6_prefixes', []):
+        # The AMAZON service is a superset of all of the other services, so the specific service takes precedence
+        priority = 0 if prefix['service'] == 'AMAZON' else 1
+        lstPrefixes.append((prefix.get('ip_prefix') or prefix.get('ipv6_prefix'), 'aws', prefix['service'], prefix['region'], priority))
+    return lstPrefixes
+
+def _parseGCP(jsonRanges):
+    lstPrefixes = []
+    for prefix in jsonRanges.get('prefixes', []):
+        lstPrefixes.append((prefix.get('ipv4Prefix') or prefix.get('ipv6Prefix'), 'gcp', prefix.get('service', ''), prefix.get('scope', ''), 1))
+    return lstPrefixes
+
+def _parseAzure(jsonRanges):
+    lstPrefixes = []
+    for serviceTag in jsonRanges.get('values', []):
+        properties = serviceTag.get('properties', {})
+        # The AzureCloud tags cover everything, so the named service tags take precedence
+        priority = 0 if serviceTag['name'].startswith('AzureCloud') else 1
+        service = properties.get('systemService') or serviceTag['name']
+        for prefix in properties.get('addressPrefixes', []):
+            lstPrefixes.append((prefix, 'azure', service, properties.get('region', ''), priority))
+    return lstPrefixes
+
+def _parseCloudflare(jsonRanges):
+    lstPrefixes = []
+    result = jsonRanges.get('result', jsonRanges)
+    for prefix in result.get('ipv4_cidrs', []) + result.get('ipv6_cidrs', []):
+        lstPrefixes.append((prefix, 'cloudflare', 'cdn', '', 1))
+    return lstPrefixes
+
+CLOUD_RANGE_FILES = {
+    'aws-ip-ranges.json': _parseAWS,
+    'gcp-cloud.json': _parseGCP,
+    'azure-servicetags.json': _parseAzure,
+    'cloudflare-ips.json': _parseCloudflare
+}
+
+# CIDR prefixes are always either disjoint or nested. Sorting by start address with the widest prefix first lets a single stack sweep split parents around their children.
+def _flattenPrefixes(lstPrefixes, version):
+    lstIntervals = []
+    for prefix, provider, service, region, priority in lstPrefixes:
+        try:
+            network = ipaddress.ip_network(prefix, strict=False)
+        except ValueError:
+            continue
+        if network.version != version:
+            continue
+        lstIntervals.append((int(network.network_address), int(network.broadcast_address), priority, (provider, service, region)))
+    lstIntervals.sort(key=lambda interval: (interval[0], -interval[1], interval[2]))
+
+    lstSegments = []
+    def _emit(start, end, attributes):
+        if start <= end:
+            lstSegments.append((start, end, attributes))
+
+    stack = []
+    position = 0
+    for start, end, priority, attributes in lstIntervals:
+        while stack and stack[-1][1] < start:
+            top = stack.pop()
+            _emit(position, top[1], top[2])
+            position = top[1] + 1
+        if stack:
+            _emit(position, start - 1, stack[-1][2])
+        stack.append((start, end, attributes))
+        position = start
+    while stack:
+        top = stack.pop()
+        _emit(position, top[1], top[2])
+        position = top[1] + 1
+
+    addressClass = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    return [[str(addressClass(start)), str(addressClass(end))] + list(attributes) for start, end, attributes in lstSegments]
+
+# Load every available snapshot and build the in-memory interval index. The index is reused across calls and warm Lambda invocations.
+def loadCloudRanges(rangesPath=None):
+    rangesPath = rangesPath or getCloudRangesPath()
+    if rangesPath in _cloudRangeIndexes:
+        return _cloudRangeIndexes[rangesPath]
+    lstPrefixes = []
+    for fileName, parseRanges in CLOUD_RANGE_FILES.items():
+        jsonRanges = _loadJSON(rangesPath + fileName)
+        if jsonRanges is None:
+            print('No cloud range snapshot: ' + fileName)
+            continue
+        lstPrefixes += parseRanges(jsonRanges)
+    lstRanges = _flattenPrefixes(lstPrefixes, 4) + _flattenPrefixes(lstPrefixes, 6)
+    dfRanges = pd.DataFrame(lstRanges, columns=['start_ip', 'end_ip'] + CLOUD_COLUMNS)
+    cloudRangeIndex, indexInfo = brevityprogram.iprange.createIPRangeIndex(dfRanges, CLOUD_COLUMNS)
+    _cloudRangeIndexes[rangesPath] = cloudRangeIndex
+    return cloudRangeIndex
+
+# Tag each address with the cloud provider, service and region. Addresses outside all of the published ranges are tagged as other.
+def classifyIPs(arrIPs, rangesPath=None):
+    cloudRangeIndex = loadCloudRanges(rangesPath)
+    dfResults = brevityprogram.iprange.lookupIPRangeIndex(cloudRangeIndex, arrIPs)
+    dfResults['cloud_provider'] = dfResults['cloud_provider'].fillna('other')
+    dfResults[['cloud_service', 'cloud_region']] = dfResults[['cloud_service', 'cloud_region']].fillna('')
+    return dfResults
+
+# Add the cloud_provider, cloud_service and cloud_region columns for an address column within a dataframe.
+def processCloudProvider(df, ipColumn, rangesPath=None):
+    if ipColumn not in df.columns:
+        return df
+    dfResults = classifyIPs(df[ipColumn].fillna('').astype(str).values, rangesPath)
+    dfResults.index = df.index
+    df = df.drop(columns=[column for column in CLOUD_COLUMNS if column in df.columns])
+    return pd.concat([df, dfResults], axis=1)
@@ -288,4 +288,19 @@ def getProgramInfo(programName):
     ScopeOutWild = dynjson.loads(resp['ScopeOutWild'])
     ScopeOutGeneral = dynjson.loads(resp['ScopeOutGeneral'])
     ScopeOutIP = dynjson.loads(resp['ScopeOutIP'])
-    return programPlatform, inviteType, listscopein, listscopeout, ScopeInURLs, ScopeInGithub, ScopeInWild, ScopeInGeneral, ScopeInIP, ScopeOutURLs, ScopeOutGithub, ScopeOutWild, ScopeOutGeneral, ScopeOutIP
\ No newline at end of file
+    return programPlatform, inviteType, listscopein, listscopeout, ScopeInURLs, ScopeInGithub, ScopeInWild, ScopeInGeneral, ScopeInIP, ScopeOutURLs, ScopeOutGithub, ScopeOutWild, ScopeOutGeneral, ScopeOutIP
+
+# Retrieve the wildcard scopes for every program in a single paginated scan rather than one get_item per program.
+def scan_program_wildcards(dynamodb=None):
+    if not dynamodb:
+        dynamodb = boto3.client('dynamodb')
+    paginator = dynamodb.get_paginator('scan')
+    programWildcards = {}
+    for page in paginator.paginate(TableName='bugbounty', ProjectionExpression='ProgramName, ScopeInWild'):
+        for item in page['Items']:
+            if 'ScopeInWild' not in item:
+                continue
+            scopeInWild = dynjson.loads(item['ScopeInWild'])
+            if scopeInWild:
+                programWildcards[item['ProgramName']['S']] = scopeInWild
+    return programWildcards
@@ -1,44 +1,67 @@
 import json, io
 import brevitycore.core
+import brevityprogram.programs
+import brevityoperations.pipeline
+import brevityoperations.toolchain
 
-def generateScriptGoSpider(programName, inputBucketName):
-    fileBuffer = io.StringIO()
-    fileContents = f"""#!/bin/bash
+# Crawl command and the url extraction pipelines run over its output. Shared by the crawl job and the on-box pipeline (brevityoperations.pipeline).
+def gospiderCommand(inputPath, crawlPath):
+    return ['gospider', '-S', inputPath, '-o', crawlPath, '-u', 'web', '-t', '1', '-c', '5', '-d', '1', '--js', '--sitemap', '--robots', '--other-source', '--include-subs', '--include-other-source']
 
-# Run custom goSpider script
-export HOME=/root
-export PATH=/root/go/bin:$PATH
-mkdir $HOME/security/refined/{programName}
-mkdir $HOME/security/refined/{programName}/crawl
-gospider -S $HOME/security/inputs/{programName}/{programName}-urls-base.txt -o $HOME/security/raw/{programName}/crawl -u web -t 1 -c 5 -d 1 --js --sitemap --robots --other-source --include-subs --include-other-source
-cd $HOME/security/raw/{programName}/
-# Pipes everything within the crawl directory, anew will unique them, and then they are written to a consolidated file.
+# Single pass url extraction (brevityscope.urlextract) writing -urls-min.txt, -urls-max.txt and the per file listings together.
+# seenPath keeps the hashes of the urls from earlier crawls, the urls not seen before go to -urls-new.txt.
+def urlExtractCommand(programName, crawlPath, refinedPath, seenPath=None):
+    command = ['python3', '-m', 'brevityscope.urlextract', '--crawl', crawlPath, '--min', refinedPath + programName + '-urls-min.txt', '--max', refinedPath + programName + '-urls-max.txt', '--simple', refinedPath + 'crawl']
+    if seenPath:
+        command += ['--seen', seenPath, '--new', refinedPath + programName + '-urls-new.txt']
+    return command
+
+# Build the worker agent job for the crawl. The url lists are extracted in one pass once gospider finishes and uploaded to the refined bucket.
 # -urls-min.txt - The regex attempts to only retrieve the base urls, stopping at any parameters.
 # -urls-max.txt - The regex includes all of the full urls but uniques any duplicates.
-cat crawl/* | grep -Eo '(http|https)://[^/?:&"]+' | anew > $HOME/security/refined/{programName}/{programName}-urls-min.txt
-sleep 20
-cat crawl/* | grep -Eo '(http|https):\/\/[^]*]+' | anew > $HOME/security/refined/{programName}/{programName}-urls-max.txt
-sleep 20
-
-# This section will create an individual url listing for each domain passed in to crawl. I have no idea what that last bracket of symbols is doing, but it somehow writes in the filename.
-FILES=$HOME/security/raw/{programName}/crawl/*
-for f in $FILES
-do
-    cat $f | grep -Eo '(http|https)://[^/?:&"]+' | anew > $HOME/security/refined/{programName}/crawl/urls-simple-${{f##*/}}.txt
-done
-sleep 10                                                                      
-sh $HOME/security/run/{programName}/sync-{programName}.sh
-wait
-sh $HOME/security/run/{programName}/stepfunctions-{programName}.sh"""
-
-    fileBuffer.write(fileContents)
-    objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
-    # Upload file to S3
-    object_name = 'crawl-' + programName + '.sh'
-    object_path = 'run/' + programName + '/' + object_name
-    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
-    fileBuffer.close()
-    objectBuffer.close()
+# -urls-new.txt - The full urls that no earlier crawl of the program returned.
+def generateScriptGoSpider(programName, inputBucketName):
+    # The extractor runs from the brevity library zip
+    libraryStatus = brevityoperations.pipeline.uploadLibrary(inputBucketName)
+    libraryPath = '$HOME/security/config/brevity-lib.zip'
+    inputPath = '$HOME/security/inputs/' + programName + '/' + programName + '-urls-base.txt'
+    crawlPath = '$HOME/security/raw/' + programName + '/crawl'
+    refinedPath = '$HOME/security/refined/' + programName + '/'
+    simplePath = refinedPath + 'crawl'
+    seenPath = '$HOME/security/raw/' + programName + '/urls.seen'
+    jobSpec = {
+        'inputs': [
+            {'bucket': inputBucketName, 'key': brevityoperations.pipeline.PIPELINE_LIBRARY_KEY, 'path': libraryPath},
+            {'bucket': inputBucketName, 'key': 'programs/' + programName + '/' + programName + '-urls-base.txt', 'path': inputPath},
+            # The first crawl of a program has no seen file, any other download error keeps the stored seen file from being replaced
+            {'bucket': 'brevity-raw', 'key': 'crawl-seen/' + programName + '/urls.seen', 'path': seenPath, 'optional': True}
+        ],
+        'steps': [
+            {
+                'name': 'gospider',
+                'command': gospiderCommand(inputPath, crawlPath),
+                'requires': inputPath,
+                'cleanDirs': [crawlPath],
+                'uploads': [{'path': crawlPath, 'bucket': 'brevity-raw', 'prefix': 'crawl/' + programName + '/'}]
+            },
+            {
+                'name': 'urls',
+                'command': urlExtractCommand(programName, crawlPath, refinedPath, seenPath),
+                'env': {'PYTHONPATH': libraryPath},
+                'cleanDirs': [simplePath],
+                'uploads': [
+                    {'path': refinedPath + programName + '-urls-min.txt', 'bucket': 'brevity-data', 'key': 'refined/' + programName + '/' + programName + '-urls-min.txt'},
+                    {'path': refinedPath + programName + '-urls-max.txt', 'bucket': 'brevity-data', 'key': 'refined/' + programName + '/' + programName + '-urls-max.txt'},
+                    {'path': refinedPath + programName + '-urls-new.txt', 'bucket': 'brevity-data', 'key': 'refined/' + programName + '/' + programName + '-urls-new.txt'},
+                    # An individual url listing for each domain passed in to crawl, named after the gospider output file
+                    {'path': simplePath, 'bucket': 'brevity-data', 'prefix': 'refined/' + programName + '/crawl/'},
+                    {'path': seenPath, 'bucket': 'brevity-raw', 'key': 'crawl-seen/' + programName + '/urls.seen', 'requiresInput': seenPath}
+                ]
+            }
+        ],
+        'complete': brevityprogram.programs.generateJobComplete(programName, inputBucketName)
+    }
+    status = brevityprogram.programs.uploadJobSpec(programName, inputBucketName, 'crawl', jobSpec)
     return status
 
 def generateInstallScriptGoSpider(inputBucketName):
@@ -83,21 +106,11 @@ apt-get install -y git # May already be installed
 # Install Python and Pip
 apt-get install -y python3 # Likely is already installed
 apt-get install -y python3-pip
-
-# Install Golang via cli
-apt-get install -y golang
-
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-#source ~/.bashrc
     
 # Install aws cli
 apt-get install -y awscli
 
-# Install go tools
-go get -u github.com/tomnomnom/anew
-go get -u github.com/jaeles-project/gospider"""
+{brevityoperations.toolchain.goToolCommands(['anew', 'gospider'])}"""
     fileBuffer.write(fileContents)
     objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
 
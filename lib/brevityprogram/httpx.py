@@ -1,5 +1,30 @@
-import io, json
+import io, json, hashlib, heapq, math
+import boto3
+import tldextract
 import brevitycore.core
+import brevityprogram.programs
+import brevityoperations.toolchain
+
+# Sharded httpx
+# The input list is split into shards that each run as their own worker pool job, named httpx-<shard> so the worker runs run/<program>/httpx-<shard>-<program>.sh.
+# Hosts are grouped by root domain so related hosts land in the same shard, and the groups are spread with a greedy largest-first assignment to keep the shards balanced.
+# Each shard writes its own json output under refined/<program>/httpx-shards/ (outside the httpx json table so Athena does not count it twice) and a done marker under status/httpx-<program>-<output>/ in the inputs bucket.
+# The shard that finds every marker present resumes the step function, and processHttpx merges the shard outputs using the shard manifest.
+HTTPX_SHARD_COUNT = 4
+HTTPX_SHARD_DIR = 'httpx-shards'
+
+def _httpxInput(programName, fileName):
+    gospiderPath = programName + '-urls-base.txt'
+    diffPath = programName + '-domains-new.txt'
+    allPath = programName + '-domains-all.txt'
+    probePath = programName + '-domains-probe.txt'
+    if (fileName == gospiderPath):
+        return programName + '-urls-base.txt', 'crawl'
+    if (fileName == diffPath or fileName == allPath):
+        return programName + '-domains-all.txt', 'initial'
+    if (fileName == probePath):
+        return programName + '-domains-probe.txt', 'initial'
+    return None, None
 
 def prepareHttpx(programName,inputBucketName, fileName):
     
@@ -7,58 +32,128 @@ def prepareHttpx(programName,inputBucketName, fileName):
     gospiderPath = programName + '-urls-base.txt'
     # If operation is initial, it will be domains-new as filename
     diffPath = programName + '-domains-new.txt'
+    # Full initial pass over every known domain
+    allPath = programName + '-domains-all.txt'
     
     # The first iteration of recon is only going to have a -domains-all.csv file. The second recursive iteration after the crawl will have a -urls-mod.txt file.
     if (fileName == gospiderPath):
         inputPath = '$HOME/security/inputs/' + programName + '/' + programName + '-urls-base.txt'
         outputPath = 'crawl'
-    if (fileName == diffPath):
+    if (fileName == diffPath or fileName == allPath):
         inputPath = '$HOME/security/inputs/' + programName + '/' + programName + '-domains-all.txt'
         outputPath = 'initial'
+    # Incremental initial pass - only the new domains plus the stale hosts selected by brevityscope.parser.storeProbeDomains
+    probePath = programName + '-domains-probe.txt'
+    if (fileName == probePath):
+        inputPath = '$HOME/security/inputs/' + programName + '/' + probePath
+        outputPath = 'initial'
     
     scriptStatus = generateScriptHttpx(programName,inputBucketName, inputPath, outputPath)
+    # A single run replaces any earlier sharded run, so processHttpx reads the unsharded output
+    manifestStatus = uploadHttpxShardManifest(programName, inputBucketName, outputPath, 1)
     return scriptStatus
 
-def generateScriptHttpx(programName, inputBucketName, inputPath, outputPath):
-    fileBuffer = io.StringIO()
-    fileContents = f"""#!/bin/bash
-
-# Run custom httpx script
-export HOME=/root
-export PATH=/root/go/bin:$PATH
-
-mkdir $HOME/security/raw/{programName}/responses
-mkdir $HOME/security/raw/{programName}/httpx
-mkdir $HOME/security/presentation
-mkdir $HOME/security/presentation/httpx-json
-
-export HTTPXINPUTPATH={inputPath}
-
-if [ -f "$HTTPXINPUTPATH" ]; then
-    httpx -json -o $HOME/security/presentation/httpx-json/{programName}-httpx-{outputPath}.json -l {inputPath} -status-code -title -location -content-type -web-server -no-color -tls-probe -x GET -ip -cname -cdn -content-length -sr -srd $HOME/security/raw/{programName}/responses -timeout 1
-fi
-sleep 10
-# Remove .txt from all of the files
-echo 'Completed crawl'
-cd $HOME/security/raw/{programName}/responses/
-for f in *.txt; do mv -- "$f" "${{f%.txt}}"; done
-sleep 10
-cd /root/security/raw/{programName}/
-sleep 10
-sh $HOME/security/run/{programName}/sync-{programName}.sh
-wait
-sh $HOME/security/run/{programName}/stepfunctions-{programName}.sh"""
-
-    fileBuffer.write(fileContents)
-    objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
-    # Upload file to S3
-    object_name = 'httpx-' + programName + '.sh'
-    object_path = 'run/' + programName + '/' + object_name
+# Registered domain used to keep related hosts (and urls of the same host) in the same shard. The public suffix list keeps example.co.uk apart from other.co.uk.
+def _shardKey(hostValue):
+    hostName = hostValue.split('://', 1)[-1].split('/', 1)[0].split(':', 1)[0].lower()
+    # IP addresses and unknown suffixes have no registered domain and are grouped by host
+    return tldextract.extract(hostName).registered_domain or hostName
+
+# Split a list of hosts or urls into shardCount balanced shards. Root domains larger than an even share are split into consecutive sorted slices.
+def shardHttpxInput(lstHosts, shardCount):
+    lstHosts = sorted(set([hostValue.strip() for hostValue in lstHosts if hostValue.strip()]))
+    shardSize = max(1, math.ceil(len(lstHosts) / shardCount))
+    rootGroups = {}
+    for hostValue in lstHosts:
+        rootGroups.setdefault(_shardKey(hostValue), []).append(hostValue)
+    lstGroups = []
+    for rootDomain, lstRootHosts in rootGroups.items():
+        for i in range(0, len(lstRootHosts), shardSize):
+            lstGroups.append((rootDomain, lstRootHosts[i:i + shardSize]))
+    # Largest groups first, ordered by hash between groups of the same size so shards are not filled alphabetically
+    lstGroups.sort(key=lambda group: (-len(group[1]), hashlib.md5(group[0].encode()).hexdigest()))
+    shardHeap = [(0, shardIndex) for shardIndex in range(shardCount)]
+    lstShards = [[] for shardIndex in range(shardCount)]
+    for rootDomain, lstGroupHosts in lstGroups:
+        shardTotal, shardIndex = heapq.heappop(shardHeap)
+        lstShards[shardIndex] += lstGroupHosts
+        heapq.heappush(shardHeap, (shardTotal + len(lstGroupHosts), shardIndex))
+    return [sorted(lstShard) for lstShard in lstShards]
+
+# The manifest tells processHttpx how many shard outputs to merge (1 means the run was not sharded)
+def uploadHttpxShardManifest(programName, inputBucketName, outputPath, shardCount):
+    objectBuffer = io.BytesIO(json.dumps({'program': programName, 'operation': outputPath, 'shards': shardCount}).encode())
+    object_path = 'programs/' + programName + '/' + HTTPX_SHARD_DIR + '/' + programName + '-httpx-' + outputPath + '.json'
     status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
-    fileBuffer.close()
     objectBuffer.close()
     return status
 
+# Split the httpx input into shards and generate a script per shard. Returns the worker operations to queue, one per non-empty shard.
+def prepareHttpxShards(programName, inputBucketName, fileName, shardCount=HTTPX_SHARD_COUNT):
+    inputName, outputPath = _httpxInput(programName, fileName)
+    s3client = boto3.client('s3')
+    try:
+        s3Object = s3client.get_object(Bucket=inputBucketName, Key='programs/' + programName + '/' + inputName)
+        lstHosts = s3Object['Body'].read().decode('utf-8').splitlines()
+    except s3client.exceptions.NoSuchKey:
+        lstHosts = []
+    lstShards = [lstShard for lstShard in shardHttpxInput(lstHosts, shardCount) if lstShard]
+    if len(lstShards) <= 1:
+        prepareHttpx(programName, inputBucketName, fileName)
+        return ['httpx']
+    lstOperations = []
+    for shardIndex, lstShard in enumerate(lstShards):
+        shardName = programName + '-' + outputPath + '-' + str(shardIndex) + '.txt'
+        objectBuffer = io.BytesIO(('\n'.join(lstShard) + '\n').encode())
+        brevitycore.core.upload_object(objectBuffer,inputBucketName,'programs/' + programName + '/' + HTTPX_SHARD_DIR + '/' + shardName)
+        objectBuffer.close()
+        inputPath = '$HOME/security/inputs/' + programName + '/' + HTTPX_SHARD_DIR + '/' + shardName
+        generateScriptHttpx(programName, inputBucketName, inputPath, outputPath, shardIndex, len(lstShards))
+        lstOperations.append('httpx-' + str(shardIndex))
+    # Clear the done markers from the previous sharded run before any shard can finish
+    markerPrefix = 'status/httpx-' + programName + '-' + outputPath + '/'
+    response = s3client.list_objects_v2(Bucket=inputBucketName, Prefix=markerPrefix)
+    lstMarkers = [{'Key': s3object['Key']} for s3object in response.get('Contents', [])]
+    if lstMarkers:
+        s3client.delete_objects(Bucket=inputBucketName, Delete={'Objects': lstMarkers})
+    uploadHttpxShardManifest(programName, inputBucketName, outputPath, len(lstShards))
+    return lstOperations
+
+# The httpx probe writes json lines to stdout and the raw responses to responsesPath. Shared by the httpx jobs and the on-box pipeline (brevityoperations.pipeline).
+def httpxCommand(inputPath, responsesPath):
+    return ['httpx', '-silent', '-json', '-l', inputPath, '-status-code', '-title', '-location', '-content-type', '-web-server', '-no-color', '-tls-probe', '-x', 'GET', '-ip', '-cname', '-cdn', '-content-length', '-sr', '-srd', responsesPath, '-timeout', '1']
+
+# Build the worker agent job for httpx. The json output streams straight to the presentation bucket and the responses are added to the response store (brevityscope.responses) once httpx exits.
+def generateScriptHttpx(programName, inputBucketName, inputPath, outputPath, shardIndex=None, shardCount=1):
+    inputName = inputPath.replace('$HOME/security/inputs/' + programName + '/', '')
+    jobComplete = brevityprogram.programs.generateJobComplete(programName, inputBucketName)
+    if shardIndex is None:
+        runOperation = 'httpx'
+        outputName = programName + '-httpx-' + outputPath + '.json'
+        outputKey = 'presentation/httpx-json/' + outputName
+        responsesPath = '$HOME/security/raw/' + programName + '/responses-' + outputPath
+    else:
+        runOperation = 'httpx-' + str(shardIndex)
+        outputName = programName + '-httpx-' + outputPath + '-' + str(shardIndex) + '.json'
+        outputKey = 'refined/' + programName + '/' + HTTPX_SHARD_DIR + '/' + outputName
+        responsesPath = '$HOME/security/raw/' + programName + '/responses-' + outputPath + '-' + str(shardIndex)
+        # Only the last shard to finish resumes the step function
+        jobComplete['barrier'] = {'bucket': inputBucketName, 'prefix': 'status/httpx-' + programName + '-' + outputPath + '/', 'name': shardIndex, 'count': shardCount}
+    jobSpec = {
+        'inputs': [{'bucket': inputBucketName, 'key': 'programs/' + programName + '/' + inputName, 'path': inputPath}],
+        'steps': [{
+            'name': 'httpx',
+            'command': httpxCommand(inputPath, responsesPath),
+            'requires': inputPath,
+            'cleanDirs': [responsesPath],
+            'stdout': {'bucket': 'brevity-data', 'key': outputKey},
+            'uploads': [{'path': responsesPath, 'bucket': 'brevity-raw', 'store': 'store/' + programName + '/', 'stripSuffix': '.txt'}]
+        }],
+        'complete': jobComplete
+    }
+    status = brevityprogram.programs.uploadJobSpec(programName, inputBucketName, runOperation, jobSpec)
+    return status
+
 def generateInstallScriptHttpx(inputBucketName):
     # Load AWS access keys for s3 synchronization
     secretName = 'brevity-aws-recon'
@@ -102,20 +197,11 @@ apt-get install -y git # May already be installed
 # Install Python and Pip
 apt-get install -y python3 # Likely is already installed
 apt-get install -y python3-pip
-
-# Install Golang via cli
-apt-get install -y golang
-
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-#source ~/.bashrc
     
 # Install aws cli
 apt-get install -y awscli
 
-# Install go tools
-GO111MODULE=on go get -v github.com/projectdiscovery/httpx/cmd/httpx"""
+{brevityoperations.toolchain.goToolCommands(['httpx'])}"""
     fileBuffer.write(fileContents)
     objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
 
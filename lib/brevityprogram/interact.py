@@ -1,5 +1,6 @@
 import io, json
 import brevitycore.core
+import brevityoperations.toolchain
 
 def prepareInteract(programName,inputBucketName, interactType):
     if (interactType == 'server'):
@@ -113,27 +114,11 @@ apt-get install -y git # May already be installed
 # Install Python and Pip
 apt-get install -y python3 # Likely is already installed
 apt-get install -y python3-pip
-
-# Install Golang via cli
-#apt-get install -y golang
-cd $HOME/security/config/
-wget https://go.dev/dl/go1.17.5.linux-amd64.tar.gz
-sudo tar -xvf go1.17.5.linux-amd64.tar.gz
-sudo rm -R /usr/lib/go
-sudo mv go /usr/lib
-
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-source ~/.bashrc
     
 # Install aws cli
 apt-get install -y awscli
 
-# Install go tools
-go install -v github.com/projectdiscovery/interactsh/cmd/interactsh-server@latest
-go install -v github.com/projectdiscovery/interactsh/cmd/interactsh-client@latest
-go install -v github.com/projectdiscovery/notify/cmd/notify@latest"""
+{brevityoperations.toolchain.goToolCommands(['interactsh-server', 'interactsh-client', 'notify'])}"""
     fileBuffer.write(fileContents)
     objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
 
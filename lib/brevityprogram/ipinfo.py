@@ -1,29 +1,163 @@
-import json, requests, csv, boto3
+import json, boto3
+import datetime, time, ipaddress, zlib
+from collections import OrderedDict
+import ipinfo
 import brevitycore.core
-import brevityscope.parser
+
+# IP enrichment through IPInfo
+# Addresses are enriched per /24 (or /48 for IPv6) since the Route53 query logs only provide the client subnet.
+# Lookups are cached in-process across warm Lambda invocations and persisted in DynamoDB, and any misses are resolved with the IPInfo batch endpoint.
+
+IPINFO_CACHE_TABLE = 'brevity_ipinfo_cache'
+IPINFO_CACHE_TTL = 30 * 24 * 60 * 60
+IPINFO_LRU_SIZE = 10000
+IPINFO_FIELDS = ['ip', 'city', 'region', 'country', 'loc', 'org', 'postal', 'timezone', 'country_name', 'latitude', 'longitude']
+# Global secondary index on the DNS table keyed by the ingestion hour (2021-05-01T13) and sorted by the ingestion time, used by the DNS dashboard
+IPINFO_INGESTED_INDEX = 'ingested_hour-ingested-index'
+# Each ingestion hour is spread over this many index partition keys so a busy hour does not write to a single partition
+IPINFO_INGESTED_SHARDS = 8
+
+_ipinfoHandler = None
+_ipinfoCache = OrderedDict()
+# Cleared when the DynamoDB cache table does not exist, the lookups then only use the in-memory cache
+_persistedCacheAvailable = True
+
+# Build the IPInfo handler once per Lambda container rather than retrieving the secret for each address
+def getIPInfoHandler():
+    global _ipinfoHandler
+    if _ipinfoHandler is None:
+        secretName = "brevity-recon-apis"
+        regionName = "us-east-1"
+        secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
+        secretjson = json.loads(secretRetrieved)
+        access_token = secretjson['ipinfo']
+        _ipinfoHandler = ipinfo.getHandler(access_token)
+    return _ipinfoHandler
 
 def retrieveIPInfo(ipAddress):
-    
-    # Retrieve API key for SecurityTrails
-    secretName = "brevity-recon-apis"
-    regionName = "us-east-1"
-    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
-    secretjson = json.loads(secretRetrieved)
-    APIKEY = secretjson['securitytrails']
-    
-    #rootDomainStr = rootDomain[0]
-    url = "https://api.securitytrails.com/v1/domain/" + rootDomain + "/subdomains"
-    querystring = {"children_only":"false","include_inactive":"true"}
-    headers = {"Accept": "application/json","APIKEY": APIKEY}
-    # Initiate request and retrieve results
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    # Normalizing data
-    jsonInfo = response.json()
-  
+    handler = getIPInfoHandler()
+    details = handler.getDetails(ipAddress)
+    return details
+
+# Normalize an address or subnet to the cache key, for example 203.0.113.77 becomes 203.0.113.0/24
+# Route53 logs - when the resolver sent no client subnet, that and any other value that is not an address returns None
+def subnetKey(ipAddress):
+    ipAddress = str(ipAddress).split('/', 1)[0].strip()
     try:
-        jsonSubs = jsonInfo['subdomains']
-        domainList = ['{0}.{1}'.format(sub, rootDomain) for sub in jsonSubs]
-        #print(domainList)
-        return domainList
-    except:
-        return 'no subdomains'
\ No newline at end of file
+        address = ipaddress.ip_address(ipAddress)
+    except ValueError:
+        return None
+    prefixLength = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(ipAddress + '/' + str(prefixLength), strict=False))
+
+def _cacheGet(key):
+    if key in _ipinfoCache:
+        _ipinfoCache.move_to_end(key)
+        return _ipinfoCache[key]
+    return None
+
+def _cachePut(key, details):
+    _ipinfoCache[key] = details
+    _ipinfoCache.move_to_end(key)
+    while len(_ipinfoCache) > IPINFO_LRU_SIZE:
+        _ipinfoCache.popitem(last=False)
+
+# Keep only the fields that are stored, as strings, so cached and fresh lookups look the same
+def _normalizeDetails(details):
+    return {field: str(details.get(field, '') or '') for field in IPINFO_FIELDS}
+
+# Retrieve persisted lookups from DynamoDB. batch_get_item accepts a maximum of 100 keys per call.
+def _retrievePersistedDetails(lstKeys, dynamodbclient):
+    persistedDetails = {}
+    now = int(time.time())
+    for i in range(0, len(lstKeys), 100):
+        requestItems = {IPINFO_CACHE_TABLE: {'Keys': [{'subnet': {'S': key}} for key in lstKeys[i:i + 100]]}}
+        while requestItems:
+            response = dynamodbclient.batch_get_item(RequestItems=requestItems)
+            for item in response['Responses'].get(IPINFO_CACHE_TABLE, []):
+                if int(item['expires']['N']) > now:
+                    persistedDetails[item['subnet']['S']] = json.loads(item['details']['S'])
+            requestItems = response.get('UnprocessedKeys')
+    return persistedDetails
+
+def _storePersistedDetails(newDetails, dynamodbclient):
+    expires = str(int(time.time()) + IPINFO_CACHE_TTL)
+    lstItems = [{'PutRequest': {'Item': {'subnet': {'S': key}, 'details': {'S': json.dumps(details)}, 'expires': {'N': expires}}}} for key, details in newDetails.items()]
+    batchWriteItems(IPINFO_CACHE_TABLE, lstItems, dynamodbclient)
+
+# Write items in batches of 25 (the batch_write_item limit) and resubmit anything DynamoDB returns as unprocessed
+def batchWriteItems(tableName, lstItems, dynamodbclient):
+    for i in range(0, len(lstItems), 25):
+        requestItems = {tableName: lstItems[i:i + 25]}
+        retries = 0
+        while requestItems:
+            response = dynamodbclient.batch_write_item(RequestItems=requestItems)
+            requestItems = response.get('UnprocessedItems')
+            if requestItems:
+                retries += 1
+                time.sleep(min(0.05 * (2 ** retries), 2))
+    return 'Success'
+
+# Enrich a list of addresses or subnets. Returns a dictionary of subnet key to the IPInfo details for the first address of the subnet.
+def retrieveIPInfoBatch(lstAddresses, dynamodbclient=None):
+    global _persistedCacheAvailable
+    if not dynamodbclient:
+        dynamodbclient = boto3.client('dynamodb')
+    # Addresses without a valid subnet are left out rather than failing the whole batch
+    lstKeys = sorted(set([subnetKey(address) for address in lstAddresses]) - {None})
+    subnetDetails = {}
+    lstMissing = []
+    for key in lstKeys:
+        details = _cacheGet(key)
+        if details is None:
+            lstMissing.append(key)
+        else:
+            subnetDetails[key] = details
+    if lstMissing and _persistedCacheAvailable:
+        try:
+            persistedDetails = _retrievePersistedDetails(lstMissing, dynamodbclient)
+        except dynamodbclient.exceptions.ResourceNotFoundException:
+            print('No ' + IPINFO_CACHE_TABLE + ' table, using the in-memory cache only')
+            _persistedCacheAvailable = False
+            persistedDetails = {}
+        for key, details in persistedDetails.items():
+            _cachePut(key, details)
+            subnetDetails[key] = details
+        lstMissing = [key for key in lstMissing if key not in persistedDetails]
+    if lstMissing:
+        # The first address of each subnet is looked up, matching what the DNS query log provides
+        lookupAddresses = {key.split('/', 1)[0]: key for key in lstMissing}
+        handler = getIPInfoHandler()
+        batchDetails = handler.getBatchDetails(list(lookupAddresses.keys()))
+        newDetails = {}
+        for address, key in lookupAddresses.items():
+            if isinstance(batchDetails.get(address), dict):
+                details = _normalizeDetails(batchDetails[address])
+                newDetails[key] = details
+                _cachePut(key, details)
+                subnetDetails[key] = details
+        if newDetails and _persistedCacheAvailable:
+            try:
+                _storePersistedDetails(newDetails, dynamodbclient)
+            except dynamodbclient.exceptions.ResourceNotFoundException:
+                print('No ' + IPINFO_CACHE_TABLE + ' table, using the in-memory cache only')
+                _persistedCacheAvailable = False
+    return subnetDetails
+
+# The ingestion hour bucket of an ingestion timestamp, for example 2021-05-01T13:05:00.000000Z is in 2021-05-01T13
+def ingestedHour(ingestedTimestamp):
+    return ingestedTimestamp[:13]
+
+# The index key of a record, the ingestion hour and a shard taken from the query id, for example 2021-05-01T13#5
+def ingestedHourKey(ingestedTimestamp, queryid):
+    return ingestedHour(ingestedTimestamp) + '#' + str(zlib.crc32(queryid.encode()) % IPINFO_INGESTED_SHARDS)
+
+# Every index key (ingestion hour and shard) from the hour of startTimestamp to the hour of endTimestamp
+def ingestedHourKeys(startTimestamp, endTimestamp):
+    hourValue = datetime.datetime.strptime(ingestedHour(startTimestamp), '%Y-%m-%dT%H')
+    endHour = datetime.datetime.strptime(ingestedHour(endTimestamp), '%Y-%m-%dT%H')
+    lstKeys = []
+    while hourValue <= endHour:
+        lstKeys += [hourValue.strftime('%Y-%m-%dT%H') + '#' + str(shard) for shard in range(IPINFO_INGESTED_SHARDS)]
+        hourValue += datetime.timedelta(hours=1)
+    return lstKeys
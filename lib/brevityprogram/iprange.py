@@ -0,0 +1,154 @@
+import ipaddress, json, os
+import numpy as np
+import pandas as pd
+
+# Offline IP range index used to enrich addresses without calling an API per address.
+# The index is built from a downloadable range dump in CSV form (for example the IPInfo country/ASN database) with a start address, an end address and attribute columns.
+# IPv4 ranges are stored as uint32 arrays. NumPy has no uint128 type, so IPv6 ranges are stored as 16 byte big-endian keys ('S16') which sort in the same order as the integer value.
+# Attribute columns are dictionary encoded - each row holds an int32 code into a list of distinct values.
+# Lookups are a single vectorized searchsorted per address family, so millions of addresses are enriched in one call.
+
+IPRANGE_FAMILIES = ['v4', 'v6']
+
+_ipRangeIndexes = {}
+
+# Convert a series of address strings to uint32 values. Returns the values and a mask of the rows that are IPv4.
+def _parseIPv4(seriesIPs):
+    isV4 = seriesIPs.str.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$').fillna(False).values
+    octets = seriesIPs[isV4].str.split('.', expand=True)
+    arrV4 = np.zeros(len(seriesIPs), dtype=np.uint32)
+    if isV4.any():
+        octets = octets.astype(np.uint32).values
+        arrV4[isV4] = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+    return arrV4, isV4
+
+# Convert IPv6 address strings to their packed 16 byte form. Invalid values become the lowest key and will not match a range.
+def _parseIPv6(lstIPs):
+    lstPacked = []
+    for ipValue in lstIPs:
+        try:
+            lstPacked.append(ipaddress.IPv6Address(ipValue).packed)
+        except ValueError:
+            lstPacked.append(b'')
+    return np.array(lstPacked, dtype='S16')
+
+# Normalize input values to plain address strings. CIDR values such as Route53 client subnets use the first address of the range.
+def _normalizeIPs(arrIPs):
+    seriesIPs = pd.Series(arrIPs).astype(str).str.strip()
+    seriesIPs = seriesIPs.str.split('/', n=1).str[0]
+    return seriesIPs.reset_index(drop=True)
+
+# Build the in-memory range index from a dataframe of ranges. Returns the index and the metadata written to index.json.
+def createIPRangeIndex(dfRanges, attributeColumns=None, startColumn='start_ip', endColumn='end_ip'):
+    dfRanges = dfRanges.reset_index(drop=True)
+    if attributeColumns is None:
+        attributeColumns = [column for column in dfRanges.columns if column not in [startColumn, endColumn]]
+    seriesStart = _normalizeIPs(dfRanges[startColumn])
+    seriesEnd = _normalizeIPs(dfRanges[endColumn])
+    arrStart, isV4 = _parseIPv4(seriesStart)
+    arrEnd, isEndV4 = _parseIPv4(seriesEnd)
+    isV4 = isV4 & isEndV4
+    isV6 = (~isV4) & seriesStart.str.contains(':').values
+
+    # Encode each attribute once for both address families so the codes share a single value list
+    indexInfo = {'attributes': attributeColumns, 'categories': {}, 'ranges': {}}
+    ipRangeIndex = {'attributes': attributeColumns, 'categories': {}}
+    attributeCodes = {}
+    for column in attributeColumns:
+        codes, categories = pd.factorize(dfRanges[column])
+        attributeCodes[column] = codes.astype(np.int32)
+        indexInfo['categories'][column] = [str(category) for category in categories]
+        ipRangeIndex['categories'][column] = np.array(indexInfo['categories'][column] + [None], dtype=object)
+
+    for family, familyMask in [('v4', isV4), ('v6', isV6)]:
+        if family == 'v4':
+            familyStart = arrStart[familyMask]
+            familyEnd = arrEnd[familyMask]
+        else:
+            familyStart = _parseIPv6(seriesStart[familyMask].tolist())
+            familyEnd = _parseIPv6(seriesEnd[familyMask].tolist())
+        order = np.argsort(familyStart, kind='mergesort')
+        ipRangeIndex[family] = {
+            'start': familyStart[order],
+            'end': familyEnd[order],
+            'codes': {column: attributeCodes[column][familyMask][order] for column in attributeColumns}
+        }
+        indexInfo['ranges'][family] = int(len(order))
+    return ipRangeIndex, indexInfo
+
+# Build the range index from a CSV file (local or s3:// path) and write it to the indexPath directory.
+def buildIPRangeIndex(csvPath, indexPath, attributeColumns=None, startColumn='start_ip', endColumn='end_ip'):
+    dfRanges = pd.read_csv(csvPath, dtype=str, keep_default_na=False)
+    ipRangeIndex, indexInfo = createIPRangeIndex(dfRanges, attributeColumns, startColumn, endColumn)
+    os.makedirs(indexPath, exist_ok=True)
+    for family in IPRANGE_FAMILIES:
+        np.save(os.path.join(indexPath, family + '-start.npy'), ipRangeIndex[family]['start'])
+        np.save(os.path.join(indexPath, family + '-end.npy'), ipRangeIndex[family]['end'])
+        for column in indexInfo['attributes']:
+            np.save(os.path.join(indexPath, family + '-' + column + '.npy'), ipRangeIndex[family]['codes'][column])
+    with open(os.path.join(indexPath, 'index.json'), 'w') as infoFile:
+        json.dump(indexInfo, infoFile)
+    return indexInfo
+
+# Load an index directory. The arrays are memory-mapped and the loaded index is kept for reuse across calls (and warm Lambda invocations).
+def loadIPRangeIndex(indexPath):
+    if indexPath in _ipRangeIndexes:
+        return _ipRangeIndexes[indexPath]
+    with open(os.path.join(indexPath, 'index.json')) as infoFile:
+        indexInfo = json.load(infoFile)
+    ipRangeIndex = {'attributes': indexInfo['attributes'], 'categories': {}}
+    for column in indexInfo['attributes']:
+        ipRangeIndex['categories'][column] = np.array(indexInfo['categories'][column] + [None], dtype=object)
+    for family in IPRANGE_FAMILIES:
+        ipRangeIndex[family] = {
+            'start': np.load(os.path.join(indexPath, family + '-start.npy'), mmap_mode='r'),
+            'end': np.load(os.path.join(indexPath, family + '-end.npy'), mmap_mode='r'),
+            'codes': {column: np.load(os.path.join(indexPath, family + '-' + column + '.npy'), mmap_mode='r') for column in indexInfo['attributes']}
+        }
+    _ipRangeIndexes[indexPath] = ipRangeIndex
+    return ipRangeIndex
+
+# Find the range position for each key. Returns -1 where the key does not fall inside a range.
+def _searchRanges(arrStart, arrEnd, arrKeys):
+    positions = np.searchsorted(arrStart, arrKeys, side='right') - 1
+    if len(arrStart) == 0:
+        return np.full(len(arrKeys), -1)
+    clipped = np.clip(positions, 0, len(arrStart) - 1)
+    matched = (positions >= 0) & (arrKeys <= arrEnd[clipped])
+    return np.where(matched, positions, -1)
+
+# Enrich an array of addresses. Returns a dataframe aligned with the input containing one column per attribute (None where no range matched).
+def lookupIPRanges(indexPath, arrIPs):
+    ipRangeIndex = loadIPRangeIndex(indexPath)
+    return lookupIPRangeIndex(ipRangeIndex, arrIPs)
+
+# Same as lookupIPRanges but against an index that is already loaded or was created in memory.
+def lookupIPRangeIndex(ipRangeIndex, arrIPs):
+    seriesIPs = _normalizeIPs(arrIPs)
+    arrV4, isV4 = _parseIPv4(seriesIPs)
+    isV6 = (~isV4) & seriesIPs.str.contains(':').values
+    dfResults = pd.DataFrame(index=range(len(seriesIPs)))
+    familyPositions = {
+        'v4': _searchRanges(ipRangeIndex['v4']['start'], ipRangeIndex['v4']['end'], arrV4[isV4]),
+        'v6': _searchRanges(ipRangeIndex['v6']['start'], ipRangeIndex['v6']['end'], _parseIPv6(seriesIPs[isV6].tolist()))
+    }
+    for column in ipRangeIndex['attributes']:
+        categories = ipRangeIndex['categories'][column]
+        # The extra last category is None, used for any address without a match
+        arrCodes = np.full(len(seriesIPs), len(categories) - 1, dtype=np.int64)
+        for family, familyMask in [('v4', isV4), ('v6', isV6)]:
+            positions = familyPositions[family]
+            codes = np.asarray(ipRangeIndex[family]['codes'][column])
+            if len(codes) == 0:
+                continue
+            familyCodes = np.where(positions >= 0, codes[np.clip(positions, 0, len(codes) - 1)], len(categories) - 1)
+            arrCodes[familyMask] = familyCodes
+        dfResults[column] = categories[arrCodes]
+    return dfResults
+
+# Add the range attributes for an address column to a dataframe, for example the httpx ip column or the amass address rows.
+def enrichIPColumn(df, ipColumn, indexPath, columnPrefix='ip_'):
+    dfResults = lookupIPRanges(indexPath, df[ipColumn].fillna('').values)
+    dfResults.columns = [columnPrefix + column for column in dfResults.columns]
+    dfResults.index = df.index
+    return pd.concat([df, dfResults], axis=1)
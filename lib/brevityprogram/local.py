@@ -1,5 +1,6 @@
 import io, json
 import brevitycore.core
+import brevityoperations.toolchain
 
 def prepareLocal(programName,inputBucketName):
     
@@ -81,10 +82,6 @@ yum install -y python3-pip
 # Install Golang via cli
 yum install -y golang
 
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-#source ~/.bashrc
 
 # Install docker
 #curl -fsSL get.docker.com -o get-docker.sh
@@ -105,15 +102,7 @@ pip3 install --upgrade awscli
 #Install amass
 #snap install amass
 
-# Install go tools
-GO111MODULE=on go get -v github.com/projectdiscovery/nuclei/v2/cmd/nuclei
-GO111MODULE=on go get -v github.com/projectdiscovery/httpx/cmd/httpx
-go get -u github.com/tomnomnom/unfurl
-go get -u github.com/ffuf/ffuf
-go get -u github.com/hakluke/hakrawler
-go get -u github.com/tomnomnom/anew
-go get -u github.com/jaeles-project/gospider
-go get -u github.com/svent/sift
+{brevityoperations.toolchain.goToolCommands(['nuclei', 'httpx', 'unfurl', 'ffuf', 'hakrawler', 'anew', 'gospider', 'sift'])}
 
 # Install LinkFinder
 cd /$HOME/security/tools/
@@ -1,5 +1,6 @@
 import io, json
 import brevitycore.core
+import brevityoperations.toolchain
 
 def prepareManual(programName,inputBucketName):
     
@@ -78,13 +79,6 @@ apt-get install -y git # May already be installed
 apt-get install -y python3 # Likely is already installed
 apt-get install -y python3-pip
 
-# Install Golang via cli
-apt-get install -y golang
-
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-#source ~/.bashrc
 
 # Install docker
 #curl -fsSL get.docker.com -o get-docker.sh
@@ -104,15 +98,7 @@ pip3 install --upgrade awscli
 #Install amass
 snap install amass
 
-# Install go tools
-GO111MODULE=on go get -v github.com/projectdiscovery/nuclei/v2/cmd/nuclei
-GO111MODULE=on go get -v github.com/projectdiscovery/httpx/cmd/httpx
-go get -u github.com/tomnomnom/unfurl
-go get -u github.com/ffuf/ffuf
-go get -u github.com/hakluke/hakrawler
-go get -u github.com/tomnomnom/anew
-go get -u github.com/jaeles-project/gospider
-go get -u github.com/svent/sift
+{brevityoperations.toolchain.goToolCommands(['nuclei', 'httpx', 'unfurl', 'ffuf', 'hakrawler', 'anew', 'gospider', 'sift'])}
 
 # Install LinkFinder
 cd /$HOME/security/tools/
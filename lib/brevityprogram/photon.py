@@ -1,7 +1,11 @@
 import json, io
 import brevitycore.core
+import brevityoperations.pipeline
+import brevityoperations.toolchain
 
 def generateScriptPhoton(programName, inputBucketName):
+    # The url extractor runs from the brevity library zip
+    libraryStatus = brevityoperations.pipeline.uploadLibrary(inputBucketName)
     fileBuffer = io.StringIO()
     fileContents = f"""#!/bin/bash
 
@@ -12,20 +16,12 @@ mkdir $HOME/security/refined/{programName}
 mkdir $HOME/security/refined/{programName}/crawl
 gospider -S $HOME/security/inputs/{programName}/{programName}-urls-base.txt -o $HOME/security/raw/{programName}/crawl -u web -t 1 -c 5 -d 1 --js --sitemap --robots --other-source --include-subs --include-other-source
 cd $HOME/security/raw/{programName}/
-# Pipes everything within the crawl directory, anew will unique them, and then they are written to a consolidated file.
+# One pass over the crawl directory (brevityscope.urlextract) writes every listing, unique like anew.
 # -urls-min.txt - The regex attempts to only retrieve the base urls, stopping at any parameters.
 # -urls-max.txt - The regex includes all of the full urls but uniques any duplicates.
-cat crawl/* | grep -Eo '(http|https)://[^/?:&"]+' | anew > $HOME/security/refined/{programName}/{programName}-urls-min.txt
-sleep 20
-cat crawl/* | grep -Eo '(http|https):\/\/[^]*]+' | anew > $HOME/security/refined/{programName}/{programName}-urls-max.txt
-sleep 20
-
-# This section will create an individual url listing for each domain passed in to crawl. I have no idea what that last bracket of symbols is doing, but it somehow writes in the filename.
-FILES=$HOME/security/raw/{programName}/crawl/*
-for f in $FILES
-do
-    cat $f | grep -Eo '(http|https)://[^/?:&"]+' | anew > $HOME/security/refined/{programName}/crawl/urls-simple-${{f##*/}}.txt
-done
+# crawl/urls-simple-<file>.txt - An individual url listing for each domain passed in to crawl, named after the crawl output file.
+aws s3 cp s3://{inputBucketName}/config/brevity-lib.zip $HOME/security/config/
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -m brevityscope.urlextract --crawl $HOME/security/raw/{programName}/crawl --min $HOME/security/refined/{programName}/{programName}-urls-min.txt --max $HOME/security/refined/{programName}/{programName}-urls-max.txt --simple $HOME/security/refined/{programName}/crawl
 sleep 10                                                                      
 sh $HOME/security/run/{programName}/sync-{programName}.sh
 wait
@@ -83,21 +79,11 @@ apt-get install -y git # May already be installed
 # Install Python and Pip
 apt-get install -y python3 # Likely is already installed
 apt-get install -y python3-pip
-
-# Install Golang via cli
-apt-get install -y golang
-
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-#source ~/.bashrc
     
 # Install aws cli
 apt-get install -y awscli
 
-# Install go tools
-go get -u github.com/tomnomnom/anew
-go get -u github.com/jaeles-project/gospider"""
+{brevityoperations.toolchain.goToolCommands(['anew', 'gospider'])}"""
     fileBuffer.write(fileContents)
     objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
 
@@ -8,6 +8,7 @@ import brevitycore.core
 import brevityprogram.dynamodb
 import brevityscope.scope
 import brevityscope.parser
+import brevityoperations.sync
 
 def generate_program(programPlatform, inviteType, listscopein, listscopeout, programName, scopeInURLs, scopeInGithub, scopeInWild, scopeInGeneral, scopeInIP, scopeOutURLs, scopeOutGithub, scopeOutWild, scopeOutGeneral, scopeOutIP):
     try:
@@ -64,37 +65,38 @@ mkdir $HOME/security/presentation/{programName}
 mkdir $HOME/security/presentation/{programName}/httpx
 mkdir $HOME/security/presentation/{programName}/httpx-json
 
-# Retrieve any configuration updates
-aws s3 sync s3://brevity-inputs/config/ $HOME/security/config/
-
-# Retrieve any new scopes specific for amass
-aws s3 sync s3://brevity-inputs/scope/{programName}/ $HOME/security/tools/amass/
-
-# Retrieve custom input scopes for programs
-aws s3 sync s3://brevity-inputs/programs/{programName}/ $HOME/security/inputs/{programName}/
-
-# Retrieve run files specific for program
-aws s3 sync s3://brevity-inputs/run/{programName}/ $HOME/security/run/{programName}/
-    
-# Submit any new data
-# aws s3 sync $HOME/security/raw/{programName}/ s3://brevity-data/raw/{programName}/
-aws s3 sync $HOME/security/refined/{programName}/ s3://brevity-data/refined/{programName}/
-
-# Load configs
-aws s3 sync s3://brevity-inputs/tools/ $HOME/security/tools/
-
-# Copy files from server post operations to S3 raw bucket
-aws s3 cp --recursive $HOME/security/raw/{programName}/responses/ s3://brevity-raw/responses/{programName}/
-aws s3 cp --recursive $HOME/security/raw/{programName}/httpx/ s3://brevity-raw/httpx/{programName}/
-aws s3 cp --recursive $HOME/security/raw/{programName}/crawl/ s3://brevity-raw/crawl/{programName}/
-aws s3 cp --recursive $HOME/security/presentation/httpx-json/ s3://brevity-data/presentation/httpx-json/
-aws s3 cp --recursive $HOME/security/presentation/{programName}/httpx/ s3://brevity-data/presentation/httpx/
-aws s3 cp --recursive $HOME/security/presentation/{programName}/nuclei/ s3://brevity-data/presentation/nuclei/"""
+# Retrieve the delta sync tool. Everything else only transfers what changed since the last sync (see brevityoperations.sync).
+aws s3 cp s3://brevity-inputs/config/brevity-sync.py $HOME/security/config/brevity-sync.py
+python3 -c 'import boto3' 2>/dev/null || pip3 install boto3
+python3 $HOME/security/config/brevity-sync.py --bucket brevity-inputs --spec run/{programName}/sync-{programName}.json"""
     fileBuffer.write(fileContents)
     #objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
     return fileBuffer
 
+# Sync pairs for the program sync script, in the order the old aws s3 sync / cp commands ran. archive batches the small files into tar.gz objects.
+def generateProgramSyncSpec(programName):
+    lstPairs = [
+        {'name': 'config', 'direction': 'down', 'path': '$HOME/security/config/', 'bucket': 'brevity-inputs', 'prefix': 'config/'},
+        {'name': 'scope', 'direction': 'down', 'path': '$HOME/security/tools/amass/', 'bucket': 'brevity-inputs', 'prefix': 'scope/' + programName + '/'},
+        {'name': 'inputs', 'direction': 'down', 'path': '$HOME/security/inputs/' + programName + '/', 'bucket': 'brevity-inputs', 'prefix': 'programs/' + programName + '/'},
+        {'name': 'run', 'direction': 'down', 'path': '$HOME/security/run/' + programName + '/', 'bucket': 'brevity-inputs', 'prefix': 'run/' + programName + '/'},
+        {'name': 'refined', 'direction': 'up', 'path': '$HOME/security/refined/' + programName + '/', 'bucket': 'brevity-data', 'prefix': 'refined/' + programName + '/'},
+        {'name': 'tools', 'direction': 'down', 'path': '$HOME/security/tools/', 'bucket': 'brevity-inputs', 'prefix': 'tools/'},
+        {'name': 'responses', 'direction': 'up', 'path': '$HOME/security/raw/' + programName + '/responses/', 'bucket': 'brevity-raw', 'prefix': 'responses/' + programName + '/'},
+        {'name': 'httpx', 'direction': 'up', 'path': '$HOME/security/raw/' + programName + '/httpx/', 'bucket': 'brevity-raw', 'prefix': 'httpx/' + programName + '/', 'archive': True},
+        {'name': 'crawl', 'direction': 'up', 'path': '$HOME/security/raw/' + programName + '/crawl/', 'bucket': 'brevity-raw', 'prefix': 'crawl/' + programName + '/', 'archive': True},
+        {'name': 'httpx-json', 'direction': 'up', 'path': '$HOME/security/presentation/httpx-json/', 'bucket': 'brevity-data', 'prefix': 'presentation/httpx-json/'},
+        {'name': 'presentation-httpx', 'direction': 'up', 'path': '$HOME/security/presentation/' + programName + '/httpx/', 'bucket': 'brevity-data', 'prefix': 'presentation/httpx/'},
+        {'name': 'nuclei', 'direction': 'up', 'path': '$HOME/security/presentation/' + programName + '/nuclei/', 'bucket': 'brevity-data', 'prefix': 'presentation/nuclei/'}
+    ]
+    return {'program': programName, 'pairs': lstPairs}
+
 def prepareProgram(programName,inputBucketName):
+    syncStatus = brevityoperations.sync.uploadSyncTool(inputBucketName)
+    objectBuffer = io.BytesIO(json.dumps(generateProgramSyncSpec(programName), indent=1).encode())
+    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,'run/' + programName + '/sync-' + programName + '.json')
+    objectBuffer.close()
+
     fileBuffer = generateProgramSyncScript(programName)
     objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
 
@@ -140,6 +142,40 @@ aws stepfunctions send-task-success --task-token {taskToken} --task-output '{sta
     status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
     fileBuffer.close()
     objectBuffer.close()
+    # The worker agent resumes the step function itself through boto3 using the same token and output
+    objectBuffer = io.BytesIO(json.dumps({'taskToken': taskToken, 'output': json.loads(stateInput)}).encode())
+    object_path = 'run/' + programName + '/stepfunctions-' + programName + '.json'
+    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
+    objectBuffer.close()
+    return status
+
+# Completion block for a job spec - the agent reads the step functions task file written by generateScriptStepFunctions
+def generateJobComplete(programName, inputBucketName):
+    return {'bucket': inputBucketName, 'key': 'run/' + programName + '/stepfunctions-' + programName + '.json'}
+
+# Upload a worker agent job spec (run/<program>/<operation>-<program>.json) and the run script that hands it to the agent.
+# Pooled workers pick up the spec directly, dedicated droplets still run the .sh script from their user data.
+def uploadJobSpec(programName, inputBucketName, runOperation, jobSpec):
+    jobSpec = dict(jobSpec, program=programName, operation=runOperation)
+    objectBuffer = io.BytesIO(json.dumps(jobSpec, indent=1).encode())
+    spec_path = 'run/' + programName + '/' + runOperation + '-' + programName + '.json'
+    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,spec_path)
+    objectBuffer.close()
+
+    fileBuffer = io.StringIO()
+    fileContents = f"""#!/bin/bash
+
+# Run the {runOperation} job spec with the worker agent
+export HOME=/root
+export PATH=/root/go/bin:$PATH
+python3 -c 'import boto3' 2>/dev/null || pip3 install boto3
+python3 $HOME/security/config/brevity-agent.py --bucket {inputBucketName} --job {spec_path}"""
+    fileBuffer.write(fileContents)
+    objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
+    object_path = 'run/' + programName + '/' + runOperation + '-' + programName + '.sh'
+    status = brevitycore.core.upload_object(objectBuffer,inputBucketName,object_path)
+    fileBuffer.close()
+    objectBuffer.close()
     return status
 
 # This approach is no longer in-use. Moving functionality from DO Droplet to persistent EC2 instance that is always syncing S3 bucket of responses to attached EBS volume. Will eventually delete this function once the EC2 code is complete.
@@ -162,12 +198,14 @@ export AWS_DEFAULT_REGION=us-east-1
 export HOME=/root
 export PATH=/root/go/bin:$PATH
 
-# Retrieve zipped and compressed responses file
-aws s3 cp s3://brevity-data/refined/{programName}/{programName}-responses.tar.gz $HOME/security/raw/{programName}/
+# Read the responses straight out of the random access archive (brevityscope.archive) with ranged GETs, no tar.gz download and extract
+aws s3 cp s3://{inputBucketName}/config/brevity-lib.zip $HOME/security/config/
 
 wait
 cd $HOME/security/raw/{programName}/
-tar -xvzf {programName}-responses.tar.gz
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -m brevityscope.archive extract s3://brevity-data/refined/{programName}/{programName}-responses.pack --output $HOME/security/raw/{programName}/responses
+# The responses are named by body hash, keep the hash to response name and url mapping with the matches
+aws s3 cp s3://brevity-data/refined/{programName}/{programName}-responses-index.csv $HOME/security/raw/{programName}/matches-{programName}-index.csv
 wait
 sift -f $HOME/security/config/search-keywords.csv $HOME/security/raw/{programName}/responses -o matches-{programName}-keywords.txt --only-matching
 wait
@@ -1,4 +1,6 @@
 import json, requests, csv, boto3
+import asyncio, datetime, time
+from concurrent.futures import ThreadPoolExecutor
 import brevitycore.core
 import brevityscope.parser
 
@@ -26,4 +28,104 @@ def retrieveSecurityTrailsDomains(rootDomain):
         #print(domainList)
         return domainList
     except:
-        return 'no subdomains'
\ No newline at end of file
+        return 'no subdomains'
+
+# Batched SecurityTrails retrieval
+# All of the wildcard roots for a program are fetched concurrently through one shared session while a token bucket keeps the request rate within the API quota.
+# Each response is cached in S3 keyed by root domain and date so re-runs on the same day do not spend API credits.
+
+# SecurityTrails API quota - requests per second and the burst size allowed by the plan
+SECURITYTRAILS_RATE = 1.0
+SECURITYTRAILS_BURST = 1
+SECURITYTRAILS_CACHE_PREFIX = 'refined/securitytrails-cache/'
+
+# Simple token bucket shared by all of the concurrent requests
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def getSecurityTrailsKey():
+    secretName = "brevity-recon-apis"
+    regionName = "us-east-1"
+    secretRetrieved = brevitycore.core.get_secret(secretName,regionName)
+    secretjson = json.loads(secretRetrieved)
+    return secretjson['securitytrails']
+
+def _cacheKey(rootDomain, cacheDate):
+    return SECURITYTRAILS_CACHE_PREFIX + cacheDate + '/' + rootDomain + '.json'
+
+# Returns the cached subdomain list for the root and date or None if it has not been retrieved yet.
+def retrieveCachedDomains(s3Client, bucketName, rootDomain, cacheDate):
+    try:
+        s3Object = s3Client.get_object(Bucket=bucketName, Key=_cacheKey(rootDomain, cacheDate))
+    except s3Client.exceptions.NoSuchKey:
+        return None
+    return json.loads(s3Object['Body'].read())
+
+def storeCachedDomains(s3Client, bucketName, rootDomain, cacheDate, domainList):
+    s3Client.put_object(Body=json.dumps(domainList), Bucket=bucketName, Key=_cacheKey(rootDomain, cacheDate))
+
+def _requestSubdomains(session, APIKEY, rootDomain):
+    url = "https://api.securitytrails.com/v1/domain/" + rootDomain + "/subdomains"
+    querystring = {"children_only":"false","include_inactive":"true"}
+    headers = {"Accept": "application/json","APIKEY": APIKEY}
+    # A failed request or a non json body (rate limit or error pages) only loses this root, not the whole batch
+    try:
+        response = session.get(url, headers=headers, params=querystring)
+        jsonInfo = response.json()
+        jsonSubs = jsonInfo['subdomains']
+        domainList = ['{0}.{1}'.format(sub, rootDomain) for sub in jsonSubs]
+        return domainList
+    except:
+        return 'no subdomains'
+
+async def _fetchRootDomain(loop, executor, bucket, session, s3Client, APIKEY, bucketName, rootDomain, cacheDate):
+    domainList = await loop.run_in_executor(executor, retrieveCachedDomains, s3Client, bucketName, rootDomain, cacheDate)
+    if domainList is not None:
+        return rootDomain, domainList
+    await bucket.acquire()
+    domainList = await loop.run_in_executor(executor, _requestSubdomains, session, APIKEY, rootDomain)
+    # Failed lookups are not cached so they are retried on the next run
+    if domainList != 'no subdomains':
+        await loop.run_in_executor(executor, storeCachedDomains, s3Client, bucketName, rootDomain, cacheDate, domainList)
+    return rootDomain, domainList
+
+async def _fetchRootDomains(lstRootDomains, bucketName, cacheDate, rate, burst):
+    loop = asyncio.get_running_loop()
+    APIKEY = getSecurityTrailsKey()
+    bucket = TokenBucket(rate, burst)
+    s3Client = boto3.client('s3')
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=8) as executor:
+        tasks = [_fetchRootDomain(loop, executor, bucket, session, s3Client, APIKEY, bucketName, rootDomain, cacheDate) for rootDomain in lstRootDomains]
+        results = await asyncio.gather(*tasks)
+    return results
+
+# Retrieve the subdomains for every root domain and return them as one combined list along with a per root status.
+def retrieveSecurityTrailsDomainsBatch(lstRootDomains, bucketName, rate=SECURITYTRAILS_RATE, burst=SECURITYTRAILS_BURST):
+    cacheDate = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+    lstRootDomains = sorted(set(lstRootDomains))
+    results = asyncio.run(_fetchRootDomains(lstRootDomains, bucketName, cacheDate, rate, burst))
+    allDomains = set()
+    rootStatus = {}
+    for rootDomain, domainList in results:
+        if domainList == 'no subdomains':
+            rootStatus[rootDomain] = domainList
+        else:
+            allDomains.update(domainList)
+            rootStatus[rootDomain] = len(domainList)
+    return list(allDomains), rootStatus
@@ -2,6 +2,7 @@
 
 import io, json
 import brevitycore.core
+import brevityoperations.toolchain
 
 def prepareSemgrep(programName,inputBucketName):
 
@@ -92,14 +93,6 @@ apt-get install -y git # May already be installed
 # Install Python and Pip
 apt-get install -y python3 # Likely is already installed
 apt-get install -y python3-pip
-
-# Install Golang via cli
-apt-get install -y golang
-
-echo 'export GOROOT=/usr/lib/go' >> ~/.bashrc
-echo 'export GOPATH=$HOME/go' >> ~/.bashrc
-echo 'export PATH=$GOPATH/bin:$GOROOT/bin:$PATH' >> ~/.bashrc
-#source ~/.bashrc
     
 # Install aws cli
 apt-get install -y awscli
@@ -107,8 +100,7 @@ apt-get install -y awscli
 # Install semgrep
 python3 -m pip install semgrep
 
-# Install go tools
-GO111MODULE=on go get -v github.com/projectdiscovery/nuclei/v2/cmd/nuclei"""
+{brevityoperations.toolchain.goToolCommands(['nuclei'])}"""
     fileBuffer.write(fileContents)
     objectBuffer = io.BytesIO(fileBuffer.getvalue().encode())
 
@@ -1,5 +1,8 @@
 import io
 import brevitycore.core
+import brevityoperations.pipeline
+
+MATCHER_REQUIREMENTS = ['pyahocorasick==2.0.0']
 
 def prepareSift(programName,inputBucketName):
     #scriptStatus = generateScriptSift(programName, inputBucketName)
@@ -9,6 +12,8 @@ def prepareSift(programName,inputBucketName):
 # This does not yet work. Need to write the EC2 deploy and install script as a dependency.
 def generateScriptSiftAWS(programName, inputBucketName):
     
+    # The matcher runs from the brevity library zip
+    libraryStatus = brevityoperations.pipeline.uploadLibrary(inputBucketName)
     fileBuffer = io.StringIO()
     fileContents = f"""#!/bin/bash
 
@@ -17,20 +22,18 @@ export HOME=/home/ec2-user
 
 cd $HOME/security/raw/{programName}/
 
+# Match every pattern list in a single pass over the unique response bodies (brevityscope.matcher) instead of one sift run per list
+python3 -c 'import pandas, ahocorasick' 2>/dev/null || pip3 install {' '.join(brevityoperations.pipeline.PIPELINE_REQUIREMENTS + MATCHER_REQUIREMENTS)}
+# Add the new bodies to the search index on /data (brevityscope.searchindex), which also downloads them for the matcher
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -m brevityscope.searchindex update --program {programName} --store /data/store/
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -m brevityscope.matcher --program {programName} --config $HOME/security/config/ --output $HOME/security/refined/{programName}/ --store --responses /data/store/{programName}
+# Group near-duplicate pages (brevityscope.cluster) into the unique pages view, one representative url per cluster
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -m brevityscope.cluster --program {programName} --output $HOME/security/refined/{programName}/ --presentation $HOME/security/presentation/{programName}/httpx/ --responses /data/store/{programName}
+# Publish the unique bodies as a random access archive (brevityscope.archive) so single responses can be read with ranged GETs
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -m brevityscope.archive pack /data/store/{programName} s3://brevity-data/refined/{programName}/{programName}-responses.pack
+# The archive entries are named by body hash, publish the hash to response name and url mapping next to it for the sift matches
+PYTHONPATH=$HOME/security/config/brevity-lib.zip python3 -c "import brevityscope.responses; print(brevityscope.responses.publishResponseIndex('{programName}', 'brevity-data', 'refined/{programName}/{programName}-responses-index.csv'))"
 wait
-sift -f $HOME/security/config/sift/search-keywords.csv /data/responses/{programName} -o matches-{programName}-keywords.txt --literal --only-matching
-wait
-sift -f $HOME/security/config/sift/search-regex.csv /data/responses/{programName} -o matches-{programName}-extensions.txt --only-matching
-wait
-sift -f $HOME/security/config/sift/search-extensions.csv /data/responses/{programName} -o matches-{programName}-extensions.txt --only-matching
-wait
-sift -f $HOME/security/config/search-filenames.csv /data/responses/{programName} -o matches-{programName}-filenames.txt --only-matching
-wait
-sift -f $HOME/security/config/search-phrases.csv /data/responses/{programName} -o matches-{programName}-phrases.txt --only-matching
-wait
-sleep 10
-mv $HOME/security/raw/{programName}/matches-* $HOME/security/refined/{programName}/
-sleep 10
 # rm -r responses
 # sleep 10
 sh $HOME/security/config/sync-{programName}.sh"""
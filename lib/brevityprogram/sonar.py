@@ -1,21 +1,28 @@
-import boto3, io, botocore, json, requests
+import boto3, io, botocore, json, requests, re, time
 import pandas as pd
 from botocore.exceptions import ClientError
 import logging
 import tldextract
 import brevitycore.core
 import brevityprogram.dynamodb
+import brevityprogram.sonarindex
 import brevityscope.parser
 from dynamodb_json import json_util as dynjson
 
-# This function will concatenate the wildcard scope domains to incorporate into one larger Athena query.    
-def sonarRun(programName, refinedBucketPath, ATHENA_DB, ATHENA_BUCKET, ATHENA_TABLE):
+# This function will concatenate the wildcard scope domains to incorporate into one larger Athena query.
+# If the reversed hostname table is available, the wildcards are converted into prefix range scans against it and the latest date is resolved once from the Glue catalog instead of a correlated MAX(date) subquery.
+def sonarRun(programName, refinedBucketPath, ATHENA_DB, ATHENA_BUCKET, ATHENA_TABLE, ATHENA_REVERSED_TABLE=None):
     
     resp = brevityprogram.dynamodb.query_program(programName)
     searchDomains = dynjson.loads(resp['ScopeInWild'])
     if not searchDomains:
         execid = 'No Wildcards'
         return execid
+    elif ATHENA_REVERSED_TABLE is not None:
+        sonarDate = sonarLatestDate(ATHENA_DB, ATHENA_REVERSED_TABLE)
+        query = generateSonarReversedQuery(searchDomains, ATHENA_REVERSED_TABLE, sonarDate)
+        execid = brevitycore.core.queryathena(ATHENA_DB, ATHENA_BUCKET, query)
+        return execid
     else:
         searchDomains = [s.replace("*", "'%") for s in searchDomains]
         searchDomains = [s + "'" for s in searchDomains]
@@ -25,6 +32,199 @@ def sonarRun(programName, refinedBucketPath, ATHENA_DB, ATHENA_BUCKET, ATHENA_TA
         # Utilize executionID to retrieve results
         return execid
 
+# Reverse the labels of a hostname so that www.example.com becomes com.example.www. Suffix matches on the hostname become prefix matches on the reversed value.
+def reverseDomain(domainName):
+    labels = domainName.strip('.').lower().split('.')
+    labels.reverse()
+    return '.'.join(labels)
+
+# Convert a wildcard scope entry such as *.example.com into the tld partition value and the reversed prefix (com.example.) used for the range scan.
+def parseSonarWildcard(wildcardDomain):
+    rootDomain = re.sub(r'^.*?\*\.', '', wildcardDomain)
+    rootDomain = rootDomain.replace('*', '').strip('.').lower()
+    if not rootDomain:
+        return None, None
+    reversePrefix = reverseDomain(rootDomain) + '.'
+    tld = reversePrefix.split('.')[0]
+    return tld, reversePrefix
+
+# Generate the Sonar query against the reversed hostname table.
+# Each wildcard becomes a bounded range on reversename ('com.example.' <= reversename < 'com.example/') within its tld partition. The '/' character sorts directly after '.', so the upper bound closes the prefix.
+def generateSonarReversedQuery(searchDomains, ATHENA_REVERSED_TABLE, sonarDate):
+    lstConditions = []
+    for wildcardDomain in searchDomains:
+        tld, reversePrefix = parseSonarWildcard(wildcardDomain)
+        if reversePrefix is None:
+            continue
+        tld = tld.replace("'", "''")
+        reversePrefix = reversePrefix.replace("'", "''")
+        reverseUpper = reversePrefix[:-1] + '/'
+        lstConditions.append("(tld = '%s' AND reversename >= '%s' AND reversename < '%s')" % (tld, reversePrefix, reverseUpper))
+    # Remove duplicate wildcards while keeping the query deterministic
+    lstConditions = sorted(set(lstConditions))
+    searchDomainString = ' OR '.join(lstConditions)
+    query = "SELECT name, type, value FROM %s WHERE date = '%s' AND (%s);" % (ATHENA_REVERSED_TABLE, sonarDate, searchDomainString)
+    return query
+
+# Partition values of a table from the Glue data catalog. This is a metadata lookup and does not scan any of the FDNS data.
+def _partitionValues(ATHENA_DB, tableName):
+    glueClient = boto3.client('glue')
+    paginator = glueClient.get_paginator('get_partitions')
+    lstValues = []
+    for page in paginator.paginate(DatabaseName=ATHENA_DB, TableName=tableName, ExcludeColumnSchema=True):
+        lstValues += [partition['Values'] for partition in page['Partitions']]
+    return lstValues
+
+# Resolve the most recent date partition. The date is always the first partition key for both the raw and reversed tables.
+def sonarLatestDate(ATHENA_DB, tableName):
+    lstDates = [values[0] for values in _partitionValues(ATHENA_DB, tableName)]
+    if not lstDates:
+        raise ValueError('No date partitions registered for ' + ATHENA_DB + '.' + tableName)
+    return max(lstDates)
+
+# Athena runs DDL asynchronously, wait for it before the table is used
+def _waitAthenaQuery(execid, iterations=60):
+    athena = boto3.client('athena')
+    while (iterations > 0):
+        iterations = iterations - 1
+        queryStatus = athena.get_query_execution(QueryExecutionId=execid)['QueryExecution']['Status']
+        if queryStatus['State'] == 'SUCCEEDED':
+            return execid
+        if queryStatus['State'] in ('FAILED', 'CANCELLED'):
+            raise RuntimeError('Athena query ' + execid + ' ' + queryStatus['State'] + ': ' + queryStatus.get('StateChangeReason', ''))
+        time.sleep(2)
+    raise RuntimeError('Athena query ' + execid + ' did not finish')
+
+# Create the derived reversed hostname table. It is stored as parquet and partitioned by date and tld so that Athena can prune to a single date and the handful of tlds in scope.
+def generateSonarReversedTableQuery(ATHENA_REVERSED_TABLE, reversedBucketPath):
+    query = """CREATE EXTERNAL TABLE IF NOT EXISTS %s (
+    reversename string,
+    name string,
+    type string,
+    value string
+)
+PARTITIONED BY (date string, tld string)
+STORED AS PARQUET
+LOCATION '%s';""" % (ATHENA_REVERSED_TABLE, reversedBucketPath)
+    return query
+
+# Populate the reversed hostname table for a single FDNS date. Athena limits an INSERT INTO to 100 partitions, so the tlds are loaded in batches of 100.
+# The rows are sorted by reversename within each partition so the parquet min/max statistics allow row groups outside of a prefix range to be skipped.
+def sonarBuildReversedTable(ATHENA_DB, ATHENA_BUCKET, ATHENA_TABLE, ATHENA_REVERSED_TABLE, sonarDate, lstTlds):
+    lstExecIds = []
+    lstTlds = sorted(set([tld.lower().replace("'", "''") for tld in lstTlds if tld]))
+    for i in range(0, len(lstTlds), 100):
+        tldString = ', '.join(["'" + tld + "'" for tld in lstTlds[i:i + 100]])
+        query = """INSERT INTO %s
+SELECT array_join(reverse(split(lower(name), '.')), '.') AS reversename, name, type, value, date, element_at(split(lower(name), '.'), -1) AS tld
+FROM %s
+WHERE date = '%s' AND element_at(split(lower(name), '.'), -1) IN (%s)
+ORDER BY reversename;""" % (ATHENA_REVERSED_TABLE, ATHENA_TABLE, sonarDate, tldString)
+        execid = brevitycore.core.queryathena(ATHENA_DB, ATHENA_BUCKET, query)
+        lstExecIds.append(execid)
+    return lstExecIds
+
+# Create the reversed hostname table and load the latest FDNS date for the tlds of every wildcard scope. Only the tlds that are not loaded yet for that date are inserted,
+# so a rerun after new wildcards are added only loads their tlds. The INSERT queries are left running, Athena registers their partitions once they finish.
+def sonarPrepareReversedTable(ATHENA_DB, ATHENA_BUCKET, ATHENA_TABLE, ATHENA_REVERSED_TABLE, reversedBucketPath):
+    execid = brevitycore.core.queryathena(ATHENA_DB, ATHENA_BUCKET, generateSonarReversedTableQuery(ATHENA_REVERSED_TABLE, reversedBucketPath))
+    _waitAthenaQuery(execid)
+    sonarDate = sonarLatestDate(ATHENA_DB, ATHENA_TABLE)
+    lstTlds = []
+    for programName, searchDomains in brevityprogram.dynamodb.scan_program_wildcards().items():
+        for wildcardDomain in searchDomains:
+            tld, reversePrefix = parseSonarWildcard(wildcardDomain)
+            if tld:
+                lstTlds.append(tld)
+    loadedTlds = set([values[1] for values in _partitionValues(ATHENA_DB, ATHENA_REVERSED_TABLE) if values[0] == sonarDate])
+    lstMissing = sorted(set(lstTlds) - loadedTlds)
+    if not lstMissing:
+        return 'Reversed table is current for ' + sonarDate
+    lstExecIds = sonarBuildReversedTable(ATHENA_DB, ATHENA_BUCKET, ATHENA_TABLE, ATHENA_REVERSED_TABLE, sonarDate, lstMissing)
+    return 'Loading ' + str(len(lstMissing)) + ' tlds for ' + sonarDate + ': ' + ', '.join(lstExecIds)
+
+# Batch mode - build one small scope table containing every program's wildcard prefixes so that all programs are resolved with a single join against FDNS.
+# The scope file is written without a header so that the Athena table does not need to skip lines.
+def sonarBatchUploadScope(programWildcards, scopeBucketPath):
+    lstScope = []
+    for programName, searchDomains in programWildcards.items():
+        for wildcardDomain in searchDomains:
+            tld, reversePrefix = parseSonarWildcard(wildcardDomain)
+            if reversePrefix is None:
+                continue
+            lstScope.append([programName, tld, reversePrefix, reversePrefix[:-1] + '/'])
+    dfScope = pd.DataFrame(lstScope, columns=['program', 'tld', 'reverseprefix', 'reverseupper'])
+    dfScope = dfScope.drop_duplicates()
+    storePath = scopeBucketPath + 'sonar-scope.csv'
+    dfScope.to_csv(storePath, header=False, index=False)
+    return dfScope
+
+# Create the external table for the batch scope file.
+def generateSonarScopeTableQuery(ATHENA_SCOPE_TABLE, scopeBucketPath):
+    query = """CREATE EXTERNAL TABLE IF NOT EXISTS %s (
+    program string,
+    tld string,
+    reverseprefix string,
+    reverseupper string
+)
+ROW FORMAT DELIMITED FIELDS TERMINATED BY ','
+STORED AS TEXTFILE
+LOCATION '%s';""" % (ATHENA_SCOPE_TABLE, scopeBucketPath)
+    return query
+
+# The scope table reads the uploaded scope file in place, so it only has to be created once
+def sonarCreateScopeTable(ATHENA_DB, ATHENA_BUCKET, ATHENA_SCOPE_TABLE, scopeBucketPath):
+    glueClient = boto3.client('glue')
+    try:
+        glueClient.get_table(DatabaseName=ATHENA_DB, Name=ATHENA_SCOPE_TABLE)
+        return 'Scope table exists'
+    except glueClient.exceptions.EntityNotFoundException:
+        execid = brevitycore.core.queryathena(ATHENA_DB, ATHENA_BUCKET, generateSonarScopeTableQuery(ATHENA_SCOPE_TABLE, scopeBucketPath))
+        _waitAthenaQuery(execid)
+        return 'Scope table created'
+
+# Join the reversed hostname table to the scope table. The tld list is repeated as a literal filter so that Athena prunes partitions up front instead of relying on the join.
+def generateSonarBatchQuery(ATHENA_REVERSED_TABLE, ATHENA_SCOPE_TABLE, sonarDate, lstTlds):
+    tldString = ', '.join(["'" + tld.replace("'", "''") + "'" for tld in sorted(set(lstTlds))])
+    query = """SELECT s.program, f.name, f.type, f.value
+FROM %s f
+JOIN %s s ON f.tld = s.tld AND f.reversename >= s.reverseprefix AND f.reversename < s.reverseupper
+WHERE f.date = '%s' AND f.tld IN (%s);""" % (ATHENA_REVERSED_TABLE, ATHENA_SCOPE_TABLE, sonarDate, tldString)
+    return query
+
+# Run a single Sonar query for multiple programs. If no program list is passed in, every program with a wildcard scope is included.
+def sonarBatchRun(lstPrograms, refinedBucketPath, ATHENA_DB, ATHENA_BUCKET, ATHENA_REVERSED_TABLE, ATHENA_SCOPE_TABLE):
+    programWildcards = brevityprogram.dynamodb.scan_program_wildcards()
+    if lstPrograms:
+        programWildcards = {programName: programWildcards[programName] for programName in lstPrograms if programName in programWildcards}
+    if not programWildcards:
+        execid = 'No Wildcards'
+        return execid
+    scopeBucketPath = refinedBucketPath + 'sonar-scope/'
+    dfScope = sonarBatchUploadScope(programWildcards, scopeBucketPath)
+    if len(dfScope) == 0:
+        execid = 'No Wildcards'
+        return execid
+    sonarCreateScopeTable(ATHENA_DB, ATHENA_BUCKET, ATHENA_SCOPE_TABLE, scopeBucketPath)
+    sonarDate = sonarLatestDate(ATHENA_DB, ATHENA_REVERSED_TABLE)
+    query = generateSonarBatchQuery(ATHENA_REVERSED_TABLE, ATHENA_SCOPE_TABLE, sonarDate, dfScope['tld'].tolist())
+    execid = brevitycore.core.queryathena(ATHENA_DB, ATHENA_BUCKET, query)
+    return execid
+
+# Retrieve the batch query results and split them into the per program -sonar-output.csv files so that sonarLoadSubdomains can pick them up unchanged.
+def sonarBatchRetrieveResults(execid, refinedBucketPath):
+    lstPrograms = []
+    downloadURL = brevitycore.core.retrieveresults(execid)
+    if (downloadURL == 'No results.') or (downloadURL == 'Query failed.') or (downloadURL is None):
+        return lstPrograms
+    s=requests.get(downloadURL).content
+    dfhosts=pd.read_csv(io.StringIO(s.decode('utf-8')))
+    for programName, dfProgram in dfhosts.groupby('program'):
+        storePath = refinedBucketPath + programName + '/' + programName + '-sonar-output.csv'
+        dfProgram.drop(columns=['program']).drop_duplicates().to_csv(storePath, index=False)
+        lstPrograms.append(programName)
+    return lstPrograms
+
 # Retrieve the Sonar Athena query results and write them to the refined S3 bucket.
 def sonarRetrieveResults(programName, execid, refinedBucketPath):
     downloadURL = brevitycore.core.retrieveresults(execid)
@@ -37,6 +237,25 @@ def sonarRetrieveResults(programName, execid, refinedBucketPath):
     dfhosts.to_csv(storePath, index=False)
     return 'Subdomains successfully generated'
 
+# Local backend - query the on-disk FDNS index (see brevityprogram.sonarindex) instead of Athena and write the same -sonar-output.csv file so sonarLoadSubdomains works unchanged.
+def sonarRunLocal(programName, refinedBucketPath, indexPath=brevityprogram.sonarindex.SONAR_INDEX_PATH):
+    resp = brevityprogram.dynamodb.query_program(programName)
+    searchDomains = dynjson.loads(resp['ScopeInWild'])
+    if not searchDomains:
+        return 'No Wildcards'
+    lstReversePrefixes = []
+    for wildcardDomain in searchDomains:
+        tld, reversePrefix = parseSonarWildcard(wildcardDomain)
+        if reversePrefix is not None:
+            lstReversePrefixes.append(reversePrefix)
+    lstResults = brevityprogram.sonarindex.querySonarIndex(indexPath, lstReversePrefixes)
+    if not lstResults:
+        return 'No subdomains discovered.'
+    dfhosts = pd.DataFrame(lstResults, columns=['name', 'type', 'value'])
+    storePath = refinedBucketPath + programName + '/' + programName + '-sonar-output.csv'
+    dfhosts.to_csv(storePath, index=False)
+    return 'Subdomains successfully generated'
+
 # Add the newly discovered subdomains from the Sonar output results file.
 def sonarLoadSubdomains(programName, refinedBucketPath, programInputBucketPath):
     storePath = refinedBucketPath + programName + '/' + programName + '-sonar-output.csv'   
@@ -54,8 +273,7 @@ def sonarLoadSubdomains(programName, refinedBucketPath, programInputBucketPath):
     return sonarStoreStatus
     
 # This function will update the Athena table to point to the latest Sonar FDNS datasets
-def updateSonarPartitions(ATHENA_DB, ATHENA_BUCKET):
-    query = 'msck repair table rapid7_fdns_any;'
-    execid = brevitycore.core.queryathena(ATHENA_DB, ATHENA_BUCKET, query)
-    downloadURL = brevitycore.core.retrieveresults(execid)
-    s=requests.get(downloadURL).content
\ No newline at end of file
+# Only the newly arrived date partitions are registered through the Glue catalog, which replaces the msck repair table query and the polling for its results.
+def updateSonarPartitions(ATHENA_DB, ATHENA_BUCKET, ATHENA_TABLE='rapid7_fdns_any'):
+    lstNewPartitions = brevitycore.core.registerNewPartitions(ATHENA_DB, ATHENA_TABLE)
+    return lstNewPartitions
\ No newline at end of file
@@ -0,0 +1,184 @@
+import argparse, gzip, json, heapq, mmap, os, struct, tempfile, time
+
+# Local Sonar FDNS engine that runs without Athena.
+# The index is made up of three files that share the same path prefix (for example /data/sonar/fdns):
+#   fdns.dat  - newline delimited records (reversename, name, type, value separated by tabs) sorted by reversename
+#   fdns.off  - little endian uint64 byte offsets of each record within the .dat file
+#   fdns.json - metadata about the source dump and the number of records
+# Both the .dat and .off files are memory-mapped for queries, so a wildcard lookup is a binary search followed by a short sequential read.
+# Build the index on the box that serves it (the sonar Lambda reads it through the sonarIndexPath parameter when sonarBackend is local):
+#   python3 -m brevityprogram.sonarindex build s3://<bucket>/<fdns dump>.json.gz --index /data/sonar/fdns --date 2021-05-01
+#   python3 -m brevityprogram.sonarindex query example.com --index /data/sonar/fdns
+
+OFFSET_SIZE = 8
+SONAR_INDEX_PATH = '/data/sonar/fdns'
+
+# Convert www.example.com into com.example.www so that wildcard suffix matches become prefix matches.
+def reverseHostname(hostName):
+    labels = hostName.strip('.').lower().split('.')
+    labels.reverse()
+    return '.'.join(labels)
+
+# Remove tabs and newlines so that a field can never break the record layout.
+def _cleanField(fieldValue):
+    return str(fieldValue).replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+# Sort a chunk of records in memory and write it out as a temporary run file for the merge.
+def _writeSortedRun(lstRecords, tempPath):
+    lstRecords.sort()
+    runFile = tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', dir=tempPath, suffix='.run', delete=False)
+    for record in lstRecords:
+        runFile.write(record + '\n')
+    runFile.close()
+    return runFile.name
+
+# Stream a gzip FDNS JSON dump (one {"timestamp","name","type","value"} object per line) into sorted run files.
+# Only chunkSize records are held in memory at a time, which keeps the ingest within the memory of a small EC2 instance regardless of the dump size.
+def _ingestSonarDump(dumpPath, tempPath, chunkSize):
+    lstRuns = []
+    lstRecords = []
+    with gzip.open(dumpPath, 'rt', encoding='utf-8', errors='replace') as dumpFile:
+        for line in dumpFile:
+            try:
+                jsonRecord = json.loads(line)
+                hostName = _cleanField(jsonRecord['name']).strip('.').lower()
+            except (ValueError, KeyError):
+                continue
+            if not hostName:
+                continue
+            record = '\t'.join([reverseHostname(hostName), hostName, _cleanField(jsonRecord.get('type', '')), _cleanField(jsonRecord.get('value', ''))])
+            lstRecords.append(record)
+            if len(lstRecords) >= chunkSize:
+                lstRuns.append(_writeSortedRun(lstRecords, tempPath))
+                lstRecords = []
+    if lstRecords:
+        lstRuns.append(_writeSortedRun(lstRecords, tempPath))
+    return lstRuns
+
+# Build the on-disk index from a gzip FDNS dump. The sorted runs are merged with a k-way heap merge and duplicate records are dropped while writing.
+def buildSonarIndex(dumpPath, indexPath, sonarDate='', chunkSize=2000000):
+    indexDir = os.path.dirname(indexPath)
+    if indexDir:
+        os.makedirs(indexDir, exist_ok=True)
+    tempPath = tempfile.mkdtemp(dir=indexDir or None)
+    lstRuns = _ingestSonarDump(dumpPath, tempPath, chunkSize)
+    lstRunFiles = [open(runPath, 'r', encoding='utf-8') for runPath in lstRuns]
+    recordCount = 0
+    try:
+        # Build into temporary files and rename at the end so queries never see a partially written index
+        with open(indexPath + '.dat.tmp', 'wb') as datFile, open(indexPath + '.off.tmp', 'wb') as offFile:
+            previousRecord = None
+            offset = 0
+            for record in heapq.merge(*lstRunFiles):
+                if record == previousRecord:
+                    continue
+                previousRecord = record
+                encodedRecord = record.encode('utf-8')
+                offFile.write(struct.pack('<Q', offset))
+                datFile.write(encodedRecord)
+                offset += len(encodedRecord)
+                recordCount += 1
+    finally:
+        for runFile in lstRunFiles:
+            runFile.close()
+        for runPath in lstRuns:
+            os.remove(runPath)
+        os.rmdir(tempPath)
+    os.replace(indexPath + '.dat.tmp', indexPath + '.dat')
+    os.replace(indexPath + '.off.tmp', indexPath + '.off')
+    indexInfo = {'source': os.path.basename(dumpPath), 'date': sonarDate, 'records': recordCount}
+    with open(indexPath + '.json', 'w') as infoFile:
+        json.dump(indexInfo, infoFile)
+    return indexInfo
+
+# Open the memory-mapped index files. Returns None for both maps if the index is empty.
+def openSonarIndex(indexPath):
+    datFile = open(indexPath + '.dat', 'rb')
+    offFile = open(indexPath + '.off', 'rb')
+    try:
+        if os.fstat(datFile.fileno()).st_size == 0:
+            return None, None
+        datMap = mmap.mmap(datFile.fileno(), 0, access=mmap.ACCESS_READ)
+        offMap = mmap.mmap(offFile.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        # The maps hold their own reference to the underlying file
+        datFile.close()
+        offFile.close()
+    return datMap, offMap
+
+# Return the raw bytes for the record at a given position, without the trailing newline.
+def _readRecord(datMap, offMap, position):
+    start = struct.unpack_from('<Q', offMap, position * OFFSET_SIZE)[0]
+    end = datMap.find(b'\n', start)
+    if end == -1:
+        end = len(datMap)
+    return datMap[start:end]
+
+# Binary search for the first record whose reversename is greater than or equal to the prefix.
+def _lowerBound(datMap, offMap, recordCount, reversePrefix):
+    low = 0
+    high = recordCount
+    while low < high:
+        middle = (low + high) // 2
+        if _readRecord(datMap, offMap, middle) < reversePrefix:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+# Find every record under the reversed prefixes (for example com.example.). Each prefix costs one binary search plus a sequential read of its matches.
+def querySonarIndex(indexPath, lstReversePrefixes):
+    lstResults = []
+    datMap, offMap = openSonarIndex(indexPath)
+    if datMap is None:
+        return lstResults
+    try:
+        recordCount = len(offMap) // OFFSET_SIZE
+        for reversePrefix in sorted(set(lstReversePrefixes)):
+            encodedPrefix = reversePrefix.encode('utf-8')
+            position = _lowerBound(datMap, offMap, recordCount, encodedPrefix)
+            while position < recordCount:
+                record = _readRecord(datMap, offMap, position)
+                if not record.startswith(encodedPrefix):
+                    break
+                fields = record.decode('utf-8').split('\t')
+                lstResults.append({'name': fields[1], 'type': fields[2], 'value': fields[3]})
+                position += 1
+    finally:
+        datMap.close()
+        offMap.close()
+    return lstResults
+
+# Download an s3:// dump next to the index, local paths are used as they are
+def _fetchSonarDump(dumpPath, indexPath):
+    if not dumpPath.startswith('s3://'):
+        return dumpPath, False
+    import boto3
+    bucketName, objectKey = dumpPath[5:].split('/', 1)
+    localPath = os.path.join(os.path.dirname(indexPath) or '.', os.path.basename(objectKey))
+    boto3.client('s3').download_file(bucketName, objectKey, localPath)
+    return localPath, True
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity local Sonar FDNS index')
+    parser.add_argument('action', choices=['build', 'query'])
+    parser.add_argument('paths', nargs='+', help='build: <gzip dump, local or s3://>, query: <domains>')
+    parser.add_argument('--index', default=SONAR_INDEX_PATH, help='Index path prefix')
+    parser.add_argument('--date', default='', help='Date of the dump, recorded in the index metadata')
+    args = parser.parse_args()
+    startTime = time.time()
+    if args.action == 'build':
+        os.makedirs(os.path.dirname(args.index) or '.', exist_ok=True)
+        dumpPath, downloaded = _fetchSonarDump(args.paths[0], args.index)
+        try:
+            print(buildSonarIndex(dumpPath, args.index, args.date))
+        finally:
+            if downloaded:
+                os.remove(dumpPath)
+    else:
+        for result in querySonarIndex(args.index, [reverseHostname(domainName) + '.' for domainName in args.paths]):
+            print(result['name'] + '\t' + result['type'] + '\t' + result['value'])
+    print('Finished in ' + str(round(time.time() - startTime, 1)) + ' seconds')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import argparse, json, mmap, os, struct, time, zlib
+import boto3
+
+# Random access response archive, replacing the <program>-responses.tar.gz that had to be downloaded and extracted whole before any scan.
+# Layout: ARCHIVE_MAGIC, then one zlib frame per file, then the offset table (zlib compressed json, one [name, offset, length, size, crc32] row per file),
+# then a fixed trailer of table offset, table length and ARCHIVE_MAGIC.
+# A reader fetches the trailer and the table, then each response it wants with one ranged GET on S3 (or a slice of the mmap on local disk).
+# Extracting many responses coalesces neighbouring frames into shared ranged GETs, and downloads the archive once when most of it is requested.
+#   python3 -m brevityscope.archive pack <folder> <archive or s3://bucket/key>
+#   python3 -m brevityscope.archive list|cat|extract <archive or s3://bucket/key> [names] [--output <folder>]
+
+ARCHIVE_MAGIC = b'BRVPACK1'
+ARCHIVE_TRAILER = struct.Struct('<QQ8s')
+ARCHIVE_LEVEL = 6
+# Frames closer together than the gap are fetched in one GET, up to ARCHIVE_MAX_RANGE bytes per GET
+ARCHIVE_COALESCE_GAP = 1024 * 1024
+ARCHIVE_MAX_RANGE = 64 * 1024 * 1024
+# Download the whole object instead once the requested frames are this fraction of the archive
+ARCHIVE_FULL_FRACTION = 0.5
+
+def _splitS3(archivePath):
+    bucketName, objectKey = archivePath[len('s3://'):].split('/', 1)
+    return bucketName, objectKey
+
+# Read a byte range from a local archive or an s3://bucket/key archive. A negative offset reads from the end.
+def _readRange(archivePath, offset, length):
+    if archivePath.startswith('s3://'):
+        bucketName, objectKey = _splitS3(archivePath)
+        byteRange = 'bytes=' + str(offset) if offset < 0 else 'bytes=' + str(offset) + '-' + str(offset + length - 1)
+        return boto3.client('s3').get_object(Bucket=bucketName, Key=objectKey, Range=byteRange)['Body'].read()
+    with open(archivePath, 'rb') as archiveFile:
+        with mmap.mmap(archiveFile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data[offset:] if offset < 0 else data[offset:offset + length]
+
+def writeArchive(sourcePath, archivePath):
+    lstTable = []
+    with open(archivePath, 'wb') as archiveFile:
+        archiveFile.write(ARCHIVE_MAGIC)
+        for dirPath, dirNames, fileNames in os.walk(sourcePath):
+            dirNames.sort()
+            for fileName in sorted(fileNames):
+                filePath = os.path.join(dirPath, fileName)
+                with open(filePath, 'rb') as sourceFile:
+                    fileData = sourceFile.read()
+                frame = zlib.compress(fileData, ARCHIVE_LEVEL)
+                lstTable.append([os.path.relpath(filePath, sourcePath).replace(os.sep, '/'), archiveFile.tell(), len(frame), len(fileData), zlib.crc32(fileData)])
+                archiveFile.write(frame)
+        tableOffset = archiveFile.tell()
+        table = zlib.compress(json.dumps(lstTable).encode())
+        archiveFile.write(table)
+        archiveFile.write(ARCHIVE_TRAILER.pack(tableOffset, len(table), ARCHIVE_MAGIC))
+    return len(lstTable)
+
+# Pack a folder and publish it to s3://bucket/key
+def packArchive(sourcePath, archivePath):
+    if not archivePath.startswith('s3://'):
+        return writeArchive(sourcePath, archivePath)
+    localPath = os.path.join('/tmp', os.path.basename(archivePath))
+    fileCount = writeArchive(sourcePath, localPath)
+    bucketName, objectKey = _splitS3(archivePath)
+    boto3.client('s3').upload_file(localPath, bucketName, objectKey)
+    os.remove(localPath)
+    return fileCount
+
+# {name: (offset, length, size, crc32)}
+def readArchiveTable(archivePath):
+    tableOffset, tableLength, magic = ARCHIVE_TRAILER.unpack(_readRange(archivePath, -ARCHIVE_TRAILER.size, ARCHIVE_TRAILER.size))
+    if magic != ARCHIVE_MAGIC:
+        raise ValueError(archivePath + ' is not a response archive')
+    lstTable = json.loads(zlib.decompress(_readRange(archivePath, tableOffset, tableLength)))
+    return {name: (offset, length, size, crc) for name, offset, length, size, crc in lstTable}
+
+def _checkEntry(archivePath, dictTable, name, frame):
+    fileData = zlib.decompress(frame)
+    if zlib.crc32(fileData) != dictTable[name][3]:
+        raise ValueError('Checksum mismatch for ' + name + ' in ' + archivePath)
+    return fileData
+
+def readArchiveEntry(archivePath, dictTable, name):
+    offset, length, size, crc = dictTable[name]
+    return _checkEntry(archivePath, dictTable, name, _readRange(archivePath, offset, length))
+
+# Group the frames (sorted by offset) into ranges of [start, end, names] that can each be read with one GET
+def _coalesceRanges(dictTable, lstNames, gap=ARCHIVE_COALESCE_GAP, maxRange=ARCHIVE_MAX_RANGE):
+    lstRanges = []
+    for name in sorted(lstNames, key=lambda name: dictTable[name][0]):
+        offset, length, size, crc = dictTable[name]
+        if lstRanges and offset - lstRanges[-1][1] <= gap and offset + length - lstRanges[-1][0] <= maxRange:
+            lstRanges[-1][1] = max(lstRanges[-1][1], offset + length)
+            lstRanges[-1][2].append(name)
+        else:
+            lstRanges.append([offset, offset + length, [name]])
+    return lstRanges
+
+# Yield (name, data) for the named entries of a local archive, reading them from a single mmap
+def _readLocalEntries(archivePath, dictTable, lstNames):
+    with open(archivePath, 'rb') as archiveFile:
+        with mmap.mmap(archiveFile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for name in lstNames:
+                offset, length, size, crc = dictTable[name]
+                yield name, _checkEntry(archivePath, dictTable, name, data[offset:offset + length])
+
+# Yield (name, data) for the named entries. On S3 the frames are fetched with coalesced ranged GETs, or with one download when most of the archive is wanted.
+def readArchiveEntries(archivePath, dictTable, lstNames):
+    if not archivePath.startswith('s3://'):
+        yield from _readLocalEntries(archivePath, dictTable, lstNames)
+        return
+    requestedBytes = sum([dictTable[name][1] for name in lstNames])
+    archiveBytes = sum([length for offset, length, size, crc in dictTable.values()])
+    if archiveBytes and requestedBytes >= archiveBytes * ARCHIVE_FULL_FRACTION:
+        bucketName, objectKey = _splitS3(archivePath)
+        localPath = os.path.join('/tmp', os.path.basename(objectKey))
+        boto3.client('s3').download_file(bucketName, objectKey, localPath)
+        try:
+            yield from _readLocalEntries(localPath, dictTable, lstNames)
+        finally:
+            os.remove(localPath)
+        return
+    for start, end, lstRangeNames in _coalesceRanges(dictTable, lstNames):
+        rangeData = _readRange(archivePath, start, end - start)
+        for name in lstRangeNames:
+            offset, length, size, crc = dictTable[name]
+            yield name, _checkEntry(archivePath, dictTable, name, rangeData[offset - start:offset - start + length])
+
+# Write the named responses (all of them by default) under outputPath
+def extractArchive(archivePath, outputPath, lstNames=None):
+    dictTable = readArchiveTable(archivePath)
+    lstNames = [name for name in (lstNames or list(dictTable.keys())) if not os.path.isabs(name) and not os.path.normpath(name).startswith('..')]
+    for name, fileData in readArchiveEntries(archivePath, dictTable, lstNames):
+        targetPath = os.path.join(outputPath, name)
+        os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+        with open(targetPath, 'wb') as targetFile:
+            targetFile.write(fileData)
+    return len(lstNames)
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity response archive')
+    parser.add_argument('action', choices=['pack', 'list', 'cat', 'extract'])
+    parser.add_argument('paths', nargs='+', help='pack: <folder> <archive>, otherwise: <archive> [names]')
+    parser.add_argument('--output', default='.')
+    args = parser.parse_args()
+    startTime = time.time()
+    if args.action == 'pack':
+        print('Packed ' + str(packArchive(args.paths[0], args.paths[1])) + ' files')
+    elif args.action == 'list':
+        for name, (offset, length, size, crc) in readArchiveTable(args.paths[0]).items():
+            print(name + '\t' + str(size))
+    elif args.action == 'cat':
+        dictTable = readArchiveTable(args.paths[0])
+        for name in args.paths[1:]:
+            os.write(1, readArchiveEntry(args.paths[0], dictTable, name))
+        return
+    else:
+        print('Extracted ' + str(extractArchive(args.paths[0], args.output, args.paths[1:])) + ' files')
+    print('Finished in ' + str(round(time.time() - startTime, 1)) + ' seconds')
+
+if __name__ == '__main__':
+    main()
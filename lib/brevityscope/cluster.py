@@ -0,0 +1,138 @@
+import argparse, hashlib, itertools, os, re, time
+import numpy as np
+
+# Near-duplicate clustering of the unique response bodies, so pages that only differ in csrf tokens, timestamps or host names are reviewed once.
+# Each body gets a 64 bit SimHash over word shingles, with the title tokens weighted higher. Fingerprints are kept as a uint64 array in <program>-simhash.npz
+# and only new bodies are fingerprinted on later runs.
+# Candidate pairs come from multi-index hashing: the fingerprint is split into CLUSTER_BANDS bands of 64 / CLUSTER_BANDS bits, and two fingerprints within
+# CLUSTER_DISTANCE bits differ in at most CLUSTER_DISTANCE // CLUSTER_BANDS bits of at least one band (pigeonhole). Each band table is probed with the band value and
+# every value within that radius, so the bands stay 16 bits wide and the buckets small while the distance grows.
+# Within a band bucket each body is only compared with the clusters already found there, so large clusters of soft 404 pages stay close to linear.
+#   python3 -m brevityscope.cluster --program <program> --output $HOME/security/refined/<program>/ --presentation $HOME/security/presentation/<program>/httpx/ [--responses /data/store/<program>]
+
+CLUSTER_DISTANCE = 7
+CLUSTER_BANDS = 4
+CLUSTER_SHINGLE = 3
+CLUSTER_TITLE_WEIGHT = 5
+CLUSTER_MAX_BODY = 1024 * 1024
+CLUSTER_EXAMPLES = 5
+CLUSTER_TOKEN = re.compile(rb'[A-Za-z0-9]+')
+CLUSTER_TITLE = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+BIT_VALUES = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+
+def _featureHashes(lstFeatures):
+    return np.array([int.from_bytes(hashlib.blake2b(feature, digest_size=8).digest(), 'little') for feature in lstFeatures], dtype=np.uint64)
+
+def responseTitle(body):
+    titleMatch = CLUSTER_TITLE.search(body[:CLUSTER_MAX_BODY])
+    return titleMatch.group(1).strip().decode('utf-8', 'replace')[:200] if titleMatch else ''
+
+def simhash(body):
+    body = body[:CLUSTER_MAX_BODY]
+    lstTokens = [token.lower() for token in CLUSTER_TOKEN.findall(body)]
+    lstShingles = set([b' '.join(lstTokens[i:i + CLUSTER_SHINGLE]) for i in range(max(1, len(lstTokens) - CLUSTER_SHINGLE + 1))])
+    lstTitle = set([b'title:' + token.lower() for token in CLUSTER_TOKEN.findall(responseTitle(body).encode())])
+    lstFeatures = list(lstShingles) + list(lstTitle)
+    weights = np.array([1] * len(lstShingles) + [CLUSTER_TITLE_WEIGHT] * len(lstTitle))
+    featureBits = (_featureHashes(lstFeatures)[:, None] & BIT_VALUES) != 0
+    votes = (np.where(featureBits, 1, -1) * weights[:, None]).sum(axis=0)
+    return int(BIT_VALUES[votes > 0].sum())
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+# Returns the cluster root index for each fingerprint
+def clusterFingerprints(fingerprints, distance=CLUSTER_DISTANCE, bands=CLUSTER_BANDS):
+    parents = list(range(len(fingerprints)))
+
+    def _find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    lstFingerprints = [int(fingerprint) for fingerprint in fingerprints]
+    bandBits = 64 // bands
+    bandMask = (1 << bandBits) - 1
+    # Masks of every band value within the probe radius, starting with the band value itself
+    lstProbes = [sum(1 << bit for bit in bits) for radius in range(distance // bands + 1) for bits in itertools.combinations(range(bandBits), radius)]
+    for band in range(bands):
+        dictRoots = {}
+        for i, fingerprint in enumerate(lstFingerprints):
+            bandValue = (fingerprint >> (band * bandBits)) & bandMask
+            match = next((root for probe in lstProbes for root in dictRoots.get(bandValue ^ probe, ()) if _hamming(fingerprint, lstFingerprints[root]) <= distance), None)
+            if match is None:
+                dictRoots.setdefault(bandValue, []).append(i)
+                continue
+            rootI, rootJ = _find(i), _find(match)
+            if rootI != rootJ:
+                parents[max(rootI, rootJ)] = min(rootI, rootJ)
+    return [_find(i) for i in range(len(parents))]
+
+# {hash: fingerprint} from the previous run
+def loadFingerprints(fingerprintPath):
+    try:
+        fingerprintFile = np.load(fingerprintPath)
+        return dict(zip(fingerprintFile['hashes'].tolist(), fingerprintFile['fingerprints'].tolist()))
+    except (FileNotFoundError, OSError, KeyError):
+        return {}
+
+def saveFingerprints(fingerprintPath, dictFingerprints):
+    np.savez_compressed(fingerprintPath, hashes=np.array(list(dictFingerprints.keys())), fingerprints=np.array(list(dictFingerprints.values()), dtype=np.uint64))
+
+def clusterResponses(programName, responsePath, outputPath, presentationPath):
+    import brevityscope.responses
+    dfIndex = brevityscope.responses.loadResponseIndex(programName)
+    downloadCount = brevityscope.responses.downloadUniqueBodies(programName, responsePath, dfIndex)
+    print('Downloaded ' + str(downloadCount) + ' new bodies')
+    if dfIndex.empty:
+        return 'No stored responses'
+    os.makedirs(outputPath, exist_ok=True)
+    os.makedirs(presentationPath, exist_ok=True)
+    fingerprintPath = os.path.join(outputPath, programName + '-simhash.npz')
+    dictCached = loadFingerprints(fingerprintPath)
+
+    dfBodies = brevityscope.responses.uniqueResponses(dfIndex)
+    dictFingerprints = {}
+    lstTitles = []
+    for bodyHash in dfBodies['hash']:
+        with open(os.path.join(responsePath, bodyHash), 'rb') as bodyFile:
+            body = bodyFile.read(CLUSTER_MAX_BODY)
+        lstTitles.append(responseTitle(body))
+        dictFingerprints[bodyHash] = dictCached[bodyHash] if bodyHash in dictCached else simhash(body)
+    saveFingerprints(fingerprintPath, dictFingerprints)
+    dfBodies['title'] = lstTitles
+    dfBodies['simhash'] = [format(dictFingerprints[bodyHash], '016x') for bodyHash in dfBodies['hash']]
+    # uniqueResponses sorts by response count, so each cluster root is its most common body
+    lstRoots = clusterFingerprints(np.array(list(dictFingerprints.values()), dtype=np.uint64))
+    dfBodies['cluster'] = dfBodies['hash'].iloc[lstRoots].values
+
+    dfResponses = dfIndex.merge(dfBodies[['hash', 'cluster', 'title', 'simhash']], on='hash')
+    dfResponses.drop(columns=['headers'], errors='ignore').to_csv(os.path.join(outputPath, programName + '-clusters.csv'), index=False)
+    dfRepresentative = dfBodies.drop_duplicates(subset=['cluster'])[['cluster', 'title', 'simhash']]
+    dfUrls = dfResponses.groupby('cluster').agg(
+        url=('url', 'first'),
+        status=('status', 'first'),
+        responses=('url', 'count'),
+        bodies=('hash', 'nunique'),
+        examples=('url', lambda urls: list(urls)[:CLUSTER_EXAMPLES])).reset_index()
+    dfUnique = dfRepresentative.merge(dfUrls, on='cluster').sort_values('responses', ascending=False)
+    dfUnique.to_json(os.path.join(presentationPath, programName + '-httpx-unique.json'), orient='records', lines=True)
+    # One url per cluster for nuclei, ffuf and manual review
+    dfUnique['url'].to_csv(os.path.join(outputPath, programName + '-urls-unique.txt'), header=False, index=False)
+    return {'responses': len(dfIndex), 'bodies': len(dfBodies), 'clusters': len(dfUnique), 'fingerprinted': len(dictFingerprints.keys() - dictCached.keys())}
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity response clustering')
+    parser.add_argument('--program', required=True)
+    parser.add_argument('--output', required=True, help='Folder for the fingerprints, the cluster csv and the representative urls')
+    parser.add_argument('--presentation', required=True, help='Folder for the unique pages view')
+    parser.add_argument('--responses', help='Local body cache')
+    args = parser.parse_args()
+    startTime = time.time()
+    responsePath = args.responses or os.path.expanduser('~/security/store/' + args.program)
+    print(clusterResponses(args.program, responsePath, args.output, args.presentation))
+    print('Finished in ' + str(int(time.time() - startTime)) + ' seconds')
+
+if __name__ == '__main__':
+    main()
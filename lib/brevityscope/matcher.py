@@ -0,0 +1,221 @@
+import argparse, csv, mmap, os, re, time
+from collections import deque
+from multiprocessing import Pool
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Single pass response matcher, replacing the five sift runs over the same responses (one per pattern list).
+# The literal keyword list is compiled into one Aho-Corasick automaton (pyahocorasick when installed, otherwise the pure Python automaton below)
+# and each of the regex, extension, filename and phrase lists into one combined regex, matched separately like the per list sift passes. Every response file is memory-mapped and read once, spread across a process pool.
+# Matches are attributed to urls through the response store index (brevityscope.responses) when scanning the unique bodies, or to the file name for a plain responses folder.
+# Run on a worker from the brevity library zip:
+#   python3 -m brevityscope.matcher --program <program> --config $HOME/security/config/ --output $HOME/security/refined/<program>/ [--responses <folder>] [--store]
+
+# Category -> (pattern file under the config folder, literal). These are the lists and flags the sift script used.
+MATCHER_PATTERN_FILES = {
+    'keywords': ('sift/search-keywords.csv', True),
+    'regex': ('sift/search-regex.csv', False),
+    'extensions': ('sift/search-extensions.csv', False),
+    'filenames': ('search-filenames.csv', False),
+    'phrases': ('search-phrases.csv', False)
+}
+MATCHER_MAX_MATCH = 200
+MATCHER_CHUNK_SIZE = 64
+
+# Pure Python Aho-Corasick automaton over bytes. iter yields (end offset, value) like pyahocorasick.
+class ByteAutomaton:
+
+    def __init__(self):
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]
+
+    def add_word(self, pattern, value):
+        node = 0
+        for byte in pattern:
+            nextNode = self.transitions[node].get(byte)
+            if nextNode is None:
+                nextNode = len(self.transitions)
+                self.transitions.append({})
+                self.failures.append(0)
+                self.outputs.append([])
+                self.transitions[node][byte] = nextNode
+            node = nextNode
+        self.outputs[node].append(value)
+
+    def make_automaton(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for byte, nextNode in self.transitions[node].items():
+                queue.append(nextNode)
+                failure = self.failures[node]
+                while failure and byte not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[nextNode] = self.transitions[failure].get(byte, 0)
+                self.outputs[nextNode] = self.outputs[nextNode] + self.outputs[self.failures[nextNode]]
+
+    def iter(self, data):
+        transitions, failures, outputs = self.transitions, self.failures, self.outputs
+        node = 0
+        for position, byte in enumerate(data):
+            while node and byte not in transitions[node]:
+                node = failures[node]
+            node = transitions[node].get(byte, 0)
+            for value in outputs[node]:
+                yield position, value
+
+# Read the pattern lists, one pattern per line like sift -f. Missing lists are skipped.
+def loadPatterns(configPath, patternFiles=MATCHER_PATTERN_FILES):
+    dictPatterns = {}
+    for category, (fileName, literal) in patternFiles.items():
+        try:
+            with open(os.path.join(configPath, fileName), encoding='utf-8', errors='replace') as patternFile:
+                lstPatterns = [line.strip() for line in patternFile if line.strip()]
+        except FileNotFoundError:
+            print('No pattern list: ' + fileName)
+            continue
+        dictPatterns[category] = (lstPatterns, literal)
+    return dictPatterns
+
+# Leading flags such as (?i) only apply to the whole expression, so they are scoped to the pattern before it is combined with the others
+def _scopeFlags(pattern):
+    flagMatch = re.match(rb'^\(\?([aiLmsux]+)\)', pattern)
+    if flagMatch:
+        return b'(?' + flagMatch.group(1) + b':' + pattern[flagMatch.end():] + b')'
+    return pattern
+
+# Backreferences, named groups and group conditionals depend on group names and numbers, so they cannot be joined into an alternation
+STANDALONE_PATTERN = re.compile(rb'\\[1-9]|\\g<|\(\?P[<=]|\(\?\(')
+
+class ResponseMatcher:
+
+    def __init__(self, dictPatterns):
+        self.automaton = ahocorasick.Automaton() if ahocorasick else ByteAutomaton()
+        self.literalCount = 0
+        # (compiled regex, {group name: pattern} for a combined category regex or the pattern itself, category)
+        self.regexes = []
+        for category, (lstPatterns, literal) in dictPatterns.items():
+            lstGroups = []
+            groupPatterns = {}
+            for pattern in lstPatterns:
+                patternBytes = pattern.encode('utf-8')
+                if literal:
+                    # pyahocorasick matches str, latin-1 keeps one character per byte so the offsets stay byte offsets
+                    self.automaton.add_word(patternBytes.decode('latin-1') if ahocorasick else patternBytes, (category, pattern, len(patternBytes)))
+                    self.literalCount += 1
+                    continue
+                try:
+                    patternRegex = re.compile(patternBytes)
+                except re.error as e:
+                    print('Skipping invalid pattern ' + pattern + ': ' + str(e))
+                    continue
+                if STANDALONE_PATTERN.search(patternBytes):
+                    self.regexes.append((patternRegex, pattern, category))
+                    continue
+                groupName = '_m' + str(len(lstGroups))
+                groupPatterns[groupName] = pattern
+                lstGroups.append(b'(?P<' + groupName.encode() + b'>' + _scopeFlags(patternBytes) + b')')
+            if not lstGroups:
+                continue
+            # One regex per category like one sift pass per list, so a match in one list never hides a match from another
+            try:
+                self.regexes.append((re.compile(b'|'.join(lstGroups)), groupPatterns, category))
+            except re.error as e:
+                print('Matching the ' + category + ' patterns one at a time: ' + str(e))
+                self.regexes += [(re.compile(pattern.encode('utf-8')), pattern, category) for pattern in groupPatterns.values()]
+        if self.literalCount:
+            self.automaton.make_automaton()
+
+    # Returns (category, pattern, match, offset) for every literal occurrence and every non-overlapping match of each category regex
+    def scan(self, data):
+        lstMatches = []
+        if self.literalCount:
+            text = data[:].decode('latin-1') if ahocorasick else data[:]
+            for endOffset, (category, pattern, length) in self.automaton.iter(text):
+                lstMatches.append((category, pattern, pattern, endOffset - length + 1))
+        for regex, patterns, category in self.regexes:
+            for match in regex.finditer(data):
+                pattern = patterns[match.lastgroup] if isinstance(patterns, dict) else patterns
+                lstMatches.append((category, pattern, match.group(0)[:MATCHER_MAX_MATCH].decode('utf-8', 'replace'), match.start()))
+        return lstMatches
+
+_processMatcher = None
+
+def _initProcess(dictPatterns):
+    global _processMatcher
+    _processMatcher = ResponseMatcher(dictPatterns)
+
+def scanFile(filePath):
+    with open(filePath, 'rb') as responseFile:
+        if os.fstat(responseFile.fileno()).st_size == 0:
+            return filePath, []
+        with mmap.mmap(responseFile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return filePath, _processMatcher.scan(data)
+
+# Scan every file under responsePath once. Returns {relative path: [(category, pattern, match, offset)]} for the files with matches.
+def matchFiles(responsePath, dictPatterns, processes=None):
+    lstFiles = [os.path.join(dirPath, fileName) for dirPath, dirNames, fileNames in os.walk(responsePath) for fileName in fileNames]
+    dictMatches = {}
+    with Pool(processes, initializer=_initProcess, initargs=(dictPatterns,)) as pool:
+        for filePath, lstMatches in pool.imap_unordered(scanFile, lstFiles, chunksize=MATCHER_CHUNK_SIZE):
+            if lstMatches:
+                dictMatches[os.path.relpath(filePath, responsePath).replace(os.sep, '/')] = lstMatches
+    return dictMatches
+
+# Write <program>-matches.csv with every attributed match and the matches-<program>-<category>.txt files the sift passes produced (url:match per line)
+def writeMatches(programName, outputPath, dictMatches, dictUrls=None):
+    os.makedirs(outputPath, exist_ok=True)
+    categoryFiles = {}
+    matchCount = 0
+    with open(os.path.join(outputPath, programName + '-matches.csv'), 'w', newline='') as csvFile:
+        csvWriter = csv.writer(csvFile)
+        csvWriter.writerow(['url', 'response', 'category', 'pattern', 'match', 'offset'])
+        for responseName, lstMatches in sorted(dictMatches.items()):
+            for url in (dictUrls.get(responseName, [responseName]) if dictUrls else [responseName]):
+                for category, pattern, matchText, offset in lstMatches:
+                    csvWriter.writerow([url, responseName, category, pattern, matchText, offset])
+                    if category not in categoryFiles:
+                        categoryFiles[category] = open(os.path.join(outputPath, 'matches-' + programName + '-' + category + '.txt'), 'w')
+                    categoryFiles[category].write(url + ':' + matchText.replace('\n', ' ') + '\n')
+                    matchCount += 1
+    for categoryFile in categoryFiles.values():
+        categoryFile.close()
+    return matchCount
+
+# Scan the unique bodies in the response store (downloaded to responsePath) and attribute each body to every url that returned it
+def matchStore(programName, configPath, responsePath, outputPath, processes=None):
+    import brevityscope.responses
+    dfIndex = brevityscope.responses.loadResponseIndex(programName)
+    downloadCount = brevityscope.responses.downloadUniqueBodies(programName, responsePath, dfIndex)
+    print('Downloaded ' + str(downloadCount) + ' new bodies')
+    dictUrls = dfIndex.groupby('hash')['url'].apply(list).to_dict()
+    # Only the bodies that are still referenced by the index are scanned
+    dictMatches = {bodyHash: lstMatches for bodyHash, lstMatches in matchFiles(responsePath, loadPatterns(configPath), processes).items() if bodyHash in dictUrls}
+    return writeMatches(programName, outputPath, dictMatches, dictUrls)
+
+def matchFolder(programName, configPath, responsePath, outputPath, processes=None):
+    return writeMatches(programName, outputPath, matchFiles(responsePath, loadPatterns(configPath), processes))
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity response matcher')
+    parser.add_argument('--program', required=True)
+    parser.add_argument('--config', required=True, help='Folder holding the pattern lists')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--responses', help='Response folder, or the local body cache with --store')
+    parser.add_argument('--store', action='store_true', help='Scan the unique bodies from the response store')
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+    startTime = time.time()
+    if args.store:
+        responsePath = args.responses or os.path.expanduser('~/security/store/' + args.program)
+        matchCount = matchStore(args.program, args.config, responsePath, args.output, args.processes)
+    else:
+        matchCount = matchFolder(args.program, args.config, args.responses, args.output, args.processes)
+    print(str(matchCount) + ' matches in ' + str(int(time.time() - startTime)) + ' seconds')
+
+if __name__ == '__main__':
+    main()
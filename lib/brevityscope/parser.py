@@ -1,6 +1,11 @@
 import tldextract
+import time
 import pandas as pd
 
+# Incremental httpx probing - hosts that have not been probed within HTTPX_STALE_DAYS are probed again, at most HTTPX_STALE_LIMIT of them per run (oldest first)
+HTTPX_STALE_DAYS = 7
+HTTPX_STALE_LIMIT = 500
+
 def generateInitialDomains(programName, refinedBucketPath, listscopein, programInputBucketPath):
     dfInputScope = pd.DataFrame(listscopein)
     dfInputScope.columns=['domain']
@@ -118,8 +123,9 @@ def storeAllDomains(programName, refinedBucketPath, lstDomains, programInputBuck
 #        dfNewDomains = pd.DataFrame(dfNewDomains['domain'])
     #print('Length of unique subdomains after new domains added: ' + str(len(dfNewDomains)))
     newLengthDomains = (len(dfExistingDomains))
+    # Always write the delta, even when it is empty, so an incremental httpx run never probes a delta from an earlier run
+    dfNewDomains.to_csv(storePathNew, header=False, index=False, sep='\n')
     if (len(dfNewDomains) > 0):
-        dfNewDomains.to_csv(storePathNew, header=False, index=False, sep='\n')
         dfDomains = dfDomains.append(dfExistingDomains)
         dfDomains = dfDomains.drop_duplicates()
         dfDomains.to_csv(storePath, index=False)
@@ -131,6 +137,39 @@ def storeAllDomains(programName, refinedBucketPath, lstDomains, programInputBuck
     addLengthDomains = str(newLengthDomains - initialLengthDomains)
     return 'Added ' + addLengthDomains + ' domains.'
     
+# Build the incremental httpx input (-domains-probe.txt) from the new domain delta plus the stale hosts, and record when each host was last probed.
+# The probe history is kept in refined/<program>/<program>-httpx-probed.csv. Hosts missing from it count as never probed, so existing programs are caught up over a few runs.
+def storeProbeDomains(programName, refinedBucketPath, programInputBucketPath, staleDays=HTTPX_STALE_DAYS, staleLimit=HTTPX_STALE_LIMIT):
+    now = int(time.time())
+    storePathAll = programInputBucketPath + programName + '/' + programName + '-domains-all.txt'
+    storePathNew = programInputBucketPath + programName + '/' + programName + '-domains-new.txt'
+    storePathProbe = programInputBucketPath + programName + '/' + programName + '-domains-probe.txt'
+    storePathProbed = refinedBucketPath + programName + '/' + programName + '-httpx-probed.csv'
+    try:
+        dfAllDomains = pd.read_csv(storePathAll, header=None, names=['domain'])
+    except:
+        dfAllDomains = pd.DataFrame([], columns=['domain'])
+    try:
+        dfNewDomains = pd.read_csv(storePathNew, header=None, names=['domain'])
+    except:
+        dfNewDomains = pd.DataFrame([], columns=['domain'])
+    try:
+        dfProbed = pd.read_csv(storePathProbed)
+    except:
+        dfProbed = pd.DataFrame([], columns=['domain', 'last_probed'])
+    dfAllDomains = dfAllDomains.drop_duplicates()
+    dfAllDomains = dfAllDomains.merge(dfProbed, how='left', on='domain')
+    dfAllDomains['last_probed'] = dfAllDomains['last_probed'].fillna(0).astype(int)
+    isNew = dfAllDomains['domain'].isin(dfNewDomains['domain'])
+    isStale = (~isNew) & (dfAllDomains['last_probed'] < now - staleDays * 24 * 60 * 60)
+    dfStale = dfAllDomains[isStale].sort_values('last_probed').head(staleLimit)
+    isProbe = isNew | dfAllDomains.index.isin(dfStale.index)
+    dfAllDomains[isProbe]['domain'].to_csv(storePathProbe, header=False, index=False, sep='\n')
+    # Record the probe time up front so hosts that no longer respond also wait for the stale interval
+    dfAllDomains.loc[isProbe, 'last_probed'] = now
+    dfAllDomains[['domain', 'last_probed']].to_csv(storePathProbed, index=False)
+    return 'Probing ' + str(int(isNew.sum())) + ' new and ' + str(len(dfStale)) + ' stale domains.'
+
 def storeScopeDomains(programName, refinedBucketPath, lstDomains, programInputBucketPath):
     dfDomains = pd.DataFrame(lstDomains)
     print('Length of scope domains: ' + str(len(dfDomains)))
@@ -5,17 +5,26 @@ import json
 from pandas.io.json import json_normalize
 from urllib.parse import urlparse
 import brevityscope.parser
+import brevityscope.responses
+import brevityscope.urltemplate
 import brevityprogram.dynamodb
+import brevityprogram.cloudranges
 
-def processAmass(programName, refinedBucketPath, programInputBucketPath):
+def processAmass(programName, refinedBucketPath, programInputBucketPath, presentationBucketPath=None):
     filePath = refinedBucketPath + programName + '/' + programName + '-amass-subs.json'
     df = pd.read_json(filePath, lines=True)
     # Expand out the list columns - sources and addresses
     flat_df = df.set_index([c for c in df.columns if c != 'addresses' and c !='sources']).explode('addresses').explode('sources').reset_index()
     flat_df = pd.concat([flat_df, flat_df['addresses'].apply(pd.Series)], axis=1).drop(columns=['addresses'])
     flat_df.rename({'name': 'subdomain'}, axis=1, inplace=True)
+    # Tag each address with the cloud provider, service and region it is hosted in
+    flat_df = brevityprogram.cloudranges.processCloudProvider(flat_df, 'ip')
     storePath = refinedBucketPath + programName + '/' + programName + '-subs-detail.csv'
     flat_df.to_csv(storePath, index=False)
+    # Publish the tagged addresses alongside the httpx dataset so the cloud columns can be queried for hosts that did not respond
+    if presentationBucketPath:
+        presentationPath = presentationBucketPath + 'amass/' + programName + '-amass.json'
+        flat_df.to_json(presentationPath, orient='records', lines=True)
     
     # Generate a list of all of the unique domains while parsing potentially missing child domains
     allDomains = brevityscope.parser.processBulkDomains(flat_df)
@@ -59,19 +68,20 @@ def processHttpx(programName, refinedBucketPath, inputBucketPath, presentationBu
     fileName = programName + '-httpx-' + operationName + '.json'
     presentationFilePath = presentationBucketPath + 'httpx-json/' + fileName
     
-    df = pd.read_json(presentationFilePath, lines=True)
+    df = mergeHttpxShards(programName, refinedBucketPath, inputBucketPath, presentationBucketPath, operationName)
+    if df is None:
+        df = pd.read_json(presentationFilePath, lines=True)
+    
+    # An incremental pass with no new or stale hosts produces an empty httpx output, the merged dataset is left as it is
+    if df.empty or 'url' not in df.columns:
+        print('No httpx results for ' + operationName)
+        return 'Success'
     
     df = processEnrichURLs(programName, df)
+    # Tag each live host with the cloud provider, service and region it is hosted in
+    df = brevityprogram.cloudranges.processCloudProvider(df, 'ip')
     
 #    df['program'] = programName
-    
-    if (operationName == 'initial'):
-        storePathUrl = programInputBucketPath + programName + '/' + programName + '-httpx.csv'
-        df.to_csv(storePathUrl, header=False, index=False, sep='\n')
-    
-        storePathUrl = programInputBucketPath + programName + '/' + programName + '-urls-base.txt'
-        dfUrls = df.drop_duplicates(subset=['url'])
-        dfUrls['url'].to_csv(storePathUrl, header=False, index=False, sep='\n')
 
 #    df['domain'] = df['url'].apply(parseUrlRoot)
 #    df['baseurl'] = df['url'].apply(parseUrlBase)
@@ -79,6 +89,25 @@ def processHttpx(programName, refinedBucketPath, inputBucketPath, presentationBu
     fileOutputNameUrls = programName + '-urls-mod.txt'
     outputPath = presentationBucketPath + 'httpx/' + fileOutputName
     
+    # The initial pass may only have probed the new and stale hosts. The live hosts are kept in their own merged dataset, since the presentation
+    # dataset below also holds the crawl pass rows and the gospider seed list should only hold the live hosts.
+    if (operationName == 'initial'):
+        dfInitial = df
+        initialPath = refinedBucketPath + programName + '/' + programName + '-httpx-initial.json'
+        try:
+            dfInitial = pd.read_json(initialPath, lines=True).append(dfInitial)
+            dfInitial = dfInitial.drop_duplicates(subset=['url'], keep='last')
+        except:
+            print('No earlier initial httpx output')
+        dfInitial.to_json(initialPath, orient='records', lines=True)
+
+        storePathUrl = programInputBucketPath + programName + '/' + programName + '-httpx.csv'
+        dfInitial.to_csv(storePathUrl, header=False, index=False, sep='\n')
+    
+        storePathUrl = programInputBucketPath + programName + '/' + programName + '-urls-base.txt'
+        dfUrls = dfInitial.drop_duplicates(subset=['url'])
+        dfUrls['url'].to_csv(storePathUrl, header=False, index=False, sep='\n')
+
     # Check if there is already output so that it is not overwritten
     try:
         dfInitialHttpx = pd.read_json(outputPath, lines=True)
@@ -93,8 +122,38 @@ def processHttpx(programName, refinedBucketPath, inputBucketPath, presentationBu
         #fileOutputCrawl = programName + '-httpx-crawl.csv'
         storePathUrl = inputBucketPath + 'programs/' + programName + '/' + fileOutputNameUrls
         df['url'].to_csv(storePathUrl, header=False, index=False, sep='\n')
+
+    # Every httpx job adds an index part to the response store, fold them together once the (possibly sharded) pass is processed
+    try:
+        print(brevityscope.responses.compactResponseIndex(programName))
+    except Exception as e:
+        print('Response index not compacted: ' + str(e))
     return 'Success'
 
+# Merge the outputs of a sharded httpx run into the single httpx json file. Returns None when the last run was not sharded.
+# The response files from each shard are already combined since every shard uploads into the same raw responses prefix.
+# The shard outputs sit in refined/<program>/httpx-shards/, outside the httpx json table prefix.
+def mergeHttpxShards(programName, refinedBucketPath, inputBucketPath, presentationBucketPath, operationName):
+    manifestPath = inputBucketPath + 'programs/' + programName + '/httpx-shards/' + programName + '-httpx-' + operationName + '.json'
+    try:
+        shardManifest = pd.read_json(manifestPath, typ='series')
+    except:
+        return None
+    shardCount = int(shardManifest['shards'])
+    if shardCount <= 1:
+        return None
+    lstShards = []
+    for shardIndex in range(shardCount):
+        shardPath = refinedBucketPath + programName + '/httpx-shards/' + programName + '-httpx-' + operationName + '-' + str(shardIndex) + '.json'
+        try:
+            lstShards.append(pd.read_json(shardPath, lines=True))
+        except:
+            print('No httpx output for shard ' + str(shardIndex))
+    df = pd.concat(lstShards, ignore_index=True) if lstShards else pd.DataFrame()
+    presentationFilePath = presentationBucketPath + 'httpx-json/' + programName + '-httpx-' + operationName + '.json'
+    df.to_json(presentationFilePath, orient='records', lines=True)
+    return df
+
 # Duplicate of processCrawl
 def publishUrls(programName, refinedBucketPath, presentationBucketPath):
     from urllib.parse import urlparse
@@ -108,8 +167,7 @@ def publishUrls(programName, refinedBucketPath, presentationBucketPath):
     storePath = refinedBucketPath + programName + '/' + programName + '-spider-urls.csv'
     dfAllDomains.to_csv(storePath, columns=['url', 'domain', 'baseurl'], index=False)
 
-    # Need to add a variable for this
-    presentationPath = 's3://brevity-data/presentation/urls/' + programName + '-urls-info.csv'
+    presentationPath = presentationBucketPath + 'urls/' + programName + '-urls-info.csv'
     dfAllDomains.to_csv(presentationPath, columns=['url','domain','baseurl','program'], index=False)
     return 'URLs successfully published'
 
@@ -218,21 +276,43 @@ def processCrawl(programName, refinedBucketPath, inputBucketPath, presentationBu
 
     # Output URLs that are in-scope
     dfURLsIn = dfAllURLs[(dfAllURLs['scope'] == 'in') | (dfAllURLs['scope'] == 'wild')]
-    dfURLsIn['url'].drop_duplicates().to_csv(storeInPathUrl, header=None, index=False, sep='\n')
+    # Urls that only differ by an id, slug or parameter value share a template, only a few exemplars of each are kept for the httpx crawl pass
+    dfURLsInCollapsed = brevityscope.urltemplate.collapseUrls(dfURLsIn)
+    dfURLsInCollapsed['url'].to_csv(storeInPathUrl, header=None, index=False, sep='\n')
     # This only outputs the base URL so that it can be used for fuzzing
-    dfURLsIn['baseurl'].drop_duplicates().to_csv(storeBasePathUrl, header=None, index=False, sep='\n')
+    brevityscope.urltemplate.collapseUrls(dfURLsIn, 'baseurl')['baseurl'].to_csv(storeBasePathUrl, header=None, index=False, sep='\n')
     
     # Output URLs that are not explicitly out-of-scope
     dfURLsMod = dfAllURLs[dfAllURLs['scope'] != 'out']
-    dfURLsMod['url'].drop_duplicates().to_csv(storeModPathUrl, header=None, index=False, sep='\n')
+    dfURLsModCollapsed = brevityscope.urltemplate.collapseUrls(dfURLsMod)
+    dfURLsModCollapsed['url'].to_csv(storeModPathUrl, header=None, index=False, sep='\n')
     
     # Output metrics within log
     print('Length of all urls: ' + str(len(dfAllURLs)))
-    print('Length of mod urls: ' + str(len(dfURLsMod)))
-    print('Length of in-scope urls: ' + str(len(dfURLsIn)))
+    print('Length of mod urls: ' + str(len(dfURLsMod)) + ', collapsed: ' + str(len(dfURLsModCollapsed)))
+    print('Length of in-scope urls: ' + str(len(dfURLsIn)) + ', collapsed: ' + str(len(dfURLsInCollapsed)))
 
-    # Need to add a variable for this
-    presentationPath = 's3://brevity-data/presentation/urls/' + programName + '-urls-info.csv'
-    dfAllURLs.to_csv(presentationPath, columns=['url','domain','baseurl','program','scope'], index=False)
+    templatePath = presentationBucketPath + 'urls/' + programName + '-url-templates.csv'
+    brevityscope.urltemplate.templateCounts(dfURLsMod).to_csv(templatePath, index=False)
+
+    # Cloud provider of each url host, from the addresses amass resolved (processAmass). Hosts without a resolved address are left empty.
+    dfAllURLs = mergeCloudProvider(programName, refinedBucketPath, dfAllURLs)
+    presentationPath = presentationBucketPath + 'urls/' + programName + '-urls-info.csv'
+    dfAllURLs.to_csv(presentationPath, columns=['url','domain','baseurl','program','scope'] + brevityprogram.cloudranges.CLOUD_COLUMNS, index=False)
     
-    return 'URLs successfully published'
\ No newline at end of file
+    return 'URLs successfully published'
+
+# Add the cloud columns for the domain column from the amass subdomain detail, one row per subdomain (the first address amass reported)
+def mergeCloudProvider(programName, refinedBucketPath, df):
+    df = df.drop(columns=[column for column in brevityprogram.cloudranges.CLOUD_COLUMNS if column in df.columns])
+    try:
+        dfSubs = pd.read_csv(refinedBucketPath + programName + '/' + programName + '-subs-detail.csv', usecols=['subdomain'] + brevityprogram.cloudranges.CLOUD_COLUMNS, dtype=str)
+    except:
+        print('No amass cloud provider detail for ' + programName)
+        dfSubs = pd.DataFrame(columns=['subdomain'] + brevityprogram.cloudranges.CLOUD_COLUMNS)
+    dfSubs['subdomain'] = dfSubs['subdomain'].str.lower()
+    dfSubs = dfSubs.drop_duplicates(subset=['subdomain']).rename(columns={'subdomain': 'domain_key'})
+    df['domain_key'] = df['domain'].str.lower()
+    df = df.merge(dfSubs, on='domain_key', how='left').drop(columns=['domain_key'])
+    df[brevityprogram.cloudranges.CLOUD_COLUMNS] = df[brevityprogram.cloudranges.CLOUD_COLUMNS].fillna('')
+    return df
\ No newline at end of file
@@ -0,0 +1,89 @@
+import gzip, io, os, time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import pandas as pd
+
+# Content-addressed httpx response store, written by the worker agent (brevityoperations.agent.storeResponses)
+#   s3://brevity-raw/store/<program>/bodies/<hh>/<sha256>.gz   - each distinct response body once, gzip compressed
+#   s3://brevity-raw/store/<program>/index/*.jsonl.gz          - one row per stored response: name, url, hash, size, status, headers, stored
+# A later row for the same name replaces the earlier one. compactResponseIndex folds the parts together so the workers and readers only load a few objects.
+# Analysis that only needs the content (keyword matching, secrets, nuclei passive templates) can run over the unique bodies and map matches back through the index.
+
+RESPONSE_STORE_BUCKET = 'brevity-raw'
+RESPONSE_STORE_PREFIX = 'store/'
+RESPONSE_INDEX_PARTS = 8
+RESPONSE_INDEX_COLUMNS = ['name', 'url', 'hash', 'size', 'status', 'headers', 'stored']
+
+def _storePrefix(programName):
+    return RESPONSE_STORE_PREFIX + programName + '/'
+
+def bodyKey(programName, bodyHash):
+    return _storePrefix(programName) + 'bodies/' + bodyHash[:2] + '/' + bodyHash + '.gz'
+
+def _indexKeys(programName, bucketName):
+    s3client = boto3.client('s3')
+    lstKeys = []
+    for page in s3client.get_paginator('list_objects_v2').paginate(Bucket=bucketName, Prefix=_storePrefix(programName) + 'index/'):
+        lstKeys += [s3object['Key'] for s3object in page.get('Contents', [])]
+    return lstKeys
+
+def _readIndex(bucketName, lstKeys):
+    s3client = boto3.client('s3')
+    lstParts = []
+    for indexKey in lstKeys:
+        indexBody = s3client.get_object(Bucket=bucketName, Key=indexKey)['Body'].read()
+        lstParts.append(pd.read_json(io.BytesIO(gzip.decompress(indexBody)), lines=True, dtype={'name': str, 'url': str, 'hash': str}))
+    if not lstParts:
+        return pd.DataFrame(columns=RESPONSE_INDEX_COLUMNS)
+    df = pd.concat(lstParts, ignore_index=True)
+    df = df.sort_values('stored', kind='mergesort').drop_duplicates(subset=['name'], keep='last')
+    return df.reset_index(drop=True)
+
+# The current url -> body hash index for a program
+def loadResponseIndex(programName, bucketName=RESPONSE_STORE_BUCKET):
+    return _readIndex(bucketName, _indexKeys(programName, bucketName))
+
+# Merge the index parts into one once there are more than maxParts. Only the parts that were read are removed, so a part written in the meantime is kept.
+def compactResponseIndex(programName, bucketName=RESPONSE_STORE_BUCKET, maxParts=RESPONSE_INDEX_PARTS):
+    lstKeys = _indexKeys(programName, bucketName)
+    if len(lstKeys) <= maxParts:
+        return 'Response index has ' + str(len(lstKeys)) + ' parts'
+    df = _readIndex(bucketName, lstKeys)
+    s3client = boto3.client('s3')
+    indexKey = _storePrefix(programName) + 'index/' + time.strftime('%Y%m%d%H%M%S') + '-compact.jsonl.gz'
+    indexBody = gzip.compress(df.to_json(orient='records', lines=True).encode())
+    s3client.put_object(Bucket=bucketName, Key=indexKey, Body=indexBody)
+    lstDelete = [indexPart for indexPart in lstKeys if indexPart != indexKey]
+    for i in range(0, len(lstDelete), 1000):
+        s3client.delete_objects(Bucket=bucketName, Delete={'Objects': [{'Key': indexPart} for indexPart in lstDelete[i:i + 1000]]})
+    return 'Response index compacted from ' + str(len(lstKeys)) + ' parts, ' + str(len(df)) + ' responses'
+
+# Publish the body hash to response name and url mapping as a csv, written with boto3 so the workers do not need s3fs
+def publishResponseIndex(programName, bucketName, objectKey):
+    dfIndex = loadResponseIndex(programName)[['hash', 'name', 'url']]
+    boto3.client('s3').put_object(Bucket=bucketName, Key=objectKey, Body=dfIndex.to_csv(index=False).encode())
+    return 'Published ' + str(len(dfIndex)) + ' responses to s3://' + bucketName + '/' + objectKey
+
+# One row per distinct body with the number of responses that returned it and an example name
+def uniqueResponses(dfIndex):
+    dfUnique = dfIndex.groupby('hash').agg(size=('size', 'first'), responses=('name', 'count'), name=('name', 'first')).reset_index()
+    return dfUnique.sort_values('responses', ascending=False).reset_index(drop=True)
+
+def getResponseBody(programName, bodyHash, bucketName=RESPONSE_STORE_BUCKET):
+    s3client = boto3.client('s3')
+    return gzip.decompress(s3client.get_object(Bucket=bucketName, Key=bodyKey(programName, bodyHash))['Body'].read())
+
+# Write each distinct body to localPath/<hash> (skipping bodies already there) so file based tools only scan unique content
+def downloadUniqueBodies(programName, localPath, dfIndex=None, bucketName=RESPONSE_STORE_BUCKET):
+    if dfIndex is None:
+        dfIndex = loadResponseIndex(programName, bucketName)
+    os.makedirs(localPath, exist_ok=True)
+    lstHashes = [bodyHash for bodyHash in dfIndex['hash'].unique() if not os.path.exists(os.path.join(localPath, bodyHash))]
+
+    def _download(bodyHash):
+        with open(os.path.join(localPath, bodyHash), 'wb') as bodyFile:
+            bodyFile.write(getResponseBody(programName, bodyHash, bucketName))
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(_download, lstHashes))
+    return len(lstHashes)
@@ -0,0 +1,186 @@
+import argparse, os, re, sqlite3, time, zlib
+from array import array
+from itertools import accumulate
+
+# Inverted index over the stored response bodies on the EC2 /data volume, for keyword searches across every program without rescanning the corpus.
+# Documents are the unique bodies of each program's response store (brevityscope.responses), cached under /data/store/<program>/<hash>.
+# Bodies are split into lowercase [a-z0-9_] tokens. Each update adds a segment of postings, one row per token holding the sorted document ids
+# delta encoded as uint32 and zlib compressed. Searches read a handful of rows from the SQLite B-tree and intersect the lists, and segments are merged once there are more than INDEX_MAX_SEGMENTS.
+#   python3 -m brevityscope.searchindex update --program <program>
+#   python3 -m brevityscope.searchindex search "aws_secret_access_key" [--program <program>] [--verify]
+# The httpx workers do not have the /data volume, so once their responses are stored the update is sent to the index instance (SSM parameter indexInstanceId) with requestIndexUpdate.
+
+INDEX_PATH = '/data/index/responses.db'
+INDEX_STORE_PATH = '/data/store/'
+INDEX_MAX_SEGMENTS = 8
+INDEX_BATCH_DOCS = 5000
+INDEX_TOKEN = re.compile(rb'[A-Za-z0-9_]{2,64}')
+INDEX_LIBRARY_PATH = '/home/ec2-user/security/config/brevity-lib.zip'
+
+def openIndex(indexPath=INDEX_PATH):
+    os.makedirs(os.path.dirname(indexPath), exist_ok=True)
+    connection = sqlite3.connect(indexPath)
+    connection.executescript("""
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE IF NOT EXISTS documents (doc INTEGER PRIMARY KEY, program TEXT, hash TEXT, size INTEGER, UNIQUE(program, hash));
+        CREATE TABLE IF NOT EXISTS urls (doc INTEGER, url TEXT);
+        CREATE INDEX IF NOT EXISTS urls_doc ON urls (doc);
+        CREATE TABLE IF NOT EXISTS segments (segment INTEGER PRIMARY KEY, created INTEGER, documents INTEGER);
+        CREATE TABLE IF NOT EXISTS postings (term TEXT, segment INTEGER, docs BLOB, PRIMARY KEY (term, segment)) WITHOUT ROWID;
+    """)
+    return connection
+
+def encodePostings(lstDocs):
+    return zlib.compress(array('I', [lstDocs[0]] + [doc - previous for previous, doc in zip(lstDocs, lstDocs[1:])]).tobytes())
+
+def decodePostings(blob):
+    deltas = array('I')
+    deltas.frombytes(zlib.decompress(blob))
+    return list(accumulate(deltas))
+
+def tokenize(data):
+    return set([token.lower().decode() for token in INDEX_TOKEN.findall(data)])
+
+# Write one segment for a batch of (doc, body path) pairs. Doc ids only grow, so every posting list in a segment comes after the lists in older segments.
+# The caller commits, together with the documents of the batch.
+def _writeSegment(connection, lstBatch):
+    dictPostings = {}
+    for doc, bodyPath in lstBatch:
+        with open(bodyPath, 'rb') as bodyFile:
+            for token in tokenize(bodyFile.read()):
+                dictPostings.setdefault(token, []).append(doc)
+    cursor = connection.execute('INSERT INTO segments (created, documents) VALUES (?, ?)', (int(time.time()), len(lstBatch)))
+    segment = cursor.lastrowid
+    connection.executemany('INSERT INTO postings (term, segment, docs) VALUES (?, ?, ?)', [(token, segment, encodePostings(lstDocs)) for token, lstDocs in dictPostings.items()])
+    return len(dictPostings)
+
+# Fold every segment into one
+def mergeSegments(connection):
+    lstSegments = [row[0] for row in connection.execute('SELECT segment FROM segments ORDER BY segment')]
+    if len(lstSegments) <= 1:
+        return 0
+    mergedSegment = lstSegments[-1]
+    lstRows = []
+    currentTerm = None
+    lstDocs = []
+    for term, blob in connection.execute('SELECT term, docs FROM postings ORDER BY term, segment'):
+        if term != currentTerm:
+            if currentTerm is not None:
+                lstRows.append((currentTerm, mergedSegment, encodePostings(lstDocs)))
+            currentTerm = term
+            lstDocs = []
+        lstDocs += decodePostings(blob)
+    if currentTerm is not None:
+        lstRows.append((currentTerm, mergedSegment, encodePostings(lstDocs)))
+    documentCount = connection.execute('SELECT SUM(documents) FROM segments').fetchone()[0]
+    connection.execute('DELETE FROM postings')
+    connection.executemany('INSERT INTO postings (term, segment, docs) VALUES (?, ?, ?)', lstRows)
+    connection.execute('DELETE FROM segments WHERE segment != ?', (mergedSegment,))
+    connection.execute('UPDATE segments SET documents = ? WHERE segment = ?', (documentCount, mergedSegment))
+    connection.commit()
+    return len(lstSegments)
+
+# Add the program's new unique bodies to the index and refresh its url attribution from the response store index
+def updateIndex(programName, indexPath=INDEX_PATH, storePath=INDEX_STORE_PATH):
+    import brevityscope.responses
+    dfIndex = brevityscope.responses.loadResponseIndex(programName)
+    bodyPath = os.path.join(storePath, programName)
+    downloadCount = brevityscope.responses.downloadUniqueBodies(programName, bodyPath, dfIndex)
+    connection = openIndex(indexPath)
+    knownHashes = set([row[0] for row in connection.execute('SELECT hash FROM documents WHERE program = ?', (programName,))])
+    dfNew = dfIndex.drop_duplicates(subset=['hash'])
+    dfNew = dfNew[~dfNew['hash'].isin(knownHashes)]
+    # Bodies that failed to download are left out, so they are indexed on a later run instead of being recorded without postings
+    dfNew = dfNew[[os.path.isfile(os.path.join(bodyPath, bodyHash)) for bodyHash in dfNew['hash']]]
+    lstNew = list(dfNew.itertuples())
+    termCount = 0
+    # Each batch of documents is committed in the same transaction as its segment
+    for i in range(0, len(lstNew), INDEX_BATCH_DOCS):
+        lstBatch = []
+        try:
+            for row in lstNew[i:i + INDEX_BATCH_DOCS]:
+                cursor = connection.execute('INSERT INTO documents (program, hash, size) VALUES (?, ?, ?)', (programName, row.hash, int(row.size)))
+                lstBatch.append((cursor.lastrowid, os.path.join(bodyPath, row.hash)))
+            termCount += _writeSegment(connection, lstBatch)
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+    dictDocs = dict(connection.execute('SELECT hash, doc FROM documents WHERE program = ?', (programName,)).fetchall())
+    connection.execute('DELETE FROM urls WHERE doc IN (SELECT doc FROM documents WHERE program = ?)', (programName,))
+    connection.executemany('INSERT INTO urls (doc, url) VALUES (?, ?)', [(dictDocs[row.hash], row.url) for row in dfIndex.itertuples() if row.hash in dictDocs])
+    connection.commit()
+    segmentCount = connection.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+    if segmentCount > INDEX_MAX_SEGMENTS:
+        mergeSegments(connection)
+    connection.close()
+    return {'downloaded': downloadCount, 'indexed': len(lstNew), 'terms': termCount}
+
+# Non-blocking update of the index for a program on the index instance through SSM Run Command. Updates are serialized on the instance with flock.
+def requestIndexUpdate(programName, inputBucketName='brevity-inputs'):
+    import boto3
+    ssmclient = boto3.client('ssm')
+    try:
+        instanceId = ssmclient.get_parameter(Name='indexInstanceId')['Parameter']['Value']
+    except ssmclient.exceptions.ParameterNotFound:
+        return 'No index instance'
+    lstCommands = [
+        f'mkdir -p {os.path.dirname(INDEX_PATH)}',
+        f'aws s3 cp s3://{inputBucketName}/config/brevity-lib.zip {INDEX_LIBRARY_PATH}',
+        f'flock {os.path.dirname(INDEX_PATH)}/.update.lock env PYTHONPATH={INDEX_LIBRARY_PATH} python3 -m brevityscope.searchindex update --program {programName} --index {INDEX_PATH} --store {INDEX_STORE_PATH}'
+    ]
+    response = ssmclient.send_command(InstanceIds=[instanceId], DocumentName='AWS-RunShellScript', Parameters={'commands': lstCommands}, Comment='Brevity index update ' + programName)
+    return response['Command']['CommandId']
+
+# Documents containing every token of the query, smallest posting list first. verify re-reads each candidate body and keeps only exact (case-insensitive) occurrences of the query.
+def searchIndex(query, programName=None, indexPath=INDEX_PATH, verify=False, limit=1000, storePath=INDEX_STORE_PATH):
+    connection = openIndex(indexPath)
+    lstPostings = []
+    for token in tokenize(query.encode()):
+        setDocs = set()
+        for (blob,) in connection.execute('SELECT docs FROM postings WHERE term = ?', (token,)):
+            setDocs.update(decodePostings(blob))
+        lstPostings.append(setDocs)
+    if not lstPostings:
+        return []
+    lstPostings.sort(key=len)
+    setDocs = lstPostings[0].intersection(*lstPostings[1:])
+    lstResults = []
+    for doc in sorted(setDocs):
+        program, bodyHash = connection.execute('SELECT program, hash FROM documents WHERE doc = ?', (doc,)).fetchone()
+        if programName and program != programName:
+            continue
+        if verify:
+            with open(os.path.join(storePath, program, bodyHash), 'rb') as bodyFile:
+                if query.lower().encode() not in bodyFile.read().lower():
+                    continue
+        lstUrls = [row[0] for row in connection.execute('SELECT url FROM urls WHERE doc = ?', (doc,))]
+        lstResults.append({'program': program, 'hash': bodyHash, 'urls': lstUrls})
+        if len(lstResults) >= limit:
+            break
+    connection.close()
+    return lstResults
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity response search index')
+    parser.add_argument('action', choices=['update', 'search', 'merge'])
+    parser.add_argument('query', nargs='?')
+    parser.add_argument('--program')
+    parser.add_argument('--index', default=INDEX_PATH)
+    parser.add_argument('--store', default=INDEX_STORE_PATH)
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--limit', type=int, default=1000)
+    args = parser.parse_args()
+    startTime = time.time()
+    if args.action == 'update':
+        print(updateIndex(args.program, args.index, args.store))
+    elif args.action == 'merge':
+        print('Merged ' + str(mergeSegments(openIndex(args.index))) + ' segments')
+    else:
+        for result in searchIndex(args.query, args.program, args.index, args.verify, args.limit, args.store):
+            for url in result['urls'] or [result['hash']]:
+                print(result['program'] + '\t' + url + '\t' + result['hash'])
+    print('Finished in ' + str(round((time.time() - startTime) * 1000)) + ' ms')
+
+if __name__ == '__main__':
+    main()
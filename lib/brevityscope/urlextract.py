@@ -0,0 +1,94 @@
+import argparse, hashlib, os, re, time
+from array import array
+from multiprocessing import Pool
+
+# Single pass url extraction over the crawl output, replacing the cat | grep -Eo | anew pipelines (two over the whole crawl folder and a third per file).
+# Every crawl file is read once in a process pool and both regexes are applied to it. The per-source urls-simple-<file>.txt listings are written by the workers,
+# and -urls-min.txt and -urls-max.txt are written in crawl file order, unique like anew.
+# With a seen file, the hashes of every max url from earlier runs are kept on disk (8 byte blake2b per url) and the urls never seen before are also written to the new output.
+#   python3 -m brevityscope.urlextract --crawl <folder> --min <file> --max <file> --simple <folder> [--seen <file> --new <file>]
+
+# Same expressions as the grep -Eo pipelines, grep matches line by line so newlines are excluded
+URL_MIN_PATTERN = re.compile(rb'https?://[^/?:&"\n]+')
+URL_MAX_PATTERN = re.compile(rb'https?://[^\]*\n]+')
+URL_CHUNK_SIZE = 16
+
+def _unique(lstValues):
+    return list(dict.fromkeys(lstValues))
+
+def urlHash(url):
+    return int.from_bytes(hashlib.blake2b(url, digest_size=8).digest(), 'little')
+
+def loadSeen(seenPath):
+    seenHashes = array('Q')
+    try:
+        with open(seenPath, 'rb') as seenFile:
+            seenHashes.frombytes(seenFile.read())
+    except FileNotFoundError:
+        pass
+    return set(seenHashes)
+
+def _extractFile(args):
+    filePath, simplePath = args
+    with open(filePath, 'rb') as crawlFile:
+        data = crawlFile.read()
+    lstMin = _unique(URL_MIN_PATTERN.findall(data))
+    lstMax = _unique(URL_MAX_PATTERN.findall(data))
+    if simplePath:
+        with open(os.path.join(simplePath, 'urls-simple-' + os.path.basename(filePath) + '.txt'), 'wb') as simpleFile:
+            simpleFile.writelines([url + b'\n' for url in lstMin])
+    return lstMin, lstMax
+
+def extractUrls(crawlPath, minPath, maxPath, simplePath=None, seenPath=None, newPath=None, processes=None):
+    lstFiles = []
+    if os.path.isdir(crawlPath):
+        lstFiles = sorted([os.path.join(crawlPath, fileName) for fileName in os.listdir(crawlPath) if os.path.isfile(os.path.join(crawlPath, fileName))])
+    if simplePath:
+        os.makedirs(simplePath, exist_ok=True)
+    seenHashes = loadSeen(seenPath) if seenPath else set()
+    setMin = set()
+    setMax = set()
+    newHashes = array('Q')
+    newFile = open(newPath, 'wb') if newPath else None
+    with open(minPath, 'wb') as minFile, open(maxPath, 'wb') as maxFile, Pool(processes) as pool:
+        for lstMin, lstMax in pool.imap(_extractFile, [(filePath, simplePath) for filePath in lstFiles], chunksize=URL_CHUNK_SIZE):
+            for url in lstMin:
+                if url not in setMin:
+                    setMin.add(url)
+                    minFile.write(url + b'\n')
+            for url in lstMax:
+                if url in setMax:
+                    continue
+                setMax.add(url)
+                maxFile.write(url + b'\n')
+                if seenPath:
+                    hashValue = urlHash(url)
+                    if hashValue not in seenHashes:
+                        seenHashes.add(hashValue)
+                        newHashes.append(hashValue)
+                        if newFile:
+                            newFile.write(url + b'\n')
+    if newFile:
+        newFile.close()
+    if seenPath and newHashes:
+        os.makedirs(os.path.dirname(os.path.abspath(seenPath)), exist_ok=True)
+        with open(seenPath, 'ab') as seenFile:
+            seenFile.write(newHashes.tobytes())
+    return {'files': len(lstFiles), 'min': len(setMin), 'max': len(setMax), 'new': len(newHashes)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Brevity crawl url extraction')
+    parser.add_argument('--crawl', required=True, help='Crawl output folder')
+    parser.add_argument('--min', required=True, help='Base urls output, stopping at any parameters')
+    parser.add_argument('--max', required=True, help='Full urls output')
+    parser.add_argument('--simple', help='Folder for the per crawl file base url listings')
+    parser.add_argument('--seen', help='Hashes of the urls from earlier runs')
+    parser.add_argument('--new', help='Full urls not seen in earlier runs')
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+    startTime = time.time()
+    print(extractUrls(args.crawl, args.min, args.max, args.simple, args.seen, args.new, args.processes))
+    print('Finished in ' + str(int(time.time() - startTime)) + ' seconds')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import re
+from urllib.parse import urlsplit, parse_qsl
+
+# URL pattern collapsing for the crawl output. Blog and product type sites produce tens of thousands of urls where only an id, a slug or a parameter value changes.
+# Each url is reduced to a template: the host, the path with numeric, uuid, hash, long id and slug segments replaced by placeholders, and the sorted query keys without values.
+# Numeric, uuid, hash and date segments are always replaced. Long ids and slugs also match ordinary page names (/docs/getting-started-guide), so they are only
+# replaced where the same parent path has at least URL_TEMPLATE_MIN_VALUES distinct segments at that position.
+# Only the first URL_TEMPLATE_EXEMPLARS urls of each template are kept for the httpx crawl pass.
+
+URL_TEMPLATE_EXEMPLARS = 3
+URL_TEMPLATE_MIN_VALUES = 10
+SEGMENT_PATTERNS = [
+    ('{int}', re.compile(r'^\d+$')),
+    ('{uuid}', re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')),
+    ('{hash}', re.compile(r'^[0-9a-fA-F]{16,}$')),
+    ('{date}', re.compile(r'^\d{4}-\d{2}-\d{2}$')),
+    ('{id}', re.compile(r'^(?=[A-Za-z_-]*\d)(?=[0-9_-]*[A-Za-z])[A-Za-z0-9_-]{20,}$')),
+    ('{slug}', re.compile(r'^[a-z0-9]+(?:[-_][a-z0-9]+){2,}$'))
+]
+# Placeholders that need the parent path cardinality check
+CARDINALITY_PLACEHOLDERS = set(['{id}', '{slug}'])
+EXTENSION_PATTERN = re.compile(r'^(.+?)(\.[A-Za-z0-9]{1,5})$')
+
+def _templateSegment(segment):
+    for placeholder, pattern in SEGMENT_PATTERNS:
+        if pattern.match(segment):
+            return placeholder
+    # Keep the extension, 123.html and 124.html share a template
+    extensionMatch = EXTENSION_PATTERN.match(segment)
+    if extensionMatch:
+        for placeholder, pattern in SEGMENT_PATTERNS:
+            if pattern.match(extensionMatch.group(1)):
+                return placeholder + extensionMatch.group(2)
+    return segment
+
+def _isCardinalityPlaceholder(placeholder):
+    return placeholder.split('.', 1)[0] in CARDINALITY_PLACEHOLDERS
+
+def _splitTemplateUrl(urlValue):
+    try:
+        splitUrl = urlsplit(str(urlValue).strip())
+        netloc = splitUrl.netloc.lower()
+    except ValueError:
+        return None
+    queryKeys = sorted(set([key for key, value in parse_qsl(splitUrl.query, keep_blank_values=True)]))
+    return splitUrl.scheme.lower() + '://' + netloc, splitUrl.path.split('/'), queryKeys
+
+def _joinTemplate(prefix, lstSegments, queryKeys):
+    template = prefix + '/'.join(lstSegments)
+    if queryKeys:
+        template += '?' + '&'.join([key + '=' for key in queryKeys])
+    return template
+
+# Template of a single url. Without the other urls of the site only the segments that are always replaced are generalized.
+def urlTemplate(urlValue):
+    splitValue = _splitTemplateUrl(urlValue)
+    if splitValue is None:
+        return str(urlValue)
+    prefix, lstSegments, queryKeys = splitValue
+    lstTemplated = []
+    for segment in lstSegments:
+        placeholder = _templateSegment(segment)
+        lstTemplated.append(segment if _isCardinalityPlaceholder(placeholder) else placeholder)
+    return _joinTemplate(prefix, lstTemplated, queryKeys)
+
+# Templates for a list of urls. The path is templated one position at a time, so the parent of each position already has its own segments generalized.
+def urlTemplates(lstUrls, minValues=URL_TEMPLATE_MIN_VALUES):
+    lstSplit = [_splitTemplateUrl(urlValue) for urlValue in lstUrls]
+    lstTemplated = [[] for splitValue in lstSplit]
+    maxDepth = max([len(splitValue[1]) for splitValue in lstSplit if splitValue is not None] + [0])
+    for depth in range(maxDepth):
+        dictValues = {}
+        lstPending = []
+        for i, splitValue in enumerate(lstSplit):
+            if splitValue is None or depth >= len(splitValue[1]):
+                continue
+            segment = splitValue[1][depth]
+            parentKey = (splitValue[0],) + tuple(lstTemplated[i])
+            dictValues.setdefault(parentKey, set()).add(segment)
+            lstPending.append((i, segment, parentKey))
+        for i, segment, parentKey in lstPending:
+            placeholder = _templateSegment(segment)
+            if _isCardinalityPlaceholder(placeholder) and len(dictValues[parentKey]) < minValues:
+                placeholder = segment
+            lstTemplated[i].append(placeholder)
+    return [str(urlValue) if splitValue is None else _joinTemplate(splitValue[0], lstTemplated[i], splitValue[2]) for i, (urlValue, splitValue) in enumerate(zip(lstUrls, lstSplit))]
+
+# Keep up to exemplars urls per template from a dataframe with a url column (first seen first). Adds the template column.
+def collapseUrls(dfUrls, column='url', exemplars=URL_TEMPLATE_EXEMPLARS):
+    dfUrls = dfUrls.drop_duplicates(subset=[column]).copy()
+    dfUrls['template'] = urlTemplates(dfUrls[column].tolist())
+    return dfUrls.groupby('template', sort=False).head(exemplars)
+
+# Number of urls behind each template, largest first
+def templateCounts(dfUrls, column='url'):
+    dfCounts = dfUrls.drop_duplicates(subset=[column]).copy()
+    dfCounts['template'] = urlTemplates(dfCounts[column].tolist())
+    dfCounts = dfCounts.groupby('template').agg(urls=(column, 'count'), example=(column, 'first')).reset_index()
+    return dfCounts.sort_values('urls', ascending=False)
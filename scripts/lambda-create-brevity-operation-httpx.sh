@@ -6,4 +6,6 @@ cp /home/ec2-user/environment/brevity-infra/lambdas/lambda_function_$LAMBDANAME.
 cd /home/ec2-user/environment/brevity-infra/lambdas/build/$LAMBDANAME
 zip -r ../$LAMBDANAME.zip *
 aws s3 cp /home/ec2-user/environment/brevity-infra/lambdas/build/$LAMBDANAME.zip s3://brevity-deploy/infra/
-aws lambda create-function --function-name $LAMBDANAME --runtime python3.7 --handler lambda_function.lambda_handler --role arn:aws:iam::000017942944:role/brevity-lambda --layers arn:aws:lambda:us-east-1:000017942944:layer:brevity-all:4 --code S3Bucket=brevity-deploy,S3Key=infra/$LAMBDANAME.zip --description 'Creates droplets and runs the provided operation.' --timeout 300 --package-type Zip
\ No newline at end of file
+aws lambda create-function --function-name $LAMBDANAME --runtime python3.7 --handler lambda_function.lambda_handler --role arn:aws:iam::000017942944:role/brevity-lambda --layers arn:aws:lambda:us-east-1:000017942944:layer:brevity-all:4 --code S3Bucket=brevity-deploy,S3Key=infra/$LAMBDANAME.zip --description 'Creates droplets and runs the provided operation.' --timeout 300 --package-type Zip
+# Lease that serializes the worker pool top up across concurrent dispatches (brevityoperations.pool.POOL_LEASE_TABLE), shared by the httpx, crawl, nuclei and pipeline operations
+aws dynamodb create-table --table-name brevity_pool_lease --attribute-definitions AttributeName=lease,AttributeType=S --key-schema AttributeName=lease,KeyType=HASH --billing-mode PAY_PER_REQUEST
@@ -6,4 +6,10 @@ cp /home/ec2-user/environment/brevityrecon/lambdas/lambda_function_$LAMBDANAME.p
 cd /home/ec2-user/environment/brevityrecon/lambdas/build/$LAMBDANAME
 zip -r ../$LAMBDANAME.zip *
 aws s3 cp /home/ec2-user/environment/brevityrecon/lambdas/build/$LAMBDANAME.zip s3://brevity-deploy/infra/
-aws lambda create-function --function-name $LAMBDANAME --runtime python3.7 --handler lambda_function.lambda_handler --role arn:aws:iam::000017942944:role/brevity-lambda --layers arn:aws:lambda:us-east-1:000017942944:layer:brevity-ipinfo:1 --code S3Bucket=brevity-deploy,S3Key=infra/$LAMBDANAME.zip --description 'Performs Route53 DNS processing.' --timeout 300 --package-type Zip
\ No newline at end of file
+aws lambda create-function --function-name $LAMBDANAME --runtime python3.7 --handler lambda_function.lambda_handler --role arn:aws:iam::000017942944:role/brevity-lambda --layers arn:aws:lambda:us-east-1:000017942944:layer:brevity-ipinfo:1 --code S3Bucket=brevity-deploy,S3Key=infra/$LAMBDANAME.zip --description 'Performs Route53 DNS processing.' --timeout 300 --package-type Zip
+# Index the DNS records by ingestion hour, sharded as <hour>#<n> on the query id (brevityprogram.ipinfo.IPINFO_INGESTED_SHARDS), so the DNS dashboard (brevity-operation-ipinfo) queries only the records written since its last run
+aws dynamodb update-table --table-name brevity_ipinfo --attribute-definitions AttributeName=ingested_hour,AttributeType=S AttributeName=ingested,AttributeType=S --global-secondary-index-updates '[{"Create":{"IndexName":"ingested_hour-ingested-index","KeySchema":[{"AttributeName":"ingested_hour","KeyType":"HASH"},{"AttributeName":"ingested","KeyType":"RANGE"}],"Projection":{"ProjectionType":"INCLUDE","NonKeyAttributes":["timestamp","ipinfo_ip","ipinfo_country","ipinfo_org","dns_queryname"]}}}]'
+# Persisted subnet lookups shared across invocations, entries expire through the table TTL on expires
+aws dynamodb create-table --table-name brevity_ipinfo_cache --attribute-definitions AttributeName=subnet,AttributeType=S --key-schema AttributeName=subnet,KeyType=HASH --billing-mode PAY_PER_REQUEST
+aws dynamodb wait table-exists --table-name brevity_ipinfo_cache
+aws dynamodb update-time-to-live --table-name brevity_ipinfo_cache --time-to-live-specification Enabled=true,AttributeName=expires